@@ -5,7 +5,8 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
-from .inference import inference_segmentor, init_segmentor, show_result_pyplot
+from .inference import (SegmentationPredictor, inference_segmentor,
+                        init_segmentor, show_result_pyplot)
 from .test import multi_gpu_test, single_gpu_test
 from .train import get_root_logger, set_random_seed, train_segmentor
 from .export import export_model
@@ -16,6 +17,7 @@ __all__ = [
     'train_segmentor',
     'init_segmentor',
     'inference_segmentor',
+    'SegmentationPredictor',
     'multi_gpu_test',
     'single_gpu_test',
     'show_result_pyplot',
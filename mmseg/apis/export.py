@@ -25,6 +25,8 @@ from mmcv.onnx import register_extra_symbolics
 from onnxoptimizer import optimize
 from torch.onnx.symbolic_helper import _onnx_stable_opsets as available_opsets
 
+from mmseg.core.utils import optimize_for_inference
+
 
 def _convert_batchnorm(module):
     module_output = module
@@ -79,12 +81,52 @@ def _update_input_img(img_list, img_meta_list, update_ori_shape=False):
     return img_list, new_img_meta_list
 
 
+def _get_label_dtype(num_classes, label_dtype=None):
+    if label_dtype is None:
+        label_dtype = 'uint8' if num_classes <= 256 else 'int32'
+    assert label_dtype in ('uint8', 'int32'), f'Unsupported label dtype: {label_dtype}'
+    assert label_dtype != 'uint8' or num_classes <= 256
+
+    return label_dtype
+
+
+def _forward_for_export(forward, img, output_logits, output_confidence, label_dtype):
+    # the segmentor returns the class probabilities in the export mode
+    probs = forward(img)
+    if output_logits:
+        return probs
+
+    confidence, labels = probs.max(dim=1, keepdim=True)
+    labels = labels.to(getattr(torch, label_dtype))
+    if output_confidence:
+        return labels, confidence
+
+    return labels
+
+
 def export_to_onnx(model,
                    fake_inputs,
                    export_name,
                    output_logits=False,
+                   output_confidence=False,
+                   label_dtype='int32',
+                   dynamic_shape=True,
                    opset=11,
                    verbose=False):
+    """Export the segmentor to ONNX.
+
+    The output is either the class probabilities of shape (N, C, H, W) or
+    the labels of shape (N, 1, H, W) and the ``label_dtype`` type, optionally
+    with the top-1 probabilities of the same shape as the second output named
+    'confidence'. The argmax and the cast are a part of the graph, so the
+    labels are C * 4 times smaller than the probabilities for uint8.
+
+    If ``dynamic_shape`` is set, the batch and the spatial axes of the input
+    and the outputs are dynamic. In the slide mode the windows are traced as
+    constants, so only the batch axis is dynamic.
+    """
+
+    assert not (output_logits and output_confidence)
     register_extra_symbolics(opset)
 
     imgs = fake_inputs.pop('imgs')
@@ -95,40 +137,45 @@ def export_to_onnx(model,
     img_list, img_meta_list = _update_input_img(img_list, img_meta_list)
 
     origin_forward = model.forward
-    model.forward = partial(
+    segmentor_forward = partial(
         model.forward,
         img_metas=img_meta_list,
         return_loss=False,
-        output_logits=output_logits,
+        output_logits=True,
         rescale=True
     )
+    model.forward = partial(
+        _forward_for_export,
+        segmentor_forward,
+        output_logits=output_logits,
+        output_confidence=output_confidence,
+        label_dtype=label_dtype
+    )
 
-    if model.test_cfg.mode == 'slide':
-        dynamic_axes = {
-            'input': {0: 'batch'},
-            'output': {1: 'batch'}
-        }
+    output_names = ['output', 'confidence'] if output_confidence else ['output']
+    if not dynamic_shape:
+        dynamic_axes = None
+    elif model.test_cfg.mode == 'slide':
+        dynamic_axes = {name: {0: 'batch'} for name in ['input'] + output_names}
     else:
-        dynamic_axes = {
-            'input': {0: 'batch', 2: 'height', 3: 'width'},
-            'output': {1: 'batch', 2: 'height', 3: 'width'}
-        }
-
-    with torch.no_grad():
-        torch.onnx.export(
-            model,
-            (img_list,),
-            f=export_name,
-            input_names=['input'],
-            output_names=['output'],
-            dynamic_axes=dynamic_axes,
-            export_params=True,
-            verbose=verbose,
-            opset_version=opset,
-            keep_initializers_as_inputs=False,
-        )
-
-    model.forward = origin_forward
+        dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in ['input'] + output_names}
+
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (img_list,),
+                f=export_name,
+                input_names=['input'],
+                output_names=output_names,
+                dynamic_axes=dynamic_axes,
+                export_params=True,
+                verbose=verbose,
+                opset_version=opset,
+                keep_initializers_as_inputs=False,
+            )
+    finally:
+        model.forward = origin_forward
 
 
 def check_onnx_model(export_name):
@@ -234,7 +281,24 @@ def _get_fake_inputs(input_shape, num_classes):
 
 
 def export_model(model, config, output_dir, target='openvino', onnx_opset=11,
-                 input_format='rgb', precision='FP32', output_logits=False):
+                 input_format='rgb', precision='FP32', output_logits=False,
+                 output_confidence=False, label_dtype=None, dynamic_shape=True,
+                 optimize_model=True):
+    """Export the segmentor to ONNX or OpenVINO IR.
+
+    Args:
+        output_logits (bool): Whether to output the class probabilities
+            instead of the labels. Default: False.
+        output_confidence (bool): Whether to output the top-1 probabilities
+            along with the labels. Default: False.
+        label_dtype (str, optional): 'uint8' or 'int32', uint8 if the number
+            of classes allows it if None. Default: None.
+        dynamic_shape (bool): Whether the batch and the spatial axes of the
+            ONNX model are dynamic. The IR has the static shape of the test
+            pipeline, but it is reshapeable with ``IENetwork.reshape()``.
+            Default: True.
+    """
+
     assert onnx_opset in available_opsets
 
     if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)):
@@ -252,6 +316,9 @@ def export_model(model, config, output_dir, target='openvino', onnx_opset=11,
 
     model = _convert_batchnorm(model)
     model.cpu().eval()
+    if optimize_model:
+        # a copy with the folded BN layers is exported, the model is kept intact
+        model = optimize_for_inference(model, input_shape=input_shape, inplace=False)
 
     mmcv.mkdir_or_exist(osp.abspath(output_dir))
     onnx_model_path = osp.join(output_dir, config.get('model_name', 'model') + '.onnx')
@@ -259,6 +326,9 @@ def export_model(model, config, output_dir, target='openvino', onnx_opset=11,
     export_to_onnx(model,
                    fake_inputs,
                    output_logits=output_logits,
+                   output_confidence=output_confidence,
+                   label_dtype=_get_label_dtype(num_classes, label_dtype),
+                   dynamic_shape=dynamic_shape,
                    export_name=onnx_model_path,
                    opset=onnx_opset,
                    verbose=False)
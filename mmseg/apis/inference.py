@@ -1,14 +1,22 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import matplotlib.pyplot as plt
 import mmcv
+import numpy as np
 import torch
 from mmcv.parallel import collate, scatter
 from mmcv.runner import load_checkpoint
 
+from mmseg.core.utils import optimize_for_inference
 from mmseg.datasets.pipelines import Compose
 from mmseg.models import build_segmentor
 
 
-def init_segmentor(config, checkpoint=None, device='cuda:0'):
+def init_segmentor(config, checkpoint=None, device='cuda:0', optimize=False):
     """Initialize a segmentor from config file.
 
     Args:
@@ -18,6 +26,9 @@ def init_segmentor(config, checkpoint=None, device='cuda:0'):
             will not load any weights.
         device (str, optional) CPU/CUDA device option. Default 'cuda:0'.
             Use 'cpu' for loading model on CPU.
+        optimize (bool): Whether to fold the BN layers into the convolutions
+            and remove the dropout layers, see :func:`optimize_for_inference`.
+            Default: False.
     Returns:
         nn.Module: The constructed segmentor.
     """
@@ -36,6 +47,10 @@ def init_segmentor(config, checkpoint=None, device='cuda:0'):
     model.cfg = config  # save the config in the model for convenience
     model.to(device)
     model.eval()
+    if optimize:
+        img_scale = config.data.test.pipeline[1]['img_scale']
+        model = optimize_for_inference(
+            model, input_shape=(1, 3, img_scale[1], img_scale[0]))
     return model
 
 
@@ -76,6 +91,10 @@ def inference_segmentor(model, img):
 
     Returns:
         (list[Tensor]): The segmentation result.
+
+    Note:
+        The test pipeline is built on every call, use
+        :class:`SegmentationPredictor` to predict many images.
     """
     cfg = model.cfg
     device = next(model.parameters()).device  # model device
@@ -98,6 +117,246 @@ def inference_segmentor(model, img):
     return result
 
 
+class SegmentationPredictor:
+    """Batched inference of images with a persistent test pipeline.
+
+    Unlike :func:`inference_segmentor`, the test pipeline is built once. The
+    input is read by a feeder thread, the images are loaded and pre-processed
+    by a thread pool ahead of the model, and the images of the same shape are
+    stacked into batches of up to ``batch_size`` images. The results are
+    returned in the input order.
+
+    A batch is run when it is full, when the input is exhausted, when the
+    oldest image in it has waited longer than ``max_latency`` seconds or when
+    too many images of different shapes are waiting. The latency budget is
+    kept while the input blocks, e.g. when it waits for the next request.
+
+    The thread pool is shut down by :meth:`close`, or on exit if the
+    predictor is used as a context manager.
+
+    Args:
+        model (nn.Module): The loaded segmentor, see :func:`init_segmentor`.
+        batch_size (int): The maximum number of images in a batch. Default: 4.
+        max_latency (float, optional): The maximum time in seconds an image
+            waits for its batch to fill up. Default: None.
+        num_workers (int): The number of the pre-processing threads, the
+            images are pre-processed by the feeder thread if 0. Default: 4.
+        output_logits (bool): Whether to return the softmax probabilities of
+            shape (C, H, W) instead of the label maps. Default: False.
+
+    Example:
+        >>> with SegmentationPredictor(model, batch_size=8) as predictor:
+        ...     seg_maps = predictor(['a.jpg', 'b.jpg'])
+        ...     for seg_map in predictor.predict(image_stream):
+        ...         pass
+    """
+
+    def __init__(self,
+                 model,
+                 batch_size=4,
+                 max_latency=None,
+                 num_workers=4,
+                 output_logits=False):
+        assert batch_size > 0
+
+        self.model = model
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.num_workers = num_workers
+        self.output_logits = output_logits
+
+        self.device = next(model.parameters()).device
+        self.pipeline = Compose([LoadImage()] +
+                                model.cfg.data.test.pipeline[1:])
+        self.executor = ThreadPoolExecutor(num_workers) \
+            if num_workers > 0 else None
+
+        # the images pre-processed ahead and waiting for their batches
+        self.max_prefetch = max(num_workers, 1) + batch_size
+        self.max_pending = 4 * batch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down the pre-processing threads."""
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __call__(self, imgs):
+        """Predict an image or a list of images.
+
+        Args:
+            imgs (str | ndarray | Sequence[str | ndarray]): Image files or
+                loaded images.
+
+        Returns:
+            ndarray | list[ndarray]: The uint8 label map (int64 with more than
+                256 classes) or the logits of each image.
+        """
+
+        if isinstance(imgs, (str, np.ndarray)):
+            return next(self.predict([imgs]))
+
+        return list(self.predict(imgs))
+
+    def predict(self, imgs):
+        """Lazily predict the images of an iterable.
+
+        Args:
+            imgs (Iterable[str | ndarray]): Image files or loaded images.
+
+        Yields:
+            ndarray: The results in the order of ``imgs``.
+        """
+
+        inputs = queue.Queue(maxsize=self.max_prefetch)
+        stop_event = threading.Event()
+        feeder = threading.Thread(
+            target=self._feed,
+            args=(iter(imgs), inputs, stop_event),
+            daemon=True)
+        feeder.start()
+
+        groups = OrderedDict()
+        results = {}
+        num_inputs = 0
+        num_outputs = 0
+        exhausted = False
+
+        try:
+            while not exhausted or groups:
+                if not exhausted:
+                    try:
+                        # wake up when the oldest waiting image is out of time
+                        data, arrival_time, error = inputs.get(
+                            timeout=self._get_timeout(groups))
+                    except queue.Empty:
+                        pass
+                    else:
+                        if error is not None:
+                            raise error
+                        if data is None:
+                            exhausted = True
+                        else:
+                            if isinstance(data, Future):
+                                data = data.result()
+                            group = groups.setdefault(
+                                self._batch_key(data), [])
+                            group.append((num_inputs, data, arrival_time))
+                            num_inputs += 1
+
+                for key in self._ready_groups(groups, exhausted):
+                    group = groups.pop(key)
+                    indices = [index for index, _, _ in group]
+                    batch_results = self._forward(
+                        [data for _, data, _ in group])
+                    results.update(zip(indices, batch_results))
+
+                while num_outputs in results:
+                    yield results.pop(num_outputs)
+                    num_outputs += 1
+        finally:
+            # the consumer may stop early
+            stop_event.set()
+
+    def _feed(self, imgs, inputs, stop_event):
+        try:
+            for img in imgs:
+                item = (self._pre_process(img), time.perf_counter(), None)
+                if not self._put(inputs, item, stop_event):
+                    return
+        except Exception as e:
+            self._put(inputs, (None, None, e), stop_event)
+        else:
+            self._put(inputs, (None, None, None), stop_event)
+
+    @staticmethod
+    def _put(inputs, item, stop_event):
+        while not stop_event.is_set():
+            try:
+                inputs.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _get_timeout(self, groups):
+        if self.max_latency is None or not groups:
+            return None
+
+        oldest_time = min(group[0][2] for group in groups.values())
+        deadline = oldest_time + self.max_latency
+
+        return max(deadline - time.perf_counter(), 0.0)
+
+    def _pre_process(self, img):
+        if self.executor is None:
+            return self.pipeline(dict(img=img))
+
+        return self.executor.submit(self.pipeline, dict(img=img))
+
+    @staticmethod
+    def _batch_key(data):
+        # the images of a batch have to share the shapes of every augmentation
+        img_shapes = tuple(tuple(img.shape) for img in data['img'])
+        return img_shapes, data['img_metas'][0].data['ori_shape']
+
+    def _ready_groups(self, groups, flush):
+        if flush:
+            return list(groups.keys())
+
+        ready = [
+            key for key, group in groups.items()
+            if len(group) >= self.batch_size
+        ]
+        if self.max_latency is not None:
+            now = time.perf_counter()
+            ready += [
+                key for key, group in groups.items()
+                if key not in ready and now - group[0][2] >= self.max_latency
+            ]
+
+        num_pending = sum(
+            len(group) for key, group in groups.items() if key not in ready)
+        if num_pending >= self.max_pending:
+            # run the group of the oldest image
+            oldest_key = min((key for key in groups if key not in ready),
+                             key=lambda key: groups[key][0][0])
+            ready.append(oldest_key)
+
+        return ready
+
+    def _forward(self, batch):
+        data = collate(batch, samples_per_gpu=len(batch))
+        if self.device.type == 'cuda':
+            data = scatter(data, [self.device])[0]
+        else:
+            data['img_metas'] = [i.data[0] for i in data['img_metas']]
+
+        with torch.no_grad():
+            results = self.model(
+                return_loss=False,
+                rescale=True,
+                output_logits=self.output_logits,
+                **data)
+
+        if not self.output_logits:
+            num_classes = getattr(self.model, 'num_classes', 256)
+            if num_classes <= 256:
+                results = [
+                    result.astype(np.uint8, copy=False) for result in results
+                ]
+
+        return results
+
+
 def show_result_pyplot(model,
                        img,
                        result,
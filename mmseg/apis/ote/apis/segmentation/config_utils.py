@@ -85,7 +85,7 @@ def patch_config(config: Config,
 
     if 'evaluation' not in config:
         config.evaluation = ConfigDict()
-    config.evaluation['efficient_test'] = True
+    config.evaluation['pre_eval'] = True
     evaluation_metric = config.evaluation.get('metric')
     if evaluation_metric is not None:
         config.evaluation.save_best = evaluation_metric
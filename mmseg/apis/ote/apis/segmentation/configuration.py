@@ -182,7 +182,33 @@ class OTESegmentationConfig(ConfigurableParameters):
             affects_outcome_of=ModelLifecycle.TRAINING
         )
 
+    @attrs
+    class __OpenVINOParameters(ParameterGroup):
+        header = string_attribute("OpenVINO inference parameters")
+        description = header
+
+        num_requests = configurable_integer(
+            default_value=0,
+            min_value=0,
+            max_value=64,
+            header="Number of inference requests",
+            description="Number of asynchronous inference requests in flight. 0 means the optimal number for "
+                        "the device.",
+            affects_outcome_of=ModelLifecycle.NONE
+        )
+
+        num_streams = configurable_integer(
+            default_value=0,
+            min_value=0,
+            max_value=64,
+            header="Number of inference streams",
+            description="Number of streams executing the inference requests in parallel, e.g. the CPU cores are "
+                        "split between the streams. 0 means the number is selected automatically.",
+            affects_outcome_of=ModelLifecycle.NONE
+        )
+
     learning_parameters = add_parameter_group(__LearningParameters)
     nncf_optimization = add_parameter_group(__NNCFOptimization)
     postprocessing = add_parameter_group(__Postprocessing)
     pot_parameters = add_parameter_group(__POTParameter)
+    openvino_parameters = add_parameter_group(__OpenVINOParameters)
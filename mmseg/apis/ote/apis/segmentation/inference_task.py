@@ -50,6 +50,7 @@ from mmseg.apis.ote.apis.segmentation.config_utils import (patch_config,
                                                            set_hyperparams)
 from mmseg.apis.ote.apis.segmentation.configuration import OTESegmentationConfig
 from mmseg.apis.ote.apis.segmentation.ote_utils import InferenceProgressCallback
+from mmseg.core.utils import optimize_for_inference
 from mmseg.datasets import build_dataloader, build_dataset
 from mmseg.models import build_segmentor
 from mmseg.parallel import MMDataCPU
@@ -95,6 +96,8 @@ class OTESegmentationInferenceTask(IInferenceTask, IExportTask, IEvaluationTask,
 
         # Create and initialize PyTorch model.
         self._model = self._load_model(task_environment.model)
+        self._inference_model = None
+        self._inference_model_key = None
 
         # Extra control variables.
         self._training_work_dir = None
@@ -183,10 +186,11 @@ class OTESegmentationInferenceTask(IInferenceTask, IExportTask, IEvaluationTask,
         def hook(module, input, output):
             time_monitor.on_test_batch_end(None, None)
 
-        pre_hook_handle = self._model.register_forward_pre_hook(pre_hook)
-        hook_handle = self._model.register_forward_hook(hook)
+        model = self._get_inference_model()
+        pre_hook_handle = model.register_forward_pre_hook(pre_hook)
+        hook_handle = model.register_forward_hook(hook)
 
-        self._infer_segmentor(self._model, self._config, dataset,
+        self._infer_segmentor(model, self._config, dataset,
                               save_mask_visualization=not is_evaluation)
 
         pre_hook_handle.remove()
@@ -194,6 +198,33 @@ class OTESegmentationInferenceTask(IInferenceTask, IExportTask, IEvaluationTask,
 
         return dataset
 
+    def _get_inference_model(self) -> torch.nn.Module:
+        """
+        Returns the model to run the inference with
+
+        The BN layers are folded in a copy of the model, so the model can be trained further. The copy is
+        cached until the weights of the model are replaced or updated. The optimization is disabled by setting
+        optimize_for_inference=False in the config.
+
+        :return model: the optimized copy of the model or the model itself
+        """
+
+        if not self._config.get('optimize_for_inference', True):
+            return self._model
+
+        img_scale = self._config.data.test.pipeline[1]['img_scale']
+        input_shape = (1, 3, img_scale[1], img_scale[0])
+        # the version counters of the tensors are bumped by the in-place updates of the weights
+        key = (id(self._model), input_shape,
+               tuple((t.data_ptr(), t._version) for t in self._model.state_dict().values()))
+        if self._inference_model is None or key != self._inference_model_key:
+            # release the stale copy before making a new one
+            self._inference_model = None
+            self._inference_model = optimize_for_inference(self._model, input_shape=input_shape, inplace=False)
+            self._inference_model_key = key
+
+        return self._inference_model
+
     def _add_predictions_to_dataset_item(self, prediction, feature_vector, dataset_item, save_mask_visualization):
         soft_prediction = np.transpose(prediction, axes=(1, 2, 0))
         hard_prediction = create_hard_prediction_from_soft_prediction(
@@ -247,6 +278,7 @@ class OTESegmentationInferenceTask(IInferenceTask, IExportTask, IEvaluationTask,
                                              num_gpus=1,
                                              dist=False,
                                              shuffle=False)
+
         if torch.cuda.is_available():
             eval_model = MMDataParallel(model.cuda(test_config.gpu_ids[0]),
                                         device_ids=test_config.gpu_ids)
@@ -310,6 +342,7 @@ class OTESegmentationInferenceTask(IInferenceTask, IExportTask, IEvaluationTask,
             ctypes.string_at(0)
         else:
             logger.warning("Got unload request, but not on Docker. Only clearing CUDA cache")
+            self._inference_model = None
             torch.cuda.empty_cache()
             logger.warning(f"Done unloading. "
                            f"Torch is still occupying {torch.cuda.memory_allocated()} bytes of GPU memory")
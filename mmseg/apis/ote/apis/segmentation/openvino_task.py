@@ -22,7 +22,7 @@ import sys
 import subprocess  # nosec
 import tempfile
 from addict import Dict as ADDict
-from typing import Any, Dict, Tuple, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, Tuple, Optional, Union
 from zipfile import ZipFile
 
 import numpy as np
@@ -65,6 +65,23 @@ from . import model_wrappers
 logger = logging.getLogger(__name__)
 
 
+def get_plugin_config(device: str, num_streams: int = 0) -> Dict[str, str]:
+    """
+    Plugin configuration that sets the number of the inference streams of the device.
+
+    :param device: Device to run inference on, such as CPU, GPU or MYRIAD.
+    :param num_streams: Number of the streams, 0 selects the number automatically.
+    """
+
+    config = {}
+    for device_name in ('CPU', 'GPU'):
+        if device_name in device:
+            config[f'{device_name}_THROUGHPUT_STREAMS'] = \
+                str(num_streams) if num_streams > 0 else f'{device_name}_THROUGHPUT_AUTO'
+
+    return config
+
+
 class OpenVINOSegmentationInferencer(BaseInferencer):
     def __init__(
         self,
@@ -74,6 +91,7 @@ class OpenVINOSegmentationInferencer(BaseInferencer):
         weight_file: Union[str, bytes, None] = None,
         device: str = "CPU",
         num_requests: int = 1,
+        num_streams: Optional[int] = None,
     ):
         """
         Inferencer implementation for OTESegmentation using OpenVINO backend.
@@ -83,15 +101,23 @@ class OpenVINOSegmentationInferencer(BaseInferencer):
         :param model_file: Path to model to load, `.xml`, `.bin` or `.onnx` file.
         :param device: Device to run inference on, such as CPU, GPU or MYRIAD. Defaults to "CPU".
         :param num_requests: Maximum number of requests that the inferencer can make.
-            Good value is the number of available cores. Defaults to 1.
+            Good value is the number of available cores, 0 selects the optimal number for the device. Defaults to 1.
+        :param num_streams: Number of the inference streams of the device, 0 selects the number automatically.
+            The default configuration of the device is used if None. Defaults to None.
         """
 
-        model_adapter = OpenvinoAdapter(create_core(), model_file, weight_file, device=device, max_num_requests=num_requests)
+        adapter_kwargs = dict(device=device, max_num_requests=num_requests)
+        if num_streams is not None:
+            adapter_kwargs['plugin_config'] = get_plugin_config(device, num_streams)
+        model_adapter = OpenvinoAdapter(create_core(), model_file, weight_file, **adapter_kwargs)
         self.configuration = {**attr.asdict(hparams.postprocessing,
                               filter=lambda attr, value: attr.name not in ['header', 'description', 'type', 'visible_in_ui', 'class_name'])}
         self.model = Model.create_model(hparams.postprocessing.class_name.value, model_adapter, self.configuration, preload=True)
         self.converter = SegmentationToAnnotationConverter(label_schema)
 
+        self._completed_requests = {}
+        self._callback_exceptions = []
+
     def pre_process(self, image: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
         return self.model.preprocess(image)
 
@@ -103,6 +129,77 @@ class OpenVINOSegmentationInferencer(BaseInferencer):
     def forward(self, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
         return self.model.infer_sync(inputs)
 
+    def predict_async(self, images: Iterable[np.ndarray]) -> Iterator[AnnotationSceneEntity]:
+        """
+        Run the inference of the images with all inference requests of the model in flight.
+
+        The images are pre-processed while the previous ones are inferred, and the predictions
+        are post-processed as soon as they are ready, while the next images are inferred.
+
+        If the model API does not support the asynchronous requests, the images are predicted one by one.
+
+        :param images: Images to predict.
+        :return: Iterator over the predictions, in the order of the images.
+        """
+
+        if not self._supports_async():
+            for image in images:
+                yield self.predict(image)
+            return
+
+        # the requests of a previous call that was not run to the end
+        self.model.await_all()
+        self._completed_requests.clear()
+        self._callback_exceptions.clear()
+        self.model.model_adapter.set_callback(self._on_request_completed)
+
+        num_submitted = 0
+        num_yielded = 0
+        for image in images:
+            inputs, metadata = self.pre_process(image)
+            while not self.model.is_ready():
+                self.model.await_any()
+                for prediction in self._pop_completed(num_yielded):
+                    num_yielded += 1
+                    yield prediction
+
+            self.model.infer_async(inputs, (num_submitted, metadata))
+            num_submitted += 1
+
+            for prediction in self._pop_completed(num_yielded):
+                num_yielded += 1
+                yield prediction
+
+        self.model.await_all()
+        for prediction in self._pop_completed(num_yielded):
+            num_yielded += 1
+            yield prediction
+        assert num_yielded == num_submitted
+
+    def _supports_async(self) -> bool:
+        # the completion callbacks are set through the adapter of the model
+        return (hasattr(self.model.model_adapter, 'set_callback') and
+                all(hasattr(self.model, name) for name in ('infer_async', 'is_ready', 'await_any', 'await_all')))
+
+    def _on_request_completed(self, request, callback_args):
+        # the callback is run by the threads of the inference engine, the adapter passes the function to
+        # read the outputs of the request along with the data given to infer_async()
+        try:
+            get_result_fn, (index, metadata) = callback_args
+            self._completed_requests[index] = (get_result_fn(request), metadata)
+        except Exception as e:
+            self._callback_exceptions.append(e)
+
+    def _pop_completed(self, index: int) -> Iterator[AnnotationSceneEntity]:
+        if self._callback_exceptions:
+            raise self._callback_exceptions[0]
+
+        # the requests can be completed out of order
+        while index in self._completed_requests:
+            prediction, metadata = self._completed_requests.pop(index)
+            yield self.post_process(prediction, metadata)
+            index += 1
+
 
 class OTEOpenVinoDataLoader(DataLoader):
     def __init__(self, dataset: DatasetEntity, inferencer: BaseInferencer):
@@ -138,7 +235,9 @@ class OpenVINOSegmentationTask(IDeploymentTask, IInferenceTask, IEvaluationTask,
         return OpenVINOSegmentationInferencer(self.hparams,
                                               self.task_environment.label_schema,
                                               self.model.get_data("openvino.xml"),
-                                              self.model.get_data("openvino.bin"))
+                                              self.model.get_data("openvino.bin"),
+                                              num_requests=self.hparams.openvino_parameters.num_requests,
+                                              num_streams=self.hparams.openvino_parameters.num_streams)
 
     def infer(self,
               dataset: DatasetEntity,
@@ -147,8 +246,8 @@ class OpenVINOSegmentationTask(IDeploymentTask, IInferenceTask, IEvaluationTask,
         if inference_parameters is not None:
             update_progress_callback = inference_parameters.update_progress
         dataset_size = len(dataset)
-        for i, dataset_item in enumerate(dataset, 1):
-            predicted_scene = self.inferencer.predict(dataset_item.numpy)
+        predicted_scenes = self.inferencer.predict_async(dataset_item.numpy for dataset_item in dataset)
+        for i, (dataset_item, predicted_scene) in enumerate(zip(dataset, predicted_scenes), 1):
             dataset_item.append_annotations(predicted_scene.annotations)
             update_progress_callback(int(i / dataset_size * 100))
         return dataset
@@ -195,15 +195,22 @@ class OTEDataset(CustomDataset):
 
         return ann_info
 
+    def get_gt_seg_map_by_idx(self, idx):
+        """Get one ground truth segmentation map for evaluation."""
+
+        ann_info = self.get_ann_info(idx)
+
+        return ann_info['gt_semantic_seg']
+
     def get_gt_seg_maps(self, efficient_test=False):
-        """Get ground truth segmentation maps for evaluation."""
+        """Get ground truth segmentation maps for evaluation.
 
-        gt_seg_maps = []
-        for item_id in range(len(self)):
-            ann_info = self.get_ann_info(item_id)
-            gt_seg_maps.append(ann_info['gt_semantic_seg'])
+        The maps are yielded lazily, see :meth:`iter_gt_seg_maps`. The items
+        of OTE dataset have no annotation files, so ``efficient_test`` is
+        ignored.
+        """
 
-        return gt_seg_maps
+        yield from self.iter_gt_seg_maps()
 
 
 def get_classes_from_annotation(annot_path):
@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import itertools
 import os.path as osp
 import pickle  # nosec
 import shutil
@@ -15,6 +16,7 @@ import numpy as np
 import torch
 import torch.distributed as dist
 from mmcv.image import tensor2imgs
+from mmcv.parallel import is_module_wrapper
 from mmcv.runner import get_dist_info
 
 
@@ -45,7 +47,9 @@ def single_gpu_test(model,
                     efficient_test=False,
                     opacity=0.5,
                     add_gt_borders=True,
-                    output_logits=False):
+                    output_logits=False,
+                    pre_eval=False,
+                    profiler_cfg=None):
     """Test with single GPU.
 
     Args:
@@ -60,16 +64,41 @@ def single_gpu_test(model,
             Default 0.5.
             Must be in (0, 1] range.
         add_gt_borders (bool): Whether show GT borders. Default: True.
+        pre_eval (bool): Whether to reduce each batch to confusion matrix
+            counts against its ground truth right away instead of keeping the
+            predictions. Default: False.
+        profiler_cfg (dict, optional): If set, the modules of the model are
+            profiled during the test, see :meth:`BaseSegmentor.profile`.
+            ``sort_by`` and ``max_rows`` configure the printed report.
+            Default: None.
     Returns:
-        list: The prediction results.
+        list | ConfusionMatrixAccumulator: The prediction results, or the
+            accumulated confusion matrix if ``pre_eval`` is set.
     """
 
+    assert not (efficient_test and pre_eval), \
+        '"efficient_test" and "pre_eval" cannot be both set'
+
     model.eval()
 
-    results = []
+    profiler = None
+    if profiler_cfg is not None:
+        profiler_cfg = dict(profiler_cfg)
+        report_cfg = dict(sort_by=profiler_cfg.pop('sort_by', 'cpu_time'),
+                          max_rows=profiler_cfg.pop('max_rows', None))
+        segmentor = model.module if is_module_wrapper(model) else model
+        profiler = segmentor.profile(**profiler_cfg)
+        profiler.attach()
+
     dataset = data_loader.dataset
+    results = dataset.pre_eval([], []) if pre_eval else []
+    # the batch sampler yields the dataset indices of each batch
+    loader_indices = data_loader.batch_sampler
+    if pre_eval and hasattr(dataset, 'prefetch_gt_seg_maps'):
+        # the ground truth of the next batches is decoded while the model runs
+        dataset.prefetch_gt_seg_maps(itertools.chain.from_iterable(loader_indices))
     progress_bar = mmcv.ProgressBar(len(dataset))
-    for i, data in enumerate(data_loader):
+    for i, (batch_indices, data) in enumerate(zip(loader_indices, data_loader)):
         with torch.no_grad():
             result = model(return_loss=False,
                            output_logits=output_logits,
@@ -109,7 +138,9 @@ def single_gpu_test(model,
                     gt_seg_map=gt_seg_map
                 )
 
-        if isinstance(result, list):
+        if pre_eval:
+            results = dataset.pre_eval(result, list(batch_indices), results)
+        elif isinstance(result, list):
             if efficient_test:
                 result = [np2tmp(_) for _ in result]
             results.extend(result)
@@ -122,6 +153,12 @@ def single_gpu_test(model,
         for _ in range(batch_size):
             progress_bar.update()
 
+    if profiler is not None:
+        profiler.detach()
+        print('\n' + profiler.report(**report_cfg))
+        if profiler.trace_file is not None:
+            profiler.dump_trace()
+
     return results
 
 
@@ -129,7 +166,8 @@ def multi_gpu_test(model,
                    data_loader,
                    tmpdir=None,
                    gpu_collect=False,
-                   efficient_test=False):
+                   efficient_test=False,
+                   pre_eval=False):
     """Test model with multiple gpus.
 
     This method tests model with multiple gpus and collects the results
@@ -146,24 +184,52 @@ def multi_gpu_test(model,
         gpu_collect (bool): Option to use either gpu or cpu to collect results.
         efficient_test (bool): Whether save the results as local numpy files to
             save CPU memory during evaluation. Default: False.
+        pre_eval (bool): Whether to reduce each batch to confusion matrix
+            counts against its ground truth right away. The counts are then
+            all-reduced across ranks instead of collecting the predictions
+            through ``tmpdir`` or gpu. Default: False.
 
     Returns:
-        list: The prediction results.
+        list | ConfusionMatrixAccumulator: The prediction results, or the
+            accumulated confusion matrix if ``pre_eval`` is set.
     """
 
+    assert not (efficient_test and pre_eval), \
+        '"efficient_test" and "pre_eval" cannot be both set'
+
     model.eval()
 
-    results = []
     dataset = data_loader.dataset
+    results = dataset.pre_eval([], []) if pre_eval else []
+    # the batch sampler yields the dataset indices of each batch
+    loader_indices = data_loader.batch_sampler
     rank, world_size = get_dist_info()
+    if pre_eval and hasattr(dataset, 'prefetch_gt_seg_maps'):
+        # the ground truth of the next batches is decoded while the model
+        # runs, the padded samples are skipped as below
+        dataset.prefetch_gt_seg_maps(
+            index for k, index in enumerate(itertools.chain.from_iterable(loader_indices))
+            if rank + k * world_size < len(dataset))
     if rank == 0:
         progress_bar = mmcv.ProgressBar(len(dataset))
 
-    for i, data in enumerate(data_loader):
+    num_processed = 0
+    for batch_indices, data in zip(loader_indices, data_loader):
         with torch.no_grad():
             result = model(return_loss=False, rescale=True, **data)
 
-        if isinstance(result, list):
+        if pre_eval:
+            # the distributed sampler pads the dataset with duplicates to make
+            # it evenly divisible, sample k of this rank is global sample
+            # rank + k * world_size, so the padded ones are skipped
+            preds, indices = [], []
+            for j, (pred, index) in enumerate(zip(result, batch_indices)):
+                if rank + (num_processed + j) * world_size < len(dataset):
+                    preds.append(pred)
+                    indices.append(index)
+            num_processed += len(result)
+            results = dataset.pre_eval(preds, indices, results)
+        elif isinstance(result, list):
             if efficient_test:
                 result = [np2tmp(_) for _ in result]
             results.extend(result)
@@ -178,7 +244,9 @@ def multi_gpu_test(model,
                 progress_bar.update()
 
     # collect results from all ranks
-    if gpu_collect:
+    if pre_eval:
+        results = results.all_reduce()
+    elif gpu_collect:
         results = collect_results_gpu(results, len(dataset))
     else:
         results = collect_results_cpu(results, len(dataset), tmpdir)
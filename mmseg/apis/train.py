@@ -14,12 +14,14 @@ from mmcv.runner import HOOKS, build_optimizer, build_runner
 from mmcv.utils import build_from_cfg
 
 from mmseg.core import (
+    CustomFp16OptimizerHook,
     CustomOptimizerHook,
     DistEvalHook,
     DistEvalPlusBeforeRunHook,
     EvalHook,
     EvalPlusBeforeRunHook,
     IterBasedEMAHook,
+    LogVarsSyncHook,
     load_checkpoint,
 )
 from mmseg.datasets import build_dataloader, build_dataset
@@ -142,9 +144,18 @@ def train_segmentor(model,
     )
 
     # prepare optimizer config
-    if 'type' not in cfg.optimizer_config:
-        optimizer_config = CustomOptimizerHook(**cfg.optimizer_config)
+    fp16_cfg = cfg.get('fp16', None)
+    optimizer_type = cfg.optimizer_config.get('type', 'CustomOptimizerHook')
+    if optimizer_type == 'CustomOptimizerHook':
+        hook_cfg = {k: v for k, v in cfg.optimizer_config.items() if k != 'type'}
+        if fp16_cfg is not None:
+            optimizer_config = CustomFp16OptimizerHook(**hook_cfg, **fp16_cfg)
+        else:
+            optimizer_config = CustomOptimizerHook(**hook_cfg)
     else:
+        if fp16_cfg is not None:
+            warnings.warn(f'The fp16 config is ignored, since the optimizer hook '
+                          f'is set to {optimizer_type}')
         optimizer_config = cfg.optimizer_config
 
     # register EMA hook
@@ -161,6 +172,9 @@ def train_segmentor(model,
         cfg.get('momentum_config', None)
     )
 
+    # the log vars of the model are moved to the host before the logger hooks average them
+    runner.register_hook(LogVarsSyncHook(), priority='LOW')
+
     # register parameters manager hook
     params_manager_cfg = cfg.get('params_config', None)
     if params_manager_cfg is not None:
@@ -12,13 +12,22 @@ from .eval_hooks import (
     EvalHook,
     EvalPlusBeforeRunHook
 )
-from .metrics import eval_metrics, mean_dice, mean_fscore, mean_iou
+from .metrics import (
+    ConfusionMatrixAccumulator,
+    build_label_lut,
+    eval_metrics,
+    mean_dice,
+    mean_fscore,
+    mean_iou
+)
 
 __all__ = [
+    'ConfusionMatrixAccumulator',
     'DistEvalHook',
     'DistEvalPlusBeforeRunHook',
     'EvalHook',
     'EvalPlusBeforeRunHook',
+    'build_label_lut',
     'eval_metrics',
     'get_classes',
     'get_palette',
@@ -22,15 +22,19 @@ class EvalHook(_EvalHook):
             Default: False.
         efficient_test (bool): Whether save the results as local numpy files to
             save CPU memory during evaluation. Default: False.
+        pre_eval (bool): Whether to reduce the predictions to confusion
+            matrix counts during inference, so evaluation memory does not
+            depend on the dataset size. Default: False.
     Returns:
         list: The prediction results.
     """
 
     greater_keys = ['mIoU', 'mAcc', 'aAcc', 'mDice']
 
-    def __init__(self, *args, by_epoch=False, efficient_test=False, **kwargs):
+    def __init__(self, *args, by_epoch=False, efficient_test=False, pre_eval=False, **kwargs):
         super().__init__(*args, by_epoch=by_epoch, **kwargs)
         self.efficient_test = efficient_test
+        self.pre_eval = pre_eval
 
     def _do_evaluate(self, runner):
         """perform evaluation and save ckpt."""
@@ -38,7 +42,8 @@ class EvalHook(_EvalHook):
             return
 
         from mmseg.apis import single_gpu_test
-        results = single_gpu_test(runner.model, self.dataloader, show=False, efficient_test=self.efficient_test)
+        results = single_gpu_test(runner.model, self.dataloader, show=False,
+                                  efficient_test=self.efficient_test, pre_eval=self.pre_eval)
         runner.log_buffer.output['eval_iter_num'] = len(self.dataloader)
         key_score = self.evaluate(runner, results)
         if self.save_best:
@@ -49,7 +54,7 @@ class EvalHook(_EvalHook):
 
         Args:
             runner (:obj:`mmcv.Runner`): The underlined training runner.
-            results (list): Output results.
+            results (list | ConfusionMatrixAccumulator): Output results.
         """
         eval_res = self.dataloader.dataset.evaluate(
             results, logger=runner.logger, **self.eval_kwargs)
@@ -76,15 +81,19 @@ class DistEvalHook(_DistEvalHook):
             Default: False.
         efficient_test (bool): Whether save the results as local numpy files to
             save CPU memory during evaluation. Default: False.
+        pre_eval (bool): Whether to reduce the predictions to confusion
+            matrix counts during inference, so evaluation memory does not
+            depend on the dataset size. Default: False.
     Returns:
         list: The prediction results.
     """
 
     greater_keys = ['mIoU', 'mAcc', 'aAcc', 'mDice']
 
-    def __init__(self, *args, by_epoch=False, efficient_test=False, **kwargs):
+    def __init__(self, *args, by_epoch=False, efficient_test=False, pre_eval=False, **kwargs):
         super().__init__(*args, by_epoch=by_epoch, **kwargs)
         self.efficient_test = efficient_test
+        self.pre_eval = pre_eval
 
     def _do_evaluate(self, runner):
         """perform evaluation and save ckpt."""
@@ -112,7 +121,8 @@ class DistEvalHook(_DistEvalHook):
             runner.model,
             self.dataloader,
             tmpdir=tmpdir,
-            gpu_collect=self.gpu_collect
+            gpu_collect=self.gpu_collect,
+            pre_eval=self.pre_eval
         )
 
         if runner.rank == 0:
@@ -134,7 +144,7 @@ class EvalPlusBeforeRunHook(EvalHook):
     def before_run(self, runner):
         super().before_run(runner)
         from mmseg.apis import single_gpu_test
-        results = single_gpu_test(runner.model, self.dataloader, show=False)
+        results = single_gpu_test(runner.model, self.dataloader, show=False, pre_eval=self.pre_eval)
         self.evaluate(runner, results)
 
 
@@ -148,7 +158,8 @@ class DistEvalPlusBeforeRunHook(EvalPlusBeforeRunHook, DistEvalHook):
             runner.model,
             self.dataloader,
             tmpdir=osp.join(runner.work_dir, '.eval_hook'),
-            gpu_collect=self.gpu_collect)
+            gpu_collect=self.gpu_collect,
+            pre_eval=self.pre_eval)
         if runner.rank == 0:
             print('\n')
             self.evaluate(runner, results)
@@ -10,6 +10,7 @@ from collections import OrderedDict
 import mmcv
 import numpy as np
 import torch
+import torch.distributed as dist
 
 
 def f_score(precision, recall, beta=1):
@@ -29,6 +30,244 @@ def f_score(precision, recall, beta=1):
     return score
 
 
+def _load_pred_label(pred_label):
+    """Convert a prediction map or a result filename into a tensor."""
+
+    if isinstance(pred_label, str):
+        pred_label = torch.from_numpy(np.load(pred_label))
+    elif isinstance(pred_label, np.ndarray):
+        pred_label = torch.from_numpy(pred_label)
+
+    return pred_label
+
+
+def _build_reduce_zero_label_lut():
+    lut = np.arange(256, dtype=np.int64) - 1
+    # label 0 is ignored and the ignored label 255 stays ignored
+    lut[0] = 255
+    lut[255] = 255
+
+    return lut.astype(np.uint8)
+
+
+_REDUCE_ZERO_LABEL_LUT = _build_reduce_zero_label_lut()
+
+
+def build_label_lut(label_map=None, reduce_zero_label=False):
+    """Fold ``label_map`` and ``reduce_zero_label`` into a lookup table, so
+    that a uint8 label map is remapped by one ``lut[label]`` gather.
+
+    Args:
+        label_map (dict | np.ndarray, optional): Mapping old labels to new
+            labels, or a lookup table returned by this function. Labels mapped
+            to -1 become 255. Default: None.
+        reduce_zero_label (bool): Whether to apply ``reduce_zero_label`` after
+            ``label_map``. Default: False.
+
+    Returns:
+        np.ndarray | None: uint8 table of 256 entries, or None if the labels
+            are left unchanged.
+    """
+
+    if isinstance(label_map, dict):
+        if len(label_map) > 0:
+            lut = np.arange(256, dtype=np.int64)
+            for old_id, new_id in label_map.items():
+                lut[old_id] = new_id
+            label_lut = (lut % 256).astype(np.uint8)
+        else:
+            label_lut = None
+    else:
+        label_lut = label_map
+
+    if reduce_zero_label:
+        if label_lut is None:
+            label_lut = _REDUCE_ZERO_LABEL_LUT
+        else:
+            label_lut = _REDUCE_ZERO_LABEL_LUT[label_lut]
+
+    return label_lut
+
+
+def _load_label(label, label_lut=None):
+    """Convert a ground truth map or a label filename into an int64 tensor
+    remapped by ``label_lut``."""
+
+    if isinstance(label, str):
+        label = torch.from_numpy(
+            mmcv.imread(label, flag='unchanged', backend='pillow'))
+    elif isinstance(label, np.ndarray):
+        label = torch.from_numpy(label)
+    is_uint8 = label.dtype == torch.uint8
+    label = label.long()
+
+    if label_lut is not None:
+        if is_uint8:
+            label = label_lut[label]
+        else:
+            # labels out of the table are kept as is
+            in_table = (label >= 0) & (label < len(label_lut))
+            label = torch.where(
+                in_table, label_lut[label.clamp(0, len(label_lut) - 1)],
+                label)
+
+    return label
+
+
+class ConfusionMatrixAccumulator:
+    """Streaming confusion matrix for semantic segmentation evaluation.
+
+    The accumulator keeps a single (num_classes, num_classes) matrix, where
+    rows index the ground truth and columns index the prediction. Each call of
+    :meth:`update` adds the counts of a prediction/label pair (or a batch of
+    them) through one ``bincount(label * num_classes + pred)``, so the memory
+    cost of evaluation is O(num_classes ** 2) regardless of the dataset size.
+
+    Args:
+        num_classes (int): Number of categories.
+        ignore_index (int): Index that will be ignored in evaluation.
+            Default: 255.
+        label_map (dict | np.ndarray): Mapping old labels to new labels, or a
+            lookup table returned by :func:`build_label_lut`. Default: dict().
+        reduce_zero_label (bool): Wether ignore zero label. Default: False.
+        device (str | torch.device): Device to keep the matrix on. Inputs are
+            moved to this device before counting. Default: 'cpu'.
+    """
+
+    def __init__(self,
+                 num_classes,
+                 ignore_index=255,
+                 label_map=dict(),
+                 reduce_zero_label=False,
+                 device='cpu'):
+        self.num_classes = num_classes
+        self.ignore_index = ignore_index
+        self.label_map = label_map
+        self.reduce_zero_label = reduce_zero_label
+        label_lut = build_label_lut(label_map, reduce_zero_label)
+        self.label_lut = None if label_lut is None else \
+            torch.from_numpy(label_lut).long()
+        self.confusion_matrix = torch.zeros(
+            (num_classes, num_classes), dtype=torch.int64, device=device)
+
+    def reset(self):
+        """Clear the accumulated counts."""
+        self.confusion_matrix.zero_()
+
+    def update(self, pred_label, label):
+        """Add a prediction/label pair or a batch of them.
+
+        Args:
+            pred_label (ndarray | torch.Tensor | str | list): Prediction
+                segmentation map(s) of any integer dtype, or predict result
+                filename(s).
+            label (ndarray | torch.Tensor | str | list): Ground truth
+                segmentation map(s) of the same shape, or label filename(s).
+
+        Returns:
+            ConfusionMatrixAccumulator: The accumulator itself.
+        """
+
+        if isinstance(pred_label, (list, tuple)):
+            assert len(pred_label) == len(label)
+            for single_pred_label, single_label in zip(pred_label, label):
+                self.update(single_pred_label, single_label)
+            return self
+
+        device = self.confusion_matrix.device
+        pred_label = _load_pred_label(pred_label).to(device).long()
+        label = _load_label(label, self.label_lut).to(device)
+        assert pred_label.shape == label.shape, \
+            f'Shape mismatch: {pred_label.shape} vs {label.shape}'
+
+        n = self.num_classes
+        mask = (label != self.ignore_index) & (label >= 0) & (label < n) & \
+               (pred_label >= 0) & (pred_label < n)
+        inds = label[mask] * n + pred_label[mask]
+        self.confusion_matrix += torch.bincount(
+            inds, minlength=n**2).reshape(n, n)
+
+        return self
+
+    def merge(self, other):
+        """Add the counts of another accumulator or confusion matrix.
+
+        Args:
+            other (ConfusionMatrixAccumulator | torch.Tensor): Source of the
+                counts, e.g. the accumulator of another worker.
+
+        Returns:
+            ConfusionMatrixAccumulator: The accumulator itself.
+        """
+
+        if isinstance(other, ConfusionMatrixAccumulator):
+            other = other.confusion_matrix
+        assert other.shape == self.confusion_matrix.shape
+        self.confusion_matrix += other.to(self.confusion_matrix)
+
+        return self
+
+    def all_reduce(self):
+        """Sum the counts over all ranks of the default process group.
+
+        Does nothing if torch.distributed is not initialized.
+
+        Returns:
+            ConfusionMatrixAccumulator: The accumulator itself.
+        """
+
+        if not (dist.is_available() and dist.is_initialized()):
+            return self
+
+        confusion_matrix = self.confusion_matrix
+        if dist.get_backend() == 'nccl' and not confusion_matrix.is_cuda:
+            confusion_matrix = confusion_matrix.cuda()
+        dist.all_reduce(confusion_matrix)
+        if confusion_matrix is not self.confusion_matrix:
+            self.confusion_matrix.copy_(confusion_matrix)
+
+        return self
+
+    def total_areas(self):
+        """Derive the per-class areas from the confusion matrix.
+
+        Returns:
+            torch.Tensor: The intersection of prediction and ground truth
+                histogram on all classes.
+            torch.Tensor: The union of prediction and ground truth histogram
+                on all classes.
+            torch.Tensor: The prediction histogram on all classes.
+            torch.Tensor: The ground truth histogram on all classes.
+        """
+
+        mat = self.confusion_matrix.cpu().double()
+        area_intersect = torch.diag(mat)
+        area_pred_label = mat.sum(dim=0)
+        area_label = mat.sum(dim=1)
+        area_union = area_pred_label + area_label - area_intersect
+
+        return area_intersect, area_union, area_pred_label, area_label
+
+    def compute(self, metrics=['mIoU'], nan_to_num=None, beta=1):
+        """Calculate evaluation metrics from the accumulated counts.
+
+        Args:
+            metrics (list[str] | str): Metrics to be evaluated, 'mIoU',
+                'mDice' and 'mFscore'.
+            nan_to_num (int, optional): If specified, NaN values will be
+                replaced by the numbers defined by the user. Default: None.
+            beta (int): Determines the weight of recall in the combined score.
+                Default: 1.
+
+        Returns:
+            dict[str, float | ndarray]: Overall accuracy and per category
+                evaluation metrics.
+        """
+
+        return total_area_to_metrics(*self.total_areas(), metrics=metrics,
+                                     nan_to_num=nan_to_num, beta=beta)
+
+
 def intersect_and_union(pred_label,
                         label,
                         num_classes,
@@ -58,36 +297,11 @@ def intersect_and_union(pred_label,
          torch.Tensor: The ground truth histogram on all classes.
     """
 
-    if isinstance(pred_label, str):
-        pred_label = torch.from_numpy(np.load(pred_label))
-    else:
-        pred_label = torch.from_numpy((pred_label))
+    accumulator = ConfusionMatrixAccumulator(
+        num_classes, ignore_index, label_map, reduce_zero_label)
+    accumulator.update(pred_label, label)
 
-    if isinstance(label, str):
-        label = torch.from_numpy(
-            mmcv.imread(label, flag='unchanged', backend='pillow'))
-    else:
-        label = torch.from_numpy(label)
-
-    if label_map is not None:
-        for old_id, new_id in label_map.items():
-            label[label == old_id] = new_id
-    if reduce_zero_label:
-        label[label == 0] = 255
-        label = label - 1
-        label[label == 254] = 255
-
-    mask = (label != ignore_index)
-    pred_label = pred_label[mask]
-    label = label[mask]
-
-    intersect = pred_label[pred_label == label]
-    area_intersect = torch.histc(intersect.float(), bins=num_classes, min=0, max=num_classes - 1)
-    area_pred_label = torch.histc(pred_label.float(), bins=num_classes, min=0, max=num_classes - 1)
-    area_label = torch.histc(label.float(), bins=num_classes, min=0, max=num_classes - 1)
-    area_union = area_pred_label + area_label - area_intersect
-
-    return area_intersect, area_union, area_pred_label, area_label
+    return accumulator.total_areas()
 
 
 def total_intersect_and_union(results,
@@ -119,20 +333,84 @@ def total_intersect_and_union(results,
     num_imgs = len(results)
     assert len(gt_seg_maps) == num_imgs
 
-    total_area_intersect = torch.zeros((num_classes, ), dtype=torch.float64)
-    total_area_union = torch.zeros((num_classes, ), dtype=torch.float64)
-    total_area_pred_label = torch.zeros((num_classes, ), dtype=torch.float64)
-    total_area_label = torch.zeros((num_classes, ), dtype=torch.float64)
+    accumulator = ConfusionMatrixAccumulator(
+        num_classes, ignore_index, label_map, reduce_zero_label)
     for i in range(num_imgs):
-        area_intersect, area_union, area_pred_label, area_label = \
-            intersect_and_union(results[i], gt_seg_maps[i], num_classes,
-                                ignore_index, label_map, reduce_zero_label)
-        total_area_intersect += area_intersect
-        total_area_union += area_union
-        total_area_pred_label += area_pred_label
-        total_area_label += area_label
+        accumulator.update(results[i], gt_seg_maps[i])
+
+    return accumulator.total_areas()
+
+
+def total_area_to_metrics(total_area_intersect,
+                          total_area_union,
+                          total_area_pred_label,
+                          total_area_label,
+                          metrics=['mIoU'],
+                          nan_to_num=None,
+                          beta=1):
+    """Calculate evaluation metrics from the total areas.
+
+    Args:
+        total_area_intersect (torch.Tensor): The intersection of prediction
+            and ground truth histogram on all classes.
+        total_area_union (torch.Tensor): The union of prediction and ground
+            truth histogram on all classes.
+        total_area_pred_label (torch.Tensor): The prediction histogram on all
+            classes.
+        total_area_label (torch.Tensor): The ground truth histogram on all
+            classes.
+        metrics (list[str] | str): Metrics to be evaluated, 'mIoU', 'mDice'
+            and 'mFscore'.
+        nan_to_num (int, optional): If specified, NaN values will be replaced
+            by the numbers defined by the user. Default: None.
+        beta (int): Determines the weight of recall in the combined score.
+            Default: 1.
+
+    Returns:
+        dict[str, float | ndarray]: Overall accuracy and per category
+            evaluation metrics.
+    """
+    if isinstance(metrics, str):
+        metrics = [metrics]
+
+    allowed_metrics = ['mIoU', 'mDice', 'mFscore']
+    if not set(metrics).issubset(set(allowed_metrics)):
+        raise KeyError('metrics {} is not supported'.format(metrics))
 
-    return total_area_intersect, total_area_union, total_area_pred_label, total_area_label
+    all_acc = total_area_intersect.sum() / total_area_label.sum()
+
+    ret_metrics = OrderedDict({'aAcc': all_acc})
+    for metric in metrics:
+        if metric == 'mIoU':
+            iou = total_area_intersect / total_area_union
+            acc = total_area_intersect / total_area_label
+            ret_metrics['IoU'] = iou
+            ret_metrics['Acc'] = acc
+        elif metric == 'mDice':
+            dice = 2 * total_area_intersect / (total_area_pred_label + total_area_label)
+            acc = total_area_intersect / total_area_label
+            ret_metrics['Dice'] = dice
+            ret_metrics['Acc'] = acc
+        elif metric == 'mFscore':
+            precision = total_area_intersect / total_area_pred_label
+            recall = total_area_intersect / total_area_label
+            f_value = f_score(precision, recall, beta)
+            ret_metrics['Fscore'] = f_value
+            ret_metrics['Precision'] = precision
+            ret_metrics['Recall'] = recall
+
+    ret_metrics = {
+        metric: value.numpy()
+        for metric, value in ret_metrics.items()
+    }
+
+    if nan_to_num is not None:
+        ret_metrics = OrderedDict({
+            metric: np.nan_to_num(metric_value, nan=nan_to_num)
+            for metric, metric_value in ret_metrics.items()
+        })
+
+    return ret_metrics
 
 
 def mean_iou(results,
@@ -286,46 +564,9 @@ def eval_metrics(results,
         ndarray: Per category accuracy, shape (num_classes, ).
         ndarray: Per category evaluation metrics, shape (num_classes, ).
     """
-    if isinstance(metrics, str):
-        metrics = [metrics]
+    total_areas = total_intersect_and_union(
+        results, gt_seg_maps, num_classes, ignore_index, label_map,
+        reduce_zero_label)
 
-    allowed_metrics = ['mIoU', 'mDice', 'mFscore']
-    if not set(metrics).issubset(set(allowed_metrics)):
-        raise KeyError('metrics {} is not supported'.format(metrics))
-
-    total_area_intersect, total_area_union, total_area_pred_label, total_area_label = \
-        total_intersect_and_union(results, gt_seg_maps, num_classes, ignore_index, label_map, reduce_zero_label)
-    all_acc = total_area_intersect.sum() / total_area_label.sum()
-
-    ret_metrics = OrderedDict({'aAcc': all_acc})
-    for metric in metrics:
-        if metric == 'mIoU':
-            iou = total_area_intersect / total_area_union
-            acc = total_area_intersect / total_area_label
-            ret_metrics['IoU'] = iou
-            ret_metrics['Acc'] = acc
-        elif metric == 'mDice':
-            dice = 2 * total_area_intersect / (total_area_pred_label + total_area_label)
-            acc = total_area_intersect / total_area_label
-            ret_metrics['Dice'] = dice
-            ret_metrics['Acc'] = acc
-        elif metric == 'mFscore':
-            precision = total_area_intersect / total_area_pred_label
-            recall = total_area_intersect / total_area_label
-            f_value = torch.tensor([f_score(x[0], x[1], beta) for x in zip(precision, recall)])
-            ret_metrics['Fscore'] = f_value
-            ret_metrics['Precision'] = precision
-            ret_metrics['Recall'] = recall
-
-    ret_metrics = {
-        metric: value.numpy()
-        for metric, value in ret_metrics.items()
-    }
-
-    if nan_to_num is not None:
-        ret_metrics = OrderedDict({
-            metric: np.nan_to_num(metric_value, nan=nan_to_num)
-            for metric, metric_value in ret_metrics.items()
-        })
-
-    return ret_metrics
+    return total_area_to_metrics(*total_areas, metrics=metrics,
+                                 nan_to_num=nan_to_num, beta=beta)
@@ -3,9 +3,14 @@
 #
 
 from .ema import IterBasedEMAHook
-from .optimizer import CustomOptimizerHook
+from .log_vars import LogVarsSyncHook
+from .optimizer import CustomFp16OptimizerHook, CustomOptimizerHook
+from .profiler import ModuleProfilerHook
 
 __all__ = [
     'IterBasedEMAHook',
+    'LogVarsSyncHook',
     'CustomOptimizerHook',
+    'CustomFp16OptimizerHook',
+    'ModuleProfilerHook',
 ]
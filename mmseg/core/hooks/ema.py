@@ -2,23 +2,55 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import torch
 from mmcv.runner.hooks import HOOKS, Hook
 from mmcv.parallel.utils import is_module_wrapper
 
+# multi-tensor ops are available in PyTorch >= 1.7.0
+_HAS_FOREACH = hasattr(torch, '_foreach_mul_') and hasattr(torch, '_foreach_add_')
+
 
 @HOOKS.register_module()
 class IterBasedEMAHook(Hook):
+    """Exponential moving average of the model parameters.
+
+    The averages are kept in the ``ema_*`` buffers of the model and updated
+    with multi-tensor (``torch._foreach_*``) ops, so one update launches a
+    few kernels instead of two per parameter. Every ``eval_interval``
+    iterations the parameters and their averages are swapped by exchanging
+    the underlying tensors, and swapped back before the next iteration.
+
+    Args:
+        momentum (float): The momentum of the average. Default: 0.0002.
+        ema_interval (int): Update the average every ``ema_interval``
+            iterations. Default: 1.
+        skip_iters (int): Number of first iterations without the average.
+            Default: 1000.
+        eval_interval (int): Interval of swapping the parameters with their
+            averages for evaluation. Default: 1000.
+        device (str, optional): Device to keep the averages on, e.g. 'cpu' to
+            save the memory of the accelerator. The same device as the
+            parameters if None. Default: None.
+        use_stream (bool): Whether to update the averages on a side CUDA
+            stream. The update is joined before the next iteration starts.
+            Default: False.
+    """
+
     def __init__(self,
                  momentum=0.0002,
                  ema_interval=1,
                  skip_iters=1000,
-                 eval_interval=1000):
+                 eval_interval=1000,
+                 device=None,
+                 use_stream=False):
         assert isinstance(ema_interval, int) and ema_interval > 0
         assert 0 < momentum < 1
 
         self.skip_iters = skip_iters
         self.ema_interval = ema_interval
         self.eval_interval = eval_interval
+        self.device = torch.device(device) if device is not None else None
+        self.use_stream = use_stream
 
         self.buffer_init_mode = True
         self.eval_mode = False
@@ -27,6 +59,10 @@ class IterBasedEMAHook(Hook):
         self.model_buffers = {}
         self.momentum = momentum ** ema_interval
 
+        self._params = []
+        self._ema_buffers = []
+        self._stream = None
+
     def before_run(self, runner):
         model = runner.model
         if is_module_wrapper(model):
@@ -37,10 +73,19 @@ class IterBasedEMAHook(Hook):
             buffer_name = f"ema_{name.replace('.', '_')}"  # "." is not allowed in module's buffer name
 
             self.param_ema_buffer[name] = buffer_name
-            model.register_buffer(buffer_name, value.data.clone())
+            device = self.device if self.device is not None else value.device
+            model.register_buffer(buffer_name, value.data.to(device, copy=True))
         self.model_buffers = dict(model.named_buffers(recurse=True))
 
+        self._params = list(self.model_parameters.values())
+        self._ema_buffers = [self.model_buffers[self.param_ema_buffer[name]] for name in self.model_parameters]
+
+        if self.use_stream and any(p.is_cuda for p in self._params):
+            self._stream = torch.cuda.Stream()
+
     def before_train_iter(self, runner):
+        self._join_stream()
+
         if self.eval_mode:
             self._swap_ema_parameters()
             self.eval_mode = False
@@ -51,26 +96,55 @@ class IterBasedEMAHook(Hook):
             return
 
         if curr_iter % self.ema_interval == 0:
-            for name, parameter in self.model_parameters.items():
-                buffer_name = self.param_ema_buffer[name]
-                buffer_parameter = self.model_buffers[buffer_name]
-
-                if self.buffer_init_mode:
-                    buffer_parameter.copy_(parameter.data)
-                else:
-                    buffer_parameter.mul_(1.0 - self.momentum).add_(parameter.data, alpha=self.momentum)
+            if self._stream is not None:
+                self._stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(self._stream):
+                    self._update_ema_buffers()
+            else:
+                self._update_ema_buffers()
 
             self.buffer_init_mode = False
 
         if curr_iter > 1 and curr_iter % self.eval_interval == 0:
             assert not self.eval_mode
 
+            self._join_stream()
             self._swap_ema_parameters()
             self.eval_mode = True
 
+    @torch.no_grad()
+    def _update_ema_buffers(self):
+        params = self._params
+        if self.device is not None:
+            # the host is not synchronized with a non-blocking copy to the CPU,
+            # so the averages would be updated with partially copied values
+            non_blocking = self.device.type != 'cpu'
+            copies = [p.to(self.device, non_blocking=non_blocking) for p in params]
+            if self._stream is not None:
+                # the copies are released after this call while the side stream may still
+                # read them, so their memory is not reused until the stream is done with it
+                for param, copy in zip(params, copies):
+                    if copy is not param and copy.is_cuda:
+                        copy.record_stream(self._stream)
+            params = copies
+
+        if self.buffer_init_mode:
+            for ema_buffer, param in zip(self._ema_buffers, params):
+                ema_buffer.copy_(param)
+        elif _HAS_FOREACH:
+            torch._foreach_mul_(self._ema_buffers, 1.0 - self.momentum)
+            torch._foreach_add_(self._ema_buffers, params, alpha=self.momentum)
+        else:
+            for ema_buffer, param in zip(self._ema_buffers, params):
+                ema_buffer.mul_(1.0 - self.momentum).add_(param, alpha=self.momentum)
+
+    def _join_stream(self):
+        if self._stream is not None:
+            torch.cuda.current_stream().wait_stream(self._stream)
+
     def _swap_ema_parameters(self):
-        for name, value in self.model_parameters.items():
-            temp = value.data.clone()
-            ema_buffer = self.model_buffers[self.param_ema_buffer[name]]
-            value.data.copy_(ema_buffer.data)
-            ema_buffer.data.copy_(temp)
+        for param, ema_buffer in zip(self._params, self._ema_buffers):
+            param_data = param.data
+            # no copies are made if the averages are kept on the same device
+            param.data = ema_buffer.data.to(param_data.device)
+            ema_buffer.data = param_data.to(ema_buffer.device)
@@ -0,0 +1,65 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import torch
+from mmcv.runner import Hook, HOOKS, LoggerHook
+
+
+def is_logging_iter(runner, logger_hooks):
+    """Whether any of the logger hooks averages the log buffer on the current iteration."""
+
+    for hook in logger_hooks:
+        if hook.by_epoch and hook.every_n_inner_iters(runner, hook.interval):
+            return True
+        elif not hook.by_epoch and hook.every_n_iters(runner, hook.interval):
+            return True
+        elif hook.end_of_epoch(runner) and not hook.ignore_last:
+            return True
+
+    return False
+
+
+def flush_log_buffer(log_buffer):
+    """Replace the tensors of the log buffer with the host values in one transfer."""
+
+    pending = []
+    for values in log_buffer.val_history.values():
+        # the values before the last flush are already on the host
+        start = len(values)
+        while start > 0 and isinstance(values[start - 1], torch.Tensor):
+            start -= 1
+        pending.extend((values, index) for index in range(start, len(values)))
+
+    if len(pending) == 0:
+        return
+
+    host_values = torch.stack([values[index].detach().float().reshape([]) for values, index in pending])
+    for (values, index), value in zip(pending, host_values.cpu().tolist()):
+        values[index] = value
+
+
+@HOOKS.register_module()
+class LogVarsSyncHook(Hook):
+    """Move the log vars of the model to the host on the logging iterations.
+
+    The segmentors return the log vars as detached device tensors, so the
+    training step does not wait for the device. The tensors gathered by the
+    log buffer are copied to the host in one transfer on the iterations the
+    logger hooks average the buffer, and at the end of every epoch.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self._logger_hooks = []
+
+    def before_run(self, runner):
+        self._logger_hooks = [hook for hook in runner.hooks if isinstance(hook, LoggerHook)]
+
+    def after_train_iter(self, runner):
+        if is_logging_iter(runner, self._logger_hooks):
+            flush_log_buffer(runner.log_buffer)
+
+    def after_train_epoch(self, runner):
+        flush_log_buffer(runner.log_buffer)
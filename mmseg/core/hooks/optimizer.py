@@ -2,44 +2,105 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import math
+from collections import OrderedDict
 from typing import Union, Iterable
 
 import torch
 from torch.nn.utils import clip_grad
-from mmcv.runner import Hook, HOOKS
+from mmcv.runner import CheckpointHook, Hook, HOOKS, LoggerHook, wrap_fp16_model
+
+from .log_vars import is_logging_iter
+
+try:
+    # GradScaler is available in PyTorch >= 1.6.0
+    from torch.cuda.amp import GradScaler
+except ImportError:
+    GradScaler = None
+
+# multi-tensor ops are available in PyTorch >= 1.7.0
+_HAS_FOREACH = hasattr(torch, '_foreach_mul_')
 
 _tensor_or_tensors = Union[torch.Tensor, Iterable[torch.Tensor]]
 
 
-def _unit_wise_norm(x):
+def _unit_wise_norm(x, batch_dims=0):
     shape = x.size()
-    if len(shape) <= 1:
+    if len(shape) - batch_dims <= 1:
         norms = torch.abs(x)
     else:
-        sum_dims = tuple(range(1, len(shape)))
+        sum_dims = tuple(range(batch_dims + 1, len(shape)))
         norms = torch.sqrt(torch.sum(x ** 2, dim=sum_dims, keepdim=True))
 
     return norms
 
 
+def _group_by_shape(parameters):
+    groups = OrderedDict()
+    for p in parameters:
+        groups.setdefault((p.shape, p.dtype, p.device), []).append(p)
+
+    return list(groups.values())
+
+
 @HOOKS.register_module()
 class CustomOptimizerHook(Hook):
+    """Optimizer hook with the default or the adaptive gradient clipping.
+
+    The gradient statistics stay on the device and are moved to the host in
+    one transfer on the iterations the logger hooks flush the log buffer, so
+    clipping does not synchronize the device on every iteration.
+
+    Args:
+        grad_clip (dict, optional): Gradient clipping config. ``method`` is
+            'default' (the arguments of ``clip_grad_norm_``) or 'adaptive'
+            (``clip``). Default: None.
+    """
+
+    # whether iterations with non-finite gradients are logged
+    log_nonfinite_grads = True
+
     def __init__(self, grad_clip=None):
         super().__init__()
 
         self.grad_clip = grad_clip
 
+        self._logger_hooks = []
+        self._grad_info_keys = None
+        self._pending_grad_info = []
+
+    def before_run(self, runner):
+        self._logger_hooks = [hook for hook in runner.hooks if isinstance(hook, LoggerHook)]
+
     def after_train_iter(self, runner):
         runner.optimizer.zero_grad()
         runner.outputs['loss'].backward()
 
         if self.grad_clip is not None:
             grad_norm_info = self.clip_grads(runner.model.parameters())
-            if len(grad_norm_info) > 0:
-                runner.log_buffer.update(grad_norm_info, runner.outputs['num_samples'])
+            self._log_grad_info(runner, grad_norm_info)
 
         runner.optimizer.step()
 
+    def _log_grad_info(self, runner, grad_norm_info):
+        if len(grad_norm_info) > 0 and len(self._logger_hooks) > 0:
+            self._grad_info_keys = list(grad_norm_info.keys())
+            values = torch.stack([torch.as_tensor(v, dtype=torch.float32) for v in grad_norm_info.values()])
+            self._pending_grad_info.append((values, runner.outputs['num_samples']))
+
+        if len(self._pending_grad_info) == 0 or not self._is_logging_iter(runner):
+            return
+
+        all_values = torch.stack([values for values, _ in self._pending_grad_info]).cpu().tolist()
+        for values, (_, num_samples) in zip(all_values, self._pending_grad_info):
+            grad_info = dict(zip(self._grad_info_keys, values))
+            if self.log_nonfinite_grads or math.isfinite(grad_info.get('grad_norm', 0.0)):
+                runner.log_buffer.update(grad_info, num_samples)
+        self._pending_grad_info = []
+
+    def _is_logging_iter(self, runner):
+        return is_logging_iter(runner, self._logger_hooks)
+
     def clip_grads(self, params):
         assert self.grad_clip is not None
 
@@ -67,7 +128,7 @@ class CustomOptimizerHook(Hook):
 
         grad_norm = clip_grad.clip_grad_norm_(parameters, **kwargs)
         if grad_norm is not None:
-            out_info['grad_norm'] = float(grad_norm)
+            out_info['grad_norm'] = grad_norm
 
         return out_info
 
@@ -76,14 +137,18 @@ class CustomOptimizerHook(Hook):
         if isinstance(parameters, torch.Tensor):
             parameters = [parameters]
 
-        total_norm = torch.norm(torch.stack([torch.norm(p.grad.detach(), 2) for p in parameters]), 2)
+        all_sq_norms, all_invalid_clip_coef, all_num_invalids = [], [], []
+        total_num_elements, total_num_params = 0, 0
+        with torch.no_grad():
+            # the parameters of the same shape are processed as one batch
+            for group in _group_by_shape(parameters):
+                grads = [p.grad.detach() for p in group]
+                stacked_params = torch.stack([p.detach() for p in group])
+                stacked_grads = torch.stack(grads)
+                all_sq_norms.append(torch.sum(stacked_grads.float() ** 2))
 
-        all_num_invalids, all_invalid_clip_coef = [], []
-        total_num_elements = 0
-        for p in parameters:
-            with torch.no_grad():
-                p_norms = _unit_wise_norm(p)
-                g_norms = _unit_wise_norm(p.grad)
+                p_norms = _unit_wise_norm(stacked_params, batch_dims=1)
+                g_norms = _unit_wise_norm(stacked_grads, batch_dims=1)
 
                 max_p_norms = float(clip) * p_norms.clamp_min(1e-3)
                 max_g_norms = g_norms.clamp_min(1e-6)
@@ -92,17 +157,112 @@ class CustomOptimizerHook(Hook):
                 invalid_mask = g_norms > max_p_norms
                 clip_coef = torch.where(invalid_mask, scales, torch.ones_like(scales))
 
-                num_invalids = torch.sum(invalid_mask).float().item()
-                all_invalid_clip_coef.append(torch.sum(scales[invalid_mask]).float().item() / max(1.0, num_invalids))
-                all_num_invalids.append(num_invalids)
+                num_invalids = invalid_mask.reshape(len(group), -1).sum(dim=1).float()
+                invalid_scales = torch.where(invalid_mask, scales, torch.zeros_like(scales))
+                invalid_scales = invalid_scales.reshape(len(group), -1).sum(dim=1).float()
+                all_invalid_clip_coef.append(torch.sum(invalid_scales / num_invalids.clamp_min(1.0)))
+                all_num_invalids.append(torch.sum(num_invalids))
                 total_num_elements += invalid_mask.nelement()
+                total_num_params += len(group)
 
-            p.grad.detach().mul_(clip_coef)
+                if _HAS_FOREACH:
+                    torch._foreach_mul_(grads, list(clip_coef.unbind(0)))
+                else:
+                    for grad, coef in zip(grads, clip_coef.unbind(0)):
+                        grad.mul_(coef)
 
         out_info = {
-            'invalid_grad_scale': sum(all_invalid_clip_coef) / float(max(1, len(all_invalid_clip_coef))),
+            'invalid_grad_scale': sum(all_invalid_clip_coef) / float(max(1, total_num_params)),
             'invalid_grad_ratio': sum(all_num_invalids) / float(max(1, total_num_elements)),
-            'grad_norm': total_norm.item(),
+            'grad_norm': torch.sqrt(sum(all_sq_norms)),
         }
 
         return out_info
+
+
+@HOOKS.register_module()
+class CustomFp16OptimizerHook(CustomOptimizerHook):
+    """Mixed precision version of :class:`CustomOptimizerHook`.
+
+    The modules with ``fp16_enabled`` run their ``@auto_fp16`` methods (e.g.
+    the forward of the segmentor) in ``torch.cuda.amp.autocast`` and their
+    ``@force_fp32`` methods (e.g. the losses of the decode heads) in fp32. The
+    loss is scaled by a ``GradScaler``, and the gradients are unscaled before
+    they are clipped. Iterations with inf/nan gradients skip the optimizer
+    step and are not logged.
+
+    The state of the scaler is written to ``runner.meta`` only on the
+    iterations the checkpoint hook saves a checkpoint, at the end of every
+    epoch and at the end of the run, since reading the scale synchronizes
+    the device.
+
+    Args:
+        grad_clip (dict, optional): Gradient clipping config, see
+            :class:`CustomOptimizerHook`. Default: None.
+        loss_scale (float | str | dict): Scale factor of the loss. 'dynamic'
+            uses the default dynamic loss scaling, a number sets a static scale
+            and a dict is passed to ``GradScaler``. Default: 'dynamic'.
+    """
+
+    log_nonfinite_grads = False
+
+    def __init__(self, grad_clip=None, loss_scale='dynamic'):
+        super().__init__(grad_clip)
+
+        if GradScaler is None:
+            raise RuntimeError('Mixed precision training requires PyTorch >= 1.6.0')
+
+        if loss_scale == 'dynamic':
+            self.loss_scaler = GradScaler()
+        elif isinstance(loss_scale, (int, float)):
+            self.loss_scaler = GradScaler(init_scale=loss_scale, growth_factor=1, backoff_factor=1)
+        elif isinstance(loss_scale, dict):
+            self.loss_scaler = GradScaler(**loss_scale)
+        else:
+            raise ValueError(f'loss_scale must be of type int, float, dict, or "dynamic", but got {loss_scale}')
+
+    def before_run(self, runner):
+        super().before_run(runner)
+
+        # enables autocast in @auto_fp16 and fp32 in @force_fp32 methods
+        wrap_fp16_model(runner.model)
+
+        # resume the scale of the loss
+        if runner.meta is None:
+            runner.meta = dict()
+        if 'fp16' in runner.meta and 'loss_scaler' in runner.meta['fp16']:
+            self.loss_scaler.load_state_dict(runner.meta['fp16']['loss_scaler'])
+
+    def after_train_iter(self, runner):
+        runner.optimizer.zero_grad()
+        self.loss_scaler.scale(runner.outputs['loss']).backward()
+        self.loss_scaler.unscale_(runner.optimizer)
+
+        if self.grad_clip is not None:
+            grad_norm_info = self.clip_grads(runner.model.parameters())
+            # the step is skipped by the scaler on overflow
+            self._log_grad_info(runner, grad_norm_info)
+
+        self.loss_scaler.step(runner.optimizer)
+        self.loss_scaler.update()
+
+        if self._is_checkpoint_iter(runner):
+            self._save_loss_scaler(runner)
+
+    def after_train_epoch(self, runner):
+        self._save_loss_scaler(runner)
+
+    def after_run(self, runner):
+        self._save_loss_scaler(runner)
+
+    def _is_checkpoint_iter(self, runner):
+        # the hook runs before the checkpoint hook of the same iteration
+        for hook in runner.hooks:
+            if isinstance(hook, CheckpointHook) and not hook.by_epoch:
+                if self.every_n_iters(runner, hook.interval) or self.is_last_iter(runner):
+                    return True
+
+        return False
+
+    def _save_loss_scaler(self, runner):
+        runner.meta.setdefault('fp16', dict())['loss_scaler'] = self.loss_scaler.state_dict()
@@ -0,0 +1,83 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os.path as osp
+
+from mmcv.runner import master_only
+from mmcv.runner.hooks import HOOKS, Hook
+from mmcv.parallel.utils import is_module_wrapper
+
+from ..utils.profiler import ModuleProfiler
+
+
+@HOOKS.register_module()
+class ModuleProfilerHook(Hook):
+    """Profile the modules of the model during a window of training
+    iterations with :class:`ModuleProfiler`.
+
+    The report is logged at the end of the window and the Chrome trace is
+    written to the work directory. In the distributed mode only the master
+    rank is profiled.
+
+    Args:
+        depth (int): The maximum depth of the profiled submodules. Default: 2.
+        start_iter (int): The first profiled iteration. Default: 10.
+        num_iters (int): The number of the profiled iterations. Default: 50.
+        sort_by (str): The statistic to sort the report by.
+            Default: 'cpu_time'.
+        max_rows (int, optional): The maximum number of the reported modules.
+            Default: None.
+        trace_file (str, optional): The name of the trace file in the work
+            directory, no trace is written if None.
+            Default: 'module_profile.json'.
+    """
+
+    def __init__(self,
+                 depth=2,
+                 start_iter=10,
+                 num_iters=50,
+                 sort_by='cpu_time',
+                 max_rows=None,
+                 trace_file='module_profile.json'):
+        assert num_iters > 0
+
+        self.depth = depth
+        self.start_iter = start_iter
+        self.num_iters = num_iters
+        self.sort_by = sort_by
+        self.max_rows = max_rows
+        self.trace_file = trace_file
+
+        self.profiler = None
+
+    @master_only
+    def before_train_iter(self, runner):
+        if runner.iter != self.start_iter:
+            return
+
+        model = runner.model
+        if is_module_wrapper(model):
+            model = model.module
+
+        self.profiler = ModuleProfiler(model, depth=self.depth)
+        self.profiler.attach()
+
+    def after_train_iter(self, runner):
+        if runner.iter + 1 == self.start_iter + self.num_iters:
+            self._finish(runner)
+
+    def after_run(self, runner):
+        self._finish(runner)
+
+    def _finish(self, runner):
+        if self.profiler is None:
+            return
+
+        self.profiler.detach()
+        runner.logger.info(f'Module profile from iteration {self.start_iter + 1}:\n' +
+                           self.profiler.report(self.sort_by, self.max_rows))
+        if self.trace_file is not None:
+            self.profiler.dump_trace(osp.join(runner.work_dir, self.trace_file))
+
+        self.profiler = None
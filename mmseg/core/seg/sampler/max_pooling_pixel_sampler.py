@@ -13,7 +13,68 @@ from ..builder import PIXEL_SAMPLERS
 from .base_pixel_sampler import BasePixelSampler
 
 from ....utils.ext_loader import load_ext
-ext_module = load_ext('_mpl', ['compute_weights'])
+
+# std::numeric_limits<float>::epsilon() of the reference implementation
+_EPS = float(torch.finfo(torch.float32).eps)
+
+
+def max_pooling_weights(sort_losses, ratio, p):
+    """Vectorized Algorithm #1 of the max-pooling loss.
+
+    The reference extension walks the sorted losses serially until the
+    optimality condition holds. Here the condition is evaluated for every
+    position at once from the cumulative sums, and the first position where
+    it holds is the threshold of the pooled losses.
+
+    Args:
+        sort_losses (torch.Tensor): Losses sorted in ascending order, of shape
+            (N, L). Every row is weighted independently, the losses below
+            the float epsilon are not weighted.
+        ratio (float): The ratio of the pooled losses.
+        p (float): The norm of the pooling.
+
+    Returns:
+        torch.Tensor: The weights of the sorted losses, of shape (N, L).
+    """
+
+    num_rows, size = sort_losses.size()
+    indices = torch.arange(size, device=sort_losses.device).view(1, -1)
+
+    nonzero_mask = sort_losses >= _EPS
+    n = nonzero_mask.sum(dim=1, keepdim=True)
+    pos = size - n
+    m = torch.floor(n.to(sort_losses.dtype) * ratio)
+
+    q = p / (p - 1.0)
+    max_losses = sort_losses[:, -1:]
+    losses_q = torch.where(nonzero_mask,
+                           (sort_losses / max_losses.clamp_min(_EPS)).pow(q),
+                           torch.zeros_like(sort_losses))
+    cum_losses_q = losses_q.cumsum(dim=1)
+
+    c = m - n + (indices - pos + 1)
+    eta = c * losses_q - cum_losses_q
+    stop_mask = nonzero_mask & (eta >= _EPS)
+    stop = torch.where(stop_mask, indices, torch.full_like(indices, size)).min(dim=1, keepdim=True)[0]
+
+    found = stop < size
+    safe_stop = stop.clamp_max(size - 1)
+    stop_c = torch.where(found, c.gather(1, safe_stop), m + 1)
+    stop_a = torch.where(found,
+                         cum_losses_q.gather(1, safe_stop) - losses_q.gather(1, safe_stop),
+                         cum_losses_q[:, -1:])
+    alpha = (stop_a / stop_c).pow(1.0 / q) * max_losses
+
+    tau = 1.0 / (n.to(sort_losses.dtype).pow(1.0 / q) * m.pow(1.0 / p))
+    pooled_weights = torch.where(alpha > -_EPS,
+                                 tau * (sort_losses / alpha).pow(q - 1.0),
+                                 torch.zeros_like(sort_losses))
+    weights = torch.where(indices <= stop, pooled_weights, tau.expand_as(sort_losses))
+
+    valid_mask = nonzero_mask & (n > 0) & (m > 0)
+    weights = torch.where(valid_mask, weights, torch.zeros_like(weights))
+
+    return weights
 
 
 @PIXEL_SAMPLERS.register_module()
@@ -21,21 +82,40 @@ class MaxPoolingPixelSampler(BasePixelSampler):
     """Max-Pooling Loss
     Implementation of "Loss Max-Pooling for Semantic Image Segmentation"
     https://arxiv.org/abs/1704.02966
+
+    Args:
+        ratio (float): The ratio of the pooled losses. Default: 0.3.
+        p (float): The norm of the pooling. Default: 1.7.
+        skip_max_ratio (float, optional): Upper bound of the ratio of the
+            largest losses that are randomly skipped. Default: None.
+        per_image (bool): Whether to pool the losses of every image
+            independently instead of the whole batch. Default: False.
+        backend (str): 'tensor' computes the weights with tensor ops on the
+            device of the losses, 'ext' with the reference C++ extension on
+            the CPU. Default: 'tensor'.
     """
 
-    def __init__(self, ratio=0.3, p=1.7, skip_max_ratio=None, **kwargs):
+    def __init__(self, ratio=0.3, p=1.7, skip_max_ratio=None, per_image=False, backend='tensor', **kwargs):
         super().__init__(**kwargs)
 
         assert 0 < ratio <= 1, "ratio should be in range [0, 1]"
         assert p > 1, "p should be > 1"
+        assert backend in ('tensor', 'ext')
+        assert not (per_image and backend == 'ext'), "the extension does not support per_image"
 
         self.ratio = ratio
         self.p = p
+        self.per_image = per_image
+        self.backend = backend
 
         self.skip_max_ratio = skip_max_ratio
         if self.skip_max_ratio is not None:
             assert 0.0 < self.skip_max_ratio < 1.0
 
+        self.ext_module = None
+        if self.backend == 'ext':
+            self.ext_module = load_ext('_mpl', ['compute_weights'])
+
     def _sample(self, losses=None, seg_logit=None, seg_label=None, valid_mask=None):
         assert losses is not None
 
@@ -44,35 +124,59 @@ class MaxPoolingPixelSampler(BasePixelSampler):
                 assert seg_label is not None
                 valid_mask = seg_label != self.ignore_index
 
-            flat_losses = losses.view(-1)
-            valid_losses = flat_losses[valid_mask.view(-1)]
+            if self.backend == 'ext':
+                return self._sample_ext(losses, valid_mask)
+
+            # the ignored pixels are zeroed, so they are not weighted
+            num_rows = losses.size(0) if self.per_image else 1
+            rows = torch.where(valid_mask, losses, torch.zeros_like(losses)).reshape(num_rows, -1)
+            num_valid = valid_mask.reshape(num_rows, -1).sum(dim=1, keepdim=True)
 
             if self.skip_max_ratio is not None:
-                max_skipped = max(1, int(valid_losses.size(0) * self.skip_max_ratio))
-                assert max_skipped < valid_losses.size(0)
-
-                num_skipped = torch.randint(1, max_skipped + 1, [])
-                _sort_losses, _ = valid_losses.sort()
-                ignore_threshold = _sort_losses[-num_skipped]
-                valid_losses = torch.where(valid_losses > ignore_threshold,
-                                           torch.zeros_like(valid_losses),
-                                           valid_losses)
-
-            sort_losses, sort_indices = valid_losses.sort()
-            sort_losses = sort_losses.contiguous()
-            sort_indices = sort_indices.contiguous()
-
-            weights = torch.zeros(sort_losses.size()).contiguous()
-            ext_module.compute_weights(
-                sort_losses.size(0),
-                sort_losses.cpu(),
-                sort_indices.cpu(),
-                weights.cpu(),
-                self.ratio,
-                self.p
-            )
-
-            seg_weight = torch.zeros_like(losses)
-            seg_weight[valid_mask] = float(sort_losses.size(0)) * weights.to(losses.device)
-
-            return seg_weight
+                sort_rows, _ = rows.sort(dim=1)
+                max_skipped = torch.floor(num_valid.float() * self.skip_max_ratio).clamp_min(1.0)
+                num_skipped = torch.floor(torch.rand_like(max_skipped) * max_skipped).long() + 1
+                ignore_threshold = sort_rows.gather(1, (rows.size(1) - num_skipped).clamp_min(0))
+                rows = torch.where(rows > ignore_threshold, torch.zeros_like(rows), rows)
+
+            sort_losses, sort_indices = rows.sort(dim=1)
+            weights = max_pooling_weights(sort_losses, self.ratio, self.p)
+            weights = num_valid.to(weights.dtype) * weights
+
+            seg_weight = torch.zeros_like(rows).scatter_(1, sort_indices, weights)
+
+            return seg_weight.view_as(losses)
+
+    def _sample_ext(self, losses, valid_mask):
+        flat_losses = losses.view(-1)
+        valid_losses = flat_losses[valid_mask.view(-1)]
+
+        if self.skip_max_ratio is not None:
+            max_skipped = max(1, int(valid_losses.size(0) * self.skip_max_ratio))
+            assert max_skipped < valid_losses.size(0)
+
+            num_skipped = torch.randint(1, max_skipped + 1, [])
+            _sort_losses, _ = valid_losses.sort()
+            ignore_threshold = _sort_losses[-num_skipped]
+            valid_losses = torch.where(valid_losses > ignore_threshold,
+                                       torch.zeros_like(valid_losses),
+                                       valid_losses)
+
+        sort_losses, sort_indices = valid_losses.sort()
+        sort_losses = sort_losses.contiguous()
+        sort_indices = sort_indices.contiguous()
+
+        weights = torch.zeros(sort_losses.size()).contiguous()
+        self.ext_module.compute_weights(
+            sort_losses.size(0),
+            sort_losses.cpu(),
+            sort_indices.cpu(),
+            weights,
+            self.ratio,
+            self.p
+        )
+
+        seg_weight = torch.zeros_like(losses)
+        seg_weight[valid_mask] = float(sort_losses.size(0)) * weights.to(losses.device)
+
+        return seg_weight
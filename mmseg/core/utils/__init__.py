@@ -8,9 +8,13 @@
 from .checkpoint import load_state_dict, load_checkpoint
 from .misc import add_prefix
 from .config import propagate_root_dir
+from .profiler import ModuleProfiler
+from .optimize import fuse_conv_bn, optimize_for_inference, revert_sync_batchnorm
 
 __all__ = [
     'load_state_dict', 'load_checkpoint',
     'add_prefix',
     'propagate_root_dir',
+    'ModuleProfiler',
+    'fuse_conv_bn', 'optimize_for_inference', 'revert_sync_batchnorm',
 ]
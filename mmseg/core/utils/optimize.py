@@ -0,0 +1,282 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import copy
+import warnings
+from collections import defaultdict
+
+import torch
+import torch.nn as nn
+from torch.nn.modules.batchnorm import _BatchNorm
+
+_DROPOUT_TYPES = (nn.Dropout, nn.Dropout2d, nn.Dropout3d, nn.AlphaDropout)
+
+
+def revert_sync_batchnorm(module):
+    """Replace the SyncBatchNorm layers of a module with BatchNorm2d ones.
+
+    The running statistics and the affine parameters are shared with the
+    replaced layers.
+    """
+
+    module_output = module
+    if isinstance(module, nn.SyncBatchNorm):
+        module_output = nn.BatchNorm2d(module.num_features, module.eps,
+                                       module.momentum, module.affine,
+                                       module.track_running_stats)
+        if module.affine:
+            module_output.weight.data = module.weight.data.clone().detach()
+            module_output.bias.data = module.bias.data.clone().detach()
+            module_output.weight.requires_grad = module.weight.requires_grad
+            module_output.bias.requires_grad = module.bias.requires_grad
+
+        module_output.running_mean = module.running_mean
+        module_output.running_var = module.running_var
+        module_output.num_batches_tracked = module.num_batches_tracked
+
+    for name, child in module.named_children():
+        module_output.add_module(name, revert_sync_batchnorm(child))
+
+    del module
+
+    return module_output
+
+
+def _get_parent(model, name):
+    parent = model
+    names = name.split('.')
+    for child_name in names[:-1]:
+        parent = getattr(parent, child_name)
+
+    return parent, names[-1]
+
+
+def _run_model(model, img):
+    if hasattr(model, 'forward_dummy'):
+        return model.forward_dummy(img)
+
+    return model(img)
+
+
+def _trace_conv_bn_pairs(model, img):
+    """Run the model and find the BN layers applied to the output of a conv.
+
+    A pair is folded only if every call of the BN layer normalizes the output
+    of the same conv layer, and the outputs of the conv layer are not passed
+    to any other module, except for the ancestors of the BN layer.
+    """
+
+    producers = dict()
+    consumers = defaultdict(list)
+    bn_inputs = defaultdict(list)
+    conv_outputs = defaultdict(list)
+    # the traced tensors are kept alive, so their ids are not reused
+    traced_tensors = []
+
+    def _pre_hook(name):
+        def _hook(module, inputs):
+            for x in inputs:
+                if isinstance(x, torch.Tensor) and id(x) in producers:
+                    consumers[id(x)].append(name)
+            if isinstance(module, _BatchNorm):
+                # the producer is resolved right away, the id of a freed
+                # input can be reused by a later output
+                x = inputs[0]
+                producer = producers.get(id(x)) if isinstance(x, torch.Tensor) else None
+                bn_inputs[name].append(producer)
+
+        return _hook
+
+    def _conv_hook(name):
+        def _hook(module, inputs, output):
+            producers[id(output)] = name
+            conv_outputs[name].append(id(output))
+            traced_tensors.append(output)
+
+        return _hook
+
+    handles = []
+    for name, module in model.named_modules():
+        handles.append(module.register_forward_pre_hook(_pre_hook(name)))
+        if isinstance(module, nn.Conv2d):
+            handles.append(module.register_forward_hook(_conv_hook(name)))
+
+    try:
+        output = _run_model(model, img)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    modules = dict(model.named_modules())
+    pairs = []
+    for bn_name, input_producers in bn_inputs.items():
+        bn = modules[bn_name]
+        if not bn.track_running_stats or bn.running_mean is None:
+            continue
+
+        conv_names = set(input_producers)
+        if len(conv_names) != 1 or None in conv_names:
+            continue
+        conv_name = conv_names.pop()
+        conv = modules[conv_name]
+        if conv.out_channels != bn.num_features or len(conv_outputs[conv_name]) != len(input_producers):
+            continue
+
+        bn_ancestors = set('.'.join(bn_name.split('.')[:i]) for i in range(len(bn_name.split('.'))))
+        other_consumers = [
+            consumer for output_id in conv_outputs[conv_name] for consumer in consumers[output_id]
+            if consumer != bn_name and consumer not in bn_ancestors
+        ]
+        if other_consumers:
+            continue
+
+        pairs.append((conv_name, bn_name))
+
+    return pairs, output
+
+
+def _fold_conv_bn(conv, bn):
+    weight = conv.weight
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    bn_weight = bn.weight if bn.weight is not None else torch.ones_like(bn.running_mean)
+    bn_bias = bn.bias if bn.bias is not None else torch.zeros_like(bn.running_mean)
+
+    factor = bn_weight.float() / torch.sqrt(bn.running_var.float() + bn.eps)
+    new_weight = weight.float() * factor.view(-1, *([1] * (weight.dim() - 1)))
+    new_bias = (bias.float() - bn.running_mean.float()) * factor + bn_bias.float()
+
+    conv.weight = nn.Parameter(new_weight.to(weight.dtype), requires_grad=weight.requires_grad)
+    conv.bias = nn.Parameter(new_bias.to(weight.dtype), requires_grad=weight.requires_grad)
+
+
+def fuse_conv_bn(model, img):
+    """Fold the BN layers into the conv layers they follow.
+
+    The pairs are found by tracing the data flow of the model on ``img``,
+    e.g. the pre-activation BN layers are not folded. The folded BN layers
+    are replaced with ``nn.Identity``.
+
+    Args:
+        model (nn.Module): The model in the eval mode.
+        img (torch.Tensor): An example input of the model.
+
+    Returns:
+        tuple[list, torch.Tensor]: The states to restore the folded layers
+            with :func:`_unfuse_conv_bn` and the output of the original model.
+    """
+
+    pairs, output = _trace_conv_bn_pairs(model, img)
+
+    modules = dict(model.named_modules())
+    folded = []
+    for conv_name, bn_name in pairs:
+        conv = modules[conv_name]
+        folded.append((conv, conv.weight, conv.bias, bn_name, modules[bn_name]))
+
+        _fold_conv_bn(conv, modules[bn_name])
+        parent, attr_name = _get_parent(model, bn_name)
+        setattr(parent, attr_name, nn.Identity())
+
+    return folded, output
+
+
+def _unfuse_conv_bn(model, folded):
+    for conv, weight, bias, bn_name, bn in folded:
+        conv.weight = weight
+        conv.bias = bias
+        parent, attr_name = _get_parent(model, bn_name)
+        setattr(parent, attr_name, bn)
+
+
+def _remove_dropout_and_identity(module):
+    for name, child in list(module.named_children()):
+        if isinstance(child, _DROPOUT_TYPES):
+            setattr(module, name, nn.Identity())
+        else:
+            _remove_dropout_and_identity(child)
+
+    # the identities can only be dropped from the sequential containers
+    if type(module) is nn.Sequential:
+        for name, child in list(module.named_children()):
+            if isinstance(child, nn.Identity):
+                del module._modules[name]
+
+
+def _is_nncf_model(model):
+    return hasattr(model, 'get_nncf_wrapped_model')
+
+
+def optimize_for_inference(model,
+                           input_shape=(1, 3, 256, 256),
+                           fold_bn=True,
+                           remove_dropout=True,
+                           channels_last=False,
+                           verify=True,
+                           rtol=1e-3,
+                           atol=1e-4,
+                           inplace=True):
+    """Optimize a segmentor for the eager inference.
+
+    The SyncBN layers are replaced with BN ones, the BN layers are folded into
+    the preceding conv layers, the dropout layers are replaced with identities
+    and the identities are dropped from the sequential containers. Optionally
+    the weights are converted to the channels-last memory format.
+
+    The output of ``forward_dummy`` on a random input is compared before and
+    after the BN folding. If it differs, the folding is reverted with a
+    warning. The models compressed with NNCF are returned as is.
+
+    Args:
+        model (nn.Module): The segmentor.
+        input_shape (tuple[int]): The shape of the input used to trace and
+            verify the model. Default: (1, 3, 256, 256).
+        fold_bn (bool): Whether to fold the BN layers. Default: True.
+        remove_dropout (bool): Whether to remove the dropout and identity
+            layers. Default: True.
+        channels_last (bool): Whether to convert the model to the
+            channels-last memory format. Default: False.
+        verify (bool): Whether to compare the outputs of the model before and
+            after the BN folding. Default: True.
+        rtol (float): The relative tolerance of the comparison. Default: 1e-3.
+        atol (float): The absolute tolerance of the comparison. Default: 1e-4.
+        inplace (bool): Whether to optimize the model in place or a copy of it.
+            Default: True.
+
+    Returns:
+        nn.Module: The optimized model in the eval mode.
+    """
+
+    if _is_nncf_model(model):
+        # the compressed layers are already fused by NNCF at export
+        return model
+
+    if not inplace:
+        model = copy.deepcopy(model)
+
+    model = revert_sync_batchnorm(model)
+    model.eval()
+
+    param = next(model.parameters())
+    generator = torch.Generator().manual_seed(0)
+    img = torch.rand(input_shape, generator=generator).to(param.device, param.dtype)
+
+    with torch.no_grad():
+        if fold_bn:
+            folded, expected = fuse_conv_bn(model, img)
+            if verify and len(folded) > 0:
+                actual = _run_model(model, img)
+                # the tolerance is relative to the scale of the output
+                max_diff = (actual - expected).abs().max().item()
+                if max_diff > atol + rtol * expected.abs().max().item():
+                    warnings.warn(f'The outputs of the model with the folded BN layers differ by {max_diff}, '
+                                  f'the folding is reverted')
+                    _unfuse_conv_bn(model, folded)
+
+        if remove_dropout:
+            _remove_dropout_and_identity(model)
+
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+
+    return model
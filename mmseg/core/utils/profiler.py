@@ -0,0 +1,264 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+import torch
+
+
+def _tensors_nbytes(outputs):
+    if isinstance(outputs, torch.Tensor):
+        return outputs.numel() * outputs.element_size()
+    elif isinstance(outputs, (list, tuple)):
+        return sum(_tensors_nbytes(x) for x in outputs)
+    elif isinstance(outputs, dict):
+        return sum(_tensors_nbytes(x) for x in outputs.values())
+    else:
+        return 0
+
+
+def _is_on_cuda(module):
+    for tensor in module.parameters():
+        return tensor.is_cuda
+    for tensor in module.buffers():
+        return tensor.is_cuda
+    return torch.cuda.is_available()
+
+
+class ModuleProfiler(object):
+    """Per-module latency and memory profiler.
+
+    Forward pre and post hooks are attached to the submodules up to the
+    given depth (0 is the model itself, 1 are its children, e.g. the backbone
+    and the decode head, 2 are their children, e.g. the backbone stages, and
+    so on). For every module the profiler aggregates the number of calls, the
+    wall time of the host, the device time measured with CUDA events, the
+    size of the output activations and the peak CUDA memory allocated during
+    a call. The CUDA events are resolved lazily, so the profiled model is not
+    synchronized on every call.
+
+    The peak memory of a call is measured against the memory allocated when
+    the call starts, so the peak memory statistics of PyTorch are reset on
+    every profiled call.
+
+    Only the calls through ``module(...)`` are profiled, e.g. a head whose
+    ``forward()`` is called directly is reported through its submodules only.
+    The time of the backward pass is not attributed to the modules.
+
+    Args:
+        model (nn.Module): The model to profile.
+        depth (int): The maximum depth of the profiled submodules. Default: 2.
+        trace_file (str, optional): If set, a Chrome trace of the module calls
+            is written to it by :meth:`dump_trace`. Default: None.
+        max_trace_events (int): The maximum number of the recorded trace
+            events. Default: 100000.
+
+    Example:
+        >>> with ModuleProfiler(model, depth=2) as profiler:
+        ...     model(img)
+        >>> print(profiler.report())
+    """
+
+    def __init__(self, model, depth=2, trace_file=None, max_trace_events=100000):
+        assert depth >= 0
+
+        self.model = model
+        self.depth = depth
+        self.trace_file = trace_file
+        self.max_trace_events = max_trace_events
+
+        self.use_cuda = _is_on_cuda(model)
+        self.stats = OrderedDict()
+        self.trace_events = []
+
+        self._handles = []
+        self._starts = {}
+        self._pending_events = []
+        # the allocated and the peak memory of the enclosing calls
+        self._memory_frames = []
+        self._time_origin = time.perf_counter()
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+    def attach(self):
+        """Attach the hooks to the submodules of the model."""
+
+        assert len(self._handles) == 0, 'The profiler is already attached'
+
+        for name, module in self.model.named_modules():
+            depth = 0 if name == '' else name.count('.') + 1
+            if depth > self.depth:
+                continue
+
+            name = name if name != '' else type(module).__name__
+            self.stats.setdefault(name, dict(
+                name=name,
+                type=type(module).__name__,
+                depth=depth,
+                calls=0,
+                cpu_time=0.0,
+                device_time=0.0,
+                activation_bytes=0,
+                peak_memory_bytes=0,
+            ))
+            self._handles.append(module.register_forward_pre_hook(self._make_pre_hook(name)))
+            self._handles.append(module.register_forward_hook(self._make_post_hook(name)))
+
+    def detach(self):
+        """Remove the hooks and resolve the pending device times."""
+
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._resolve_events(wait=True)
+
+    def _make_pre_hook(self, name):
+        def _pre_hook(module, inputs):
+            start_event = None
+            if self.use_cuda:
+                self._enter_memory_frame()
+                start_event = torch.cuda.Event(enable_timing=True)
+                start_event.record()
+            # a module can be called recursively
+            self._starts.setdefault(name, []).append((time.perf_counter(), start_event))
+
+        return _pre_hook
+
+    def _make_post_hook(self, name):
+        def _post_hook(module, inputs, outputs):
+            start_time, start_event = self._starts[name].pop()
+            end_time = time.perf_counter()
+
+            stats = self.stats[name]
+            stats['calls'] += 1
+            stats['cpu_time'] += end_time - start_time
+            stats['activation_bytes'] += _tensors_nbytes(outputs)
+
+            if start_event is not None:
+                peak_memory_bytes = self._exit_memory_frame()
+                stats['peak_memory_bytes'] = max(stats['peak_memory_bytes'], peak_memory_bytes)
+                end_event = torch.cuda.Event(enable_timing=True)
+                end_event.record()
+                self._pending_events.append((name, start_event, end_event))
+                if len(self._pending_events) > 1024:
+                    self._resolve_events(wait=False)
+
+            if len(self.trace_events) < self.max_trace_events:
+                self.trace_events.append(dict(
+                    name=name,
+                    cat=stats['type'],
+                    ph='X',
+                    ts=(start_time - self._time_origin) * 1e6,
+                    dur=(end_time - start_time) * 1e6,
+                    pid=os.getpid(),
+                    tid=stats['depth'],
+                ))
+
+        return _post_hook
+
+    def _enter_memory_frame(self):
+        # the peak of the enclosing call so far is kept before the reset
+        if self._memory_frames:
+            frame = self._memory_frames[-1]
+            frame[1] = max(frame[1], torch.cuda.max_memory_allocated())
+
+        torch.cuda.reset_peak_memory_stats()
+        allocated = torch.cuda.memory_allocated()
+        self._memory_frames.append([allocated, allocated])
+
+    def _exit_memory_frame(self):
+        start_allocated, peak = self._memory_frames.pop()
+        peak = max(peak, torch.cuda.max_memory_allocated())
+        if self._memory_frames:
+            frame = self._memory_frames[-1]
+            frame[1] = max(frame[1], peak)
+        torch.cuda.reset_peak_memory_stats()
+
+        return peak - start_allocated
+
+    def _resolve_events(self, wait):
+        if wait and self.use_cuda:
+            torch.cuda.synchronize()
+
+        pending_events = []
+        for name, start_event, end_event in self._pending_events:
+            if wait or end_event.query():
+                # elapsed_time() is in milliseconds
+                self.stats[name]['device_time'] += start_event.elapsed_time(end_event) / 1000.0
+            else:
+                pending_events.append((name, start_event, end_event))
+        self._pending_events = pending_events
+
+    def summary(self, sort_by='cpu_time'):
+        """Get the aggregated statistics of the profiled modules.
+
+        Args:
+            sort_by (str): The statistic to sort the modules by in the
+                descending order. Default: 'cpu_time'.
+
+        Returns:
+            list[dict]: The statistics of the modules that were called.
+        """
+
+        self._resolve_events(wait=True)
+
+        stats = [dict(s) for s in self.stats.values() if s['calls'] > 0]
+        stats.sort(key=lambda s: s[sort_by], reverse=True)
+
+        return stats
+
+    def report(self, sort_by='cpu_time', max_rows=None):
+        """Format the statistics as a table.
+
+        Args:
+            sort_by (str): The statistic to sort the modules by.
+                Default: 'cpu_time'.
+            max_rows (int, optional): The maximum number of the reported
+                modules. Default: None.
+
+        Returns:
+            str: The report.
+        """
+
+        stats = self.summary(sort_by)
+        if max_rows is not None:
+            stats = stats[:max_rows]
+
+        name_width = max([len('Module')] + [len(s['name']) for s in stats])
+        header = f'{"Module":<{name_width}} {"Type":<24} {"Calls":>8} {"CPU ms":>12} ' \
+                 f'{"Device ms":>12} {"Activations MB":>15} {"Peak mem MB":>12}'
+        lines = [header, '-' * len(header)]
+        for s in stats:
+            lines.append(
+                f'{s["name"]:<{name_width}} {s["type"][:24]:<24} {s["calls"]:>8d} '
+                f'{s["cpu_time"] * 1000:>12.2f} {s["device_time"] * 1000:>12.2f} '
+                f'{s["activation_bytes"] / 1024 ** 2:>15.2f} '
+                f'{s["peak_memory_bytes"] / 1024 ** 2:>12.2f}'
+            )
+
+        return '\n'.join(lines)
+
+    def dump_trace(self, trace_file=None):
+        """Write the module calls in the Chrome trace format.
+
+        The file can be opened in ``chrome://tracing`` or Perfetto.
+
+        Args:
+            trace_file (str, optional): The output file, ``trace_file`` of
+                the profiler if None.
+        """
+
+        trace_file = trace_file if trace_file is not None else self.trace_file
+        assert trace_file is not None
+
+        with open(trace_file, 'w') as out_file:
+            json.dump(dict(traceEvents=self.trace_events), out_file)
@@ -18,6 +18,7 @@ from .stare import STAREDataset
 from .voc import PascalVOCDataset
 from .kvasir import KvasirDataset
 from .coco_stuff import COCOStuffDataset
+from .packed import PackedDataset
 
 __all__ = [
     'CustomDataset',
@@ -38,4 +39,5 @@ __all__ = [
     'STAREDataset',
     'KvasirDataset',
     'COCOStuffDataset',
+    'PackedDataset',
 ]
@@ -7,8 +7,8 @@
 
 import os
 import os.path as osp
-from collections import OrderedDict
-from functools import reduce
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import mmcv
 import numpy as np
@@ -16,10 +16,11 @@ from mmcv.utils import print_log
 from prettytable import PrettyTable
 from torch.utils.data import Dataset
 
-from mmseg.core import eval_metrics
+from mmseg.core import ConfusionMatrixAccumulator, build_label_lut
 from mmseg.utils import get_root_logger
 from .builder import DATASETS
 from .pipelines import Compose
+from .pipelines.cache import DecodedCache
 
 
 @DATASETS.register_module()
@@ -73,12 +74,29 @@ class CustomDataset(Dataset):
             The palette of segmentation map. If None is given, and
             self.PALETTE is None, random palette will be generated.
             Default: None
+        gt_prefetch_workers (int): Number of threads decoding the ground
+            truth segmentation maps ahead of the evaluation. The maps are
+            decoded serially if it is not greater than 1. Default: 4.
+        gt_cache_cfg (dict, optional): Arguments of :class:`DecodedCache` to
+            keep the decoded ground truth segmentation maps between the
+            evaluation rounds, e.g. ``dict(max_size=1024)``. The cache is
+            local to the evaluating process unless ``shared=True`` is given.
+            Default: None.
     """
 
     CLASSES = None
 
     PALETTE = None
 
+    # the defaults of the subclasses that do not call CustomDataset.__init__
+    label_lut = None
+    gt_prefetch_workers = 4
+    gt_cache = None
+
+    _gt_executor = None
+    _gt_prefetched = None
+    _gt_prefetch_order = None
+
     def __init__(self,
                  pipeline,
                  img_dir,
@@ -91,7 +109,9 @@ class CustomDataset(Dataset):
                  ignore_index=255,
                  reduce_zero_label=False,
                  classes=None,
-                 palette=None):
+                 palette=None,
+                 gt_prefetch_workers=4,
+                 gt_cache_cfg=None):
         self.pipeline = Compose(pipeline)
         self.img_dir = img_dir
         self.img_suffix = img_suffix
@@ -103,6 +123,13 @@ class CustomDataset(Dataset):
         self.ignore_index = ignore_index
         self.reduce_zero_label = reduce_zero_label
         self.label_map = None
+        self.label_lut = None
+        self.gt_prefetch_workers = gt_prefetch_workers
+        self.gt_cache = None
+        if gt_cache_cfg is not None:
+            cache_cfg = dict(shared=False)
+            cache_cfg.update(gt_cache_cfg)
+            self.gt_cache = DecodedCache(**cache_cfg)
 
         self.CLASSES, self.PALETTE = self.get_classes_and_palette(classes, palette)
 
@@ -185,6 +212,7 @@ class CustomDataset(Dataset):
         results['seg_prefix'] = self.ann_dir
         if self.custom_classes:
             results['label_map'] = self.label_map
+            results['label_lut'] = self.label_lut
 
     def __getitem__(self, idx):
         """Get training/test data after pipeline.
@@ -238,19 +266,190 @@ class CustomDataset(Dataset):
     def format_results(self, results, **kwargs):
         """Place holder to format result to dataset specific output."""
 
+    def get_gt_seg_map_by_idx(self, idx):
+        """Get one ground truth segmentation map for evaluation."""
+        ann_info = self.get_ann_info(idx)
+        seg_map = osp.join(self.ann_dir, ann_info['seg_map'])
+        gt_seg_map = mmcv.imread(seg_map, flag='unchanged', backend='pillow')
+
+        return gt_seg_map
+
+    def __getstate__(self):
+        # the thread pool and the scheduled maps are local to the process
+        state = self.__dict__.copy()
+        for name in ('_gt_executor', '_gt_prefetched', '_gt_prefetch_order'):
+            state.pop(name, None)
+
+        return state
+
+    def _get_gt_executor(self):
+        if self.gt_prefetch_workers <= 1:
+            return None
+
+        # the pool is created once and reused by all evaluation calls
+        if self._gt_executor is None:
+            self._gt_executor = ThreadPoolExecutor(self.gt_prefetch_workers)
+
+        return self._gt_executor
+
+    def prefetch_gt_seg_maps(self, indices):
+        """Schedule the ground truth segmentation maps to decode ahead.
+
+        The maps of ``indices`` are decoded in the background in this order,
+        so that :meth:`pre_eval` finds the maps of the next batches ready.
+        At most ``2 * gt_prefetch_workers`` maps are decoded ahead, the
+        window is moved forward on every :meth:`pre_eval` call. A previous
+        schedule is cancelled.
+
+        Args:
+            indices (Iterable[int]): The dataset indices in the order they are
+                passed to :meth:`pre_eval`.
+        """
+
+        self._cancel_gt_prefetch()
+        if self._get_gt_executor() is None:
+            return
+
+        self._gt_prefetched = OrderedDict()
+        self._gt_prefetch_order = iter(indices)
+        self._fill_gt_prefetch()
+
+    def _fill_gt_prefetch(self):
+        if self._gt_prefetch_order is None:
+            return
+
+        executor = self._get_gt_executor()
+        max_pending = 2 * self.gt_prefetch_workers
+        while len(self._gt_prefetched) < max_pending:
+            idx = next(self._gt_prefetch_order, None)
+            if idx is None:
+                self._gt_prefetch_order = None
+                break
+            if idx not in self._gt_prefetched:
+                self._gt_prefetched[idx] = self._load_gt_seg_map(idx, executor)
+
+    def _cancel_gt_prefetch(self):
+        if self._gt_prefetched is not None:
+            for gt_seg_map in self._gt_prefetched.values():
+                if isinstance(gt_seg_map, Future):
+                    gt_seg_map.cancel()
+
+        self._gt_prefetched = None
+        self._gt_prefetch_order = None
+
+    def iter_gt_seg_maps(self, indices=None):
+        """Lazily yield the ground truth segmentation maps.
+
+        The maps are decoded by a thread pool a few samples ahead of the
+        consumer, so at most ``2 * gt_prefetch_workers`` decoded maps are kept
+        in memory at once. The maps scheduled with
+        :meth:`prefetch_gt_seg_maps` are taken from the schedule. With
+        ``gt_cache_cfg`` the decoded maps are looked up in and added to the
+        cache by the calling thread.
+
+        Args:
+            indices (Sequence[int], optional): The dataset indices of the maps.
+                All samples of the dataset if None. Default: None.
+
+        Yields:
+            np.ndarray: The ground truth segmentation maps in the order of
+                ``indices``.
+        """
+
+        if indices is None:
+            indices = range(len(self))
+
+        executor = self._get_gt_executor() if len(indices) > 1 else None
+        max_pending = 2 * self.gt_prefetch_workers
+
+        pending = deque()
+        try:
+            for idx in indices:
+                if self._gt_prefetched is not None and idx in self._gt_prefetched:
+                    gt_seg_map = self._gt_prefetched.pop(idx)
+                else:
+                    gt_seg_map = self._load_gt_seg_map(idx, executor)
+                pending.append((idx, gt_seg_map))
+                if len(pending) > max_pending:
+                    yield self._finish_gt_seg_map(*pending.popleft())
+            while pending:
+                yield self._finish_gt_seg_map(*pending.popleft())
+        finally:
+            # the consumer may stop early
+            for _, gt_seg_map in pending:
+                if isinstance(gt_seg_map, Future):
+                    gt_seg_map.cancel()
+
+    def _load_gt_seg_map(self, idx, executor=None):
+        if self.gt_cache is not None:
+            gt_seg_map = self.gt_cache.get(str(idx))
+            if gt_seg_map is not None:
+                return gt_seg_map
+
+        if executor is None:
+            return self.get_gt_seg_map_by_idx(idx)
+
+        return executor.submit(self.get_gt_seg_map_by_idx, idx)
+
+    def _finish_gt_seg_map(self, idx, gt_seg_map):
+        if not isinstance(gt_seg_map, Future):
+            return gt_seg_map
+
+        gt_seg_map = gt_seg_map.result()
+        if self.gt_cache is not None:
+            self.gt_cache.put(str(idx), gt_seg_map)
+
+        return gt_seg_map
+
     def get_gt_seg_maps(self, efficient_test=False):
-        """Get ground truth segmentation maps for evaluation."""
-        gt_seg_maps = []
-        for item_id in range(len(self)):
-            ann_info = self.get_ann_info(item_id)
-            seg_map = osp.join(self.ann_dir, ann_info['seg_map'])
-            if efficient_test:
-                gt_seg_map = seg_map
-            else:
-                gt_seg_map = mmcv.imread(seg_map, flag='unchanged', backend='pillow')
-            gt_seg_maps.append(gt_seg_map)
+        """Get ground truth segmentation maps for evaluation.
+
+        The maps are yielded lazily, see :meth:`iter_gt_seg_maps`. With
+        ``efficient_test`` the paths of the maps are yielded instead.
+        """
+
+        if efficient_test:
+            for item_id in range(len(self)):
+                ann_info = self.get_ann_info(item_id)
+                yield osp.join(self.ann_dir, ann_info['seg_map'])
+        else:
+            yield from self.iter_gt_seg_maps()
 
-        return gt_seg_maps
+    def pre_eval(self, preds, indices, accumulator=None):
+        """Reduce predictions to confusion matrix counts right away.
+
+        Args:
+            preds (list[ndarray] | ndarray): The prediction segmentation
+                map(s) of a batch.
+            indices (list[int] | int): The dataset indices of ``preds``.
+            accumulator (ConfusionMatrixAccumulator, optional): Accumulator to
+                update. If None, a new one is created. Default: None.
+
+        Returns:
+            ConfusionMatrixAccumulator: The updated accumulator, which can be
+                passed to :meth:`evaluate` instead of the results list.
+        """
+        if not isinstance(indices, list):
+            indices = [indices]
+        if not isinstance(preds, list):
+            preds = [preds]
+
+        if accumulator is None:
+            # label maps are stored as uint8, so 256 slots cover every label
+            # when the classes of the dataset are unknown
+            num_classes = 256 if self.CLASSES is None else len(self.CLASSES)
+            accumulator = ConfusionMatrixAccumulator(
+                num_classes,
+                self.ignore_index,
+                label_map=self.label_lut,
+                reduce_zero_label=self.reduce_zero_label
+            )
+
+        for pred, gt_seg_map in zip(preds, self.iter_gt_seg_maps(indices)):
+            accumulator.update(pred, gt_seg_map)
+        self._fill_gt_prefetch()
+
+        return accumulator
 
     def get_classes_and_palette(self, classes=None, palette=None):
         """Get class names of current dataset.
@@ -291,6 +490,8 @@ class CustomDataset(Dataset):
                     self.label_map[i] = -1
                 else:
                     self.label_map[i] = classes.index(c)
+            # applied to label maps with a single gather
+            self.label_lut = build_label_lut(self.label_map)
 
         palette = self.get_palette_for_custom_classes(class_names, palette)
 
@@ -325,7 +526,8 @@ class CustomDataset(Dataset):
         """Evaluate the dataset.
 
         Args:
-            results (list): Testing results of the dataset.
+            results (list | ConfusionMatrixAccumulator): Testing results of
+                the dataset, or the accumulator returned by :meth:`pre_eval`.
             metric (str | list[str]): Metrics to be evaluated. 'mIoU',
                 'mDice' and 'mFscore' are supported.
             logger (logging.Logger | None | str): Logger used for printing
@@ -342,21 +544,30 @@ class CustomDataset(Dataset):
         if not set(metric).issubset(set(allowed_metrics)):
             raise KeyError('metric {} is not supported'.format(metric))
 
-        gt_seg_maps = self.get_gt_seg_maps(efficient_test)
-        num_classes = len(reduce(np.union1d, [np.unique(_) for _ in gt_seg_maps])) \
-            if self.CLASSES is None else len(self.CLASSES)
-        class_names = tuple(range(num_classes)) \
-            if self.CLASSES is None else self.CLASSES
-
-        ret_metrics = eval_metrics(
-            results,
-            gt_seg_maps,
-            num_classes,
-            self.ignore_index,
-            metric,
-            label_map=self.label_map,
-            reduce_zero_label=self.reduce_zero_label
-        )
+        if isinstance(results, ConfusionMatrixAccumulator):
+            accumulator = results
+        else:
+            # ground truth maps are loaded lazily, one at a time, so only the
+            # confusion matrix is kept in memory during evaluation
+            assert len(results) == len(self), \
+                f'The length of results is not equal to the dataset len: ' \
+                f'{len(results)} != {len(self)}'
+            accumulator = self.pre_eval(results, list(range(len(results))))
+
+        if self.CLASSES is None:
+            # keep the classes up to the largest label present in ground truth,
+            # the rows of the confusion matrix are the running bincounts of
+            # the ground truth labels, so the maps are not decoded again
+            present_labels = accumulator.confusion_matrix.sum(dim=1).nonzero()
+            num_classes = int(present_labels.max()) + 1 \
+                if len(present_labels) > 0 else 1
+            class_names = tuple(range(num_classes))
+            accumulator = ConfusionMatrixAccumulator(num_classes).merge(
+                accumulator.confusion_matrix[:num_classes, :num_classes])
+        else:
+            class_names = self.CLASSES
+
+        ret_metrics = accumulator.compute(metric)
 
         # summary table
         ret_metrics_summary = OrderedDict({
@@ -0,0 +1,85 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os.path as osp
+
+import mmcv
+from mmcv.utils import print_log
+
+from mmseg.utils import get_root_logger
+from .builder import DATASETS
+from .custom import CustomDataset
+from .pipelines.loading import load_packed_array
+
+
+@DATASETS.register_module()
+class PackedDataset(CustomDataset):
+    """Dataset stored in the packed format written by
+    ``tools/convert_datasets/pack.py``.
+
+    The decoded images and segmentation maps of a split are stored back to
+    back in one binary shard, and an index file keeps the location of every
+    sample in it:
+
+    .. code-block:: none
+
+        ├── data
+        │   ├── my_dataset
+        │   │   ├── packed
+        │   │   │   ├── train.json
+        │   │   │   ├── train.bin
+        │   │   │   ├── val.json
+        │   │   │   ├── val.bin
+
+    :class:`LoadImageFromFile` and :class:`LoadAnnotations` read the samples
+    as zero-copy views of the memory mapped shard, so the usual pipelines can
+    be used as is. Images are stored with the ``color_type`` they were packed
+    with.
+
+    Args:
+        pipeline (list[dict]): Processing pipeline
+        index_file (str): Path to the index file of the packed split.
+        data_root (str, optional): Data root for index_file. Default: None.
+        **kwargs: Other arguments of :class:`CustomDataset`, e.g. ``classes``
+            or ``reduce_zero_label``.
+    """
+
+    def __init__(self, pipeline, index_file, data_root=None, **kwargs):
+        if data_root is not None and not osp.isabs(index_file):
+            index_file = osp.join(data_root, index_file)
+        self.index_file = index_file
+
+        super(PackedDataset, self).__init__(
+            pipeline,
+            img_dir=osp.dirname(index_file),
+            ann_dir=osp.dirname(index_file),
+            **kwargs)
+        self.data_root = data_root
+
+    def load_annotations(self, img_dir, img_suffix, ann_dir, seg_map_suffix,
+                         split):
+        """Load the sample locations from the index file.
+
+        Returns:
+            list[dict]: All image info of dataset.
+        """
+
+        index = mmcv.load(self.index_file)
+        shard = osp.join(osp.dirname(self.index_file), index['shard'])
+
+        img_infos = []
+        for sample in index['samples']:
+            img_info = dict(filename=sample['filename'], shard=shard)
+            img_info.update(sample['img'])
+            if 'ann' in sample:
+                img_info['ann'] = dict(
+                    seg_map=sample['seg_map'], shard=shard, **sample['ann'])
+            img_infos.append(img_info)
+
+        print_log(f'Loaded {len(img_infos)} images', logger=get_root_logger())
+        return img_infos
+
+    def get_gt_seg_map_by_idx(self, idx):
+        """Get one ground truth segmentation map for evaluation."""
+        return load_packed_array(self.get_ann_info(idx))
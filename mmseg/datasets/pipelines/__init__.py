@@ -13,7 +13,8 @@ from .test_time_aug import MultiScaleFlipAug
 from .transforms import (CLAHE, AdjustGamma, Normalize, Pad,
                          PhotoMetricDistortion, RandomCrop, RandomFlip,
                          RandomRotate, Rerange, Resize, RGB2Gray, SegRescale,
-                         CrossNorm, MixUp, BorderWeighting, Empty)
+                         CrossNorm, MixUp, BorderWeighting, Empty,
+                         FusedGeometricTransform)
 
 __all__ = [
     'Compose',
@@ -44,4 +45,5 @@ __all__ = [
     'MixUp',
     'BorderWeighting',
     'Empty',
+    'FusedGeometricTransform',
 ]
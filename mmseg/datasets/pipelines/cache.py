@@ -0,0 +1,243 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import time
+import warnings
+import weakref
+from collections import OrderedDict
+from multiprocessing import Manager
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    resource_tracker, shared_memory = None, None
+
+
+def _open_block(name=None, size=0):
+    """Create or attach a shared memory block that is not tracked by the
+    resource tracker of the current process.
+
+    The blocks are owned by the cache, so a DataLoader worker that exits must
+    not unlink the blocks it created or attached to.
+    """
+
+    if name is None:
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    else:
+        block = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(block._name, 'shared_memory')
+
+    return block
+
+
+def _unlink_blocks(names):
+    for name in names:
+        try:
+            block = _open_block(name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        # unlink() unregisters the block from the resource tracker again
+        resource_tracker.register(block._name, 'shared_memory')
+        block.unlink()
+
+
+class DecodedCache(object):
+    """Size-bounded LRU cache of decoded images and segmentation maps.
+
+    With ``shared=True`` every array is stored in a
+    ``multiprocessing.shared_memory`` block and the LRU index is kept by a
+    manager process. The cache has to be created before the DataLoader
+    workers are started (i.e. when the dataset pipeline is built), then all
+    workers built by :func:`mmseg.datasets.build_dataloader` read and fill the
+    same copy instead of decoding and caching every file on their own.
+    Otherwise, or on Python < 3.8, each process keeps its own LRU.
+
+    A hit in the shared cache costs a single call to the manager. The access
+    times are buffered by each process and sent to the manager in batches,
+    so the LRU order of the shared cache is approximate. When the cache is
+    full, the least recently used entries are evicted until it is filled to
+    ``low_water_ratio`` of its capacity, so the entries are sorted only once
+    in a while.
+
+    Args:
+        max_size (int): Capacity of the cache in megabytes. Default: 1024.
+        shared (bool): Whether to share the cache between processes.
+            Default: True.
+    """
+
+    # the fraction of the capacity the cache is evicted down to
+    low_water_ratio = 0.9
+    # the number of hits after which the access times are sent to the manager
+    access_flush_size = 32
+
+    def __init__(self, max_size=1024, shared=True):
+        self.max_size = max_size
+        self.max_bytes = int(max_size * 1024 ** 2)
+
+        if shared and shared_memory is None:
+            warnings.warn('Shared memory requires Python >= 3.8, falling back '
+                          'to a per-process cache')
+            shared = False
+        self.shared = shared
+
+        if self.shared:
+            self._manager = Manager()
+            # key -> (block name, shape, dtype, nbytes)
+            self._index = self._manager.dict()
+            # key -> last access time, may keep the keys of evicted entries
+            self._access_times = self._manager.dict()
+            # the access times of this process not sent to the manager yet
+            self._pending_access_times = dict()
+            self._total_bytes = self._manager.Value('q', 0)
+            self._lock = self._manager.Lock()
+            # the process that created the cache unlinks the blocks at exit
+            self._finalizer = weakref.finalize(
+                self, self._cleanup, self._index, os.getpid())
+        else:
+            self._local = OrderedDict()
+            self._local_bytes = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # only the proxies are sent to the workers
+        state.pop('_manager', None)
+        state.pop('_finalizer', None)
+        if '_pending_access_times' in state:
+            state['_pending_access_times'] = dict()
+        return state
+
+    @staticmethod
+    def _cleanup(index, owner_pid):
+        if os.getpid() != owner_pid:
+            # forked DataLoader workers do not own the blocks
+            return
+        try:
+            names = [entry[0] for entry in index.values()]
+        except (EOFError, OSError):
+            # the manager process is already shut down
+            return
+        _unlink_blocks(names)
+
+    def __len__(self):
+        return len(self._index) if self.shared else len(self._local)
+
+    def __contains__(self, key):
+        return key in (self._index if self.shared else self._local)
+
+    def get(self, key):
+        """Get a copy of the cached array.
+
+        Args:
+            key (str): The cache key, e.g. the file name.
+
+        Returns:
+            np.ndarray | None: The cached array, or None on a cache miss.
+        """
+
+        if not self.shared:
+            array = self._local.get(key)
+            if array is None:
+                return None
+            self._local.move_to_end(key)
+            return array.copy()
+
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+
+        name, shape, dtype, _ = entry
+        try:
+            block = _open_block(name)
+        except FileNotFoundError:
+            # evicted by another worker in the meantime
+            return None
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf).copy()
+        block.close()
+
+        self._pending_access_times[key] = time.monotonic()
+        if len(self._pending_access_times) >= self.access_flush_size:
+            self._flush_access_times()
+
+        return array
+
+    def _flush_access_times(self):
+        if len(self._pending_access_times) > 0:
+            self._access_times.update(self._pending_access_times)
+            self._pending_access_times = dict()
+
+    def put(self, key, array):
+        """Add an array to the cache, evicting the least recently used ones
+        if the capacity is exceeded.
+
+        Args:
+            key (str): The cache key, e.g. the file name.
+            array (np.ndarray): The decoded array.
+        """
+
+        nbytes = array.nbytes
+        if nbytes > self.max_bytes:
+            return
+
+        if not self.shared:
+            if key in self._local:
+                return
+            self._local[key] = array.copy()
+            self._local_bytes += nbytes
+            while self._local_bytes > self.max_bytes:
+                _, evicted = self._local.popitem(last=False)
+                self._local_bytes -= evicted.nbytes
+            return
+
+        block = _open_block(size=nbytes)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        block.close()
+
+        self._pending_access_times[key] = time.monotonic()
+        self._flush_access_times()
+
+        entry = (block.name, array.shape, array.dtype.str, nbytes)
+        evicted_names = []
+        with self._lock:
+            if self._index.setdefault(key, entry)[0] != block.name:
+                # the same file was decoded by another worker concurrently
+                evicted_names.append(block.name)
+            else:
+                total_bytes = self._total_bytes.value + nbytes
+                if total_bytes > self.max_bytes:
+                    total_bytes, evicted_names = self._evict(total_bytes)
+                self._total_bytes.value = total_bytes
+        _unlink_blocks(evicted_names)
+
+    def _evict(self, total_bytes):
+        """Drop the least recently used entries until the cache is filled to
+        its low water mark. Must be called under the lock."""
+
+        access_times = self._access_times.copy()
+        entries = sorted(self._index.items(),
+                         key=lambda item: access_times.get(item[0], 0.0))
+        low_water_bytes = self.low_water_ratio * self.max_bytes
+        evicted_names = []
+        for key, (name, _, _, nbytes) in entries:
+            if total_bytes <= low_water_bytes:
+                break
+            del self._index[key]
+            total_bytes -= nbytes
+            evicted_names.append(name)
+
+        # drop the access times of the evicted entries, including the ones
+        # written after an earlier eviction
+        for key in access_times.keys() - self._index.keys():
+            self._access_times.pop(key, None)
+
+        return total_bytes, evicted_names
+
+    def __repr__(self):
+        repr_str = self.__class__.__name__
+        repr_str += f'(max_size={self.max_size}, '
+        repr_str += f'shared={self.shared})'
+        return repr_str
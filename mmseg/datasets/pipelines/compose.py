@@ -6,19 +6,24 @@
 #
 
 import collections
-from copy import deepcopy
+from copy import copy
 
+import cv2
 import numpy as np
 from scipy.ndimage import gaussian_filter
 from mmcv.utils import build_from_cfg
 
 from ..builder import PIPELINES
+from .transforms import FusedGeometricTransform
 
 
 @PIPELINES.register_module()
 class Compose(object):
     """Compose multiple transforms sequentially.
 
+    Runs of ``[RandomFlip], [PhotoMetricDistortion], Normalize, Pad,
+    DefaultFormatBundle`` are replaced by :class:`FusedGeometricTransform`.
+
     Args:
         transforms (Sequence[dict | callable]): Sequence of transform object or
             config dict to be composed.
@@ -35,6 +40,7 @@ class Compose(object):
                 self.transforms.append(transform)
             else:
                 raise TypeError('transform must be callable or a dict')
+        self.transforms = FusedGeometricTransform.fuse(self.transforms)
 
     def __call__(self, data):
         """Call function to apply transforms sequentially.
@@ -108,7 +114,29 @@ class ProbCompose(object):
 
 @PIPELINES.register_module()
 class MaskCompose(object):
-    def __init__(self, transforms, prob, lambda_limits=(4, 16), keep_original=False):
+    """Mix the images of two random runs of the transforms with a smooth
+    random binary mask.
+
+    Both runs start from a shallow copy of the input, so the decoded arrays
+    are shared between them and only the parameters drawn by the random
+    transforms differ. The shared arrays are passed as read-only views, which
+    makes a transform modifying its input in place fail loudly instead of
+    corrupting the other run. The mask is generated at ``1 / mask_downscale``
+    of the image resolution and upsampled.
+
+    Args:
+        transforms (Sequence[dict | callable]): Sequence of transform object or
+            config dict to be composed.
+        prob (float): Probability of mixing.
+        lambda_limits (tuple[float]): Range of the smoothness of the mask.
+            Default: (4, 16).
+        keep_original (bool): Whether to keep the image of the first run and
+            store the mixed one as "aux_img". Default: False.
+        mask_downscale (int): Downscale factor of the resolution the mask is
+            generated at. Default: 4.
+    """
+
+    def __init__(self, transforms, prob, lambda_limits=(4, 16), keep_original=False, mask_downscale=4):
         self.keep_original = keep_original
         self.prob = prob
         assert 0.0 <= self.prob <= 1.0
@@ -118,6 +146,9 @@ class MaskCompose(object):
         assert 0.0 < lambda_limits[0] < lambda_limits[1]
         self.lambda_limits = lambda_limits
 
+        assert mask_downscale >= 1
+        self.mask_downscale = mask_downscale
+
         assert isinstance(transforms, collections.abc.Sequence)
         self.transforms = []
         for transform in transforms:
@@ -140,13 +171,44 @@ class MaskCompose(object):
         return data
 
     @staticmethod
-    def _generate_mask(shape, lambda_limits):
-        noise = np.random.randn(*shape)
+    def _share(data):
+        """Copy the containers of the results dict and pass the arrays as
+        read-only views."""
+
+        shared_data = dict()
+        for key, value in data.items():
+            if isinstance(value, np.ndarray):
+                value = value.view()
+                value.flags.writeable = False
+            elif isinstance(value, (list, dict)):
+                value = copy(value)
+            shared_data[key] = value
+
+        return shared_data
+
+    @staticmethod
+    def _unshare(out_data, shared_data, data):
+        """Put back the writable arrays the transforms left untouched."""
+
+        for key, value in out_data.items():
+            if isinstance(value, np.ndarray) and value is shared_data.get(key):
+                out_data[key] = data[key]
+
+        return out_data
+
+    @staticmethod
+    def _generate_mask(shape, lambda_limits, downscale=1):
+        low_res_shape = tuple(max(1, int(np.ceil(size / downscale))) for size in shape)
+        noise = np.random.randn(*low_res_shape)
 
         sigma = np.exp(np.log10(np.random.uniform(lambda_limits[0], lambda_limits[1])))
-        soft_mask = gaussian_filter(noise, sigma=sigma)
+        soft_mask = gaussian_filter(noise, sigma=sigma / downscale).astype(np.float32)
+
+        flat_mask = soft_mask.reshape(-1)
+        threshold = np.partition(flat_mask, flat_mask.size // 2)[flat_mask.size // 2]
 
-        threshold = np.median(soft_mask)
+        if low_res_shape != tuple(shape):
+            soft_mask = cv2.resize(soft_mask, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
         hard_mask = soft_mask > threshold
 
         return hard_mask
@@ -156,17 +218,19 @@ class MaskCompose(object):
         return np.where(np.expand_dims(mask, axis=2), main_img, aux_img)
 
     def __call__(self, data):
-        main_data = self._apply_transforms(deepcopy(data), self.transforms)
+        main_input = self._share(data)
+        main_data = self._apply_transforms(main_input, self.transforms)
         assert main_data is not None
+        main_data = self._unshare(main_data, main_input, data)
         if not self.keep_original and np.random.rand() > self.prob:
             return main_data
 
-        aux_data = self._apply_transforms(deepcopy(data), self.transforms)
+        aux_data = self._apply_transforms(self._share(data), self.transforms)
         assert aux_data is not None
 
         assert main_data['img'].shape == aux_data['img'].shape
 
-        mask = self._generate_mask(main_data['img'].shape[:2], self.lambda_limits)
+        mask = self._generate_mask(main_data['img'].shape[:2], self.lambda_limits, self.mask_downscale)
         mixed_img = self._mix_img(main_data['img'], aux_data['img'], mask)
 
         if self.keep_original:
@@ -3,7 +3,36 @@ import os.path as osp
 import mmcv
 import numpy as np
 
+from mmseg.core import build_label_lut
 from ..builder import PIPELINES
+from .cache import DecodedCache
+
+# memory maps of the packed shards opened by the current process
+_PACKED_SHARDS = dict()
+
+
+def load_packed_array(info):
+    """Get a zero-copy view of an array stored in a packed shard.
+
+    Args:
+        info (dict): Location of the array in the shard written by
+            ``tools/convert_datasets/pack.py``, with keys "shard", "offset",
+            "shape" and "dtype".
+
+    Returns:
+        np.ndarray: Read-only view of the array.
+    """
+
+    shard = _PACKED_SHARDS.get(info['shard'])
+    if shard is None:
+        shard = np.memmap(info['shard'], dtype=np.uint8, mode='r')
+        _PACKED_SHARDS[info['shard']] = shard
+
+    return np.ndarray(
+        tuple(info['shape']),
+        dtype=np.dtype(info['dtype']),
+        buffer=shard,
+        offset=info['offset'])
 
 
 @PIPELINES.register_module()
@@ -15,6 +44,9 @@ class LoadImageFromFile(object):
     "ori_shape" (same as `img_shape`), "pad_shape" (same as `img_shape`),
     "scale_factor" (1.0) and "img_norm_cfg" (means=0 and stds=1).
 
+    Images of :class:`mmseg.datasets.PackedDataset` are already decoded and
+    are read as views of the packed shard.
+
     Args:
         to_float32 (bool): Whether to convert the loaded image to a float32
             numpy array. If set to False, the loaded image is an uint8 array.
@@ -26,18 +58,25 @@ class LoadImageFromFile(object):
             Defaults to ``dict(backend='disk')``.
         imdecode_backend (str): Backend for :func:`mmcv.imdecode`. Default:
             'cv2'
+        cache_cfg (dict, optional): Arguments of :class:`DecodedCache` to keep
+            the decoded uint8 images in a size-bounded LRU cache, e.g.
+            ``dict(max_size=1024, shared=True)``. Default: None.
     """
 
     def __init__(self,
                  to_float32=False,
                  color_type='color',
                  file_client_args=dict(backend='disk'),
-                 imdecode_backend='cv2'):
+                 imdecode_backend='cv2',
+                 cache_cfg=None):
         self.to_float32 = to_float32
         self.color_type = color_type
         self.file_client_args = file_client_args.copy()
         self.file_client = None
         self.imdecode_backend = imdecode_backend
+        self.cache = None
+        if cache_cfg is not None:
+            self.cache = DecodedCache(**cache_cfg)
 
     def __call__(self, results):
         """Call functions to load image and get image meta information.
@@ -57,9 +96,17 @@ class LoadImageFromFile(object):
                                 results['img_info']['filename'])
         else:
             filename = results['img_info']['filename']
-        img_bytes = self.file_client.get(filename)
-        img = mmcv.imfrombytes(
-            img_bytes, flag=self.color_type, backend=self.imdecode_backend)
+        img = None
+        if 'shard' in results['img_info']:
+            img = load_packed_array(results['img_info'])
+        elif self.cache is not None:
+            img = self.cache.get(filename)
+        if img is None:
+            img_bytes = self.file_client.get(filename)
+            img = mmcv.imfrombytes(
+                img_bytes, flag=self.color_type, backend=self.imdecode_backend)
+            if self.cache is not None:
+                self.cache.put(filename, img)
         if self.to_float32:
             img = img.astype(np.float32)
 
@@ -99,16 +146,23 @@ class LoadAnnotations(object):
             Defaults to ``dict(backend='disk')``.
         imdecode_backend (str): Backend for :func:`mmcv.imdecode`. Default:
             'pillow'
+        cache_cfg (dict, optional): Arguments of :class:`DecodedCache` to keep
+            the decoded label maps in a size-bounded LRU cache, e.g.
+            ``dict(max_size=256, shared=True)``. Default: None.
     """
 
     def __init__(self,
                  reduce_zero_label=False,
                  file_client_args=dict(backend='disk'),
-                 imdecode_backend='pillow'):
+                 imdecode_backend='pillow',
+                 cache_cfg=None):
         self.reduce_zero_label = reduce_zero_label
         self.file_client_args = file_client_args.copy()
         self.file_client = None
         self.imdecode_backend = imdecode_backend
+        self.cache = None
+        if cache_cfg is not None:
+            self.cache = DecodedCache(**cache_cfg)
 
     def __call__(self, results):
         """Call function to load multiple types annotations.
@@ -128,20 +182,25 @@ class LoadAnnotations(object):
                                 results['ann_info']['seg_map'])
         else:
             filename = results['ann_info']['seg_map']
-        img_bytes = self.file_client.get(filename)
-        gt_semantic_seg = mmcv.imfrombytes(
-            img_bytes, flag='unchanged',
-            backend=self.imdecode_backend).squeeze().astype(np.uint8)
-        # modify if custom classes
-        if results.get('label_map', None) is not None:
-            for old_id, new_id in results['label_map'].items():
-                gt_semantic_seg[gt_semantic_seg == old_id] = new_id
-        # reduce zero_label
-        if self.reduce_zero_label:
-            # avoid using underflow conversion
-            gt_semantic_seg[gt_semantic_seg == 0] = 255
-            gt_semantic_seg = gt_semantic_seg - 1
-            gt_semantic_seg[gt_semantic_seg == 254] = 255
+        gt_semantic_seg = None
+        if 'shard' in results['ann_info']:
+            gt_semantic_seg = load_packed_array(results['ann_info'])
+        elif self.cache is not None:
+            gt_semantic_seg = self.cache.get(filename)
+        if gt_semantic_seg is None:
+            img_bytes = self.file_client.get(filename)
+            gt_semantic_seg = mmcv.imfrombytes(
+                img_bytes, flag='unchanged',
+                backend=self.imdecode_backend).squeeze().astype(np.uint8)
+            if self.cache is not None:
+                self.cache.put(filename, gt_semantic_seg)
+        # modify if custom classes and reduce zero_label
+        label_lut = results.get('label_lut')
+        if label_lut is None:
+            label_lut = results.get('label_map')
+        label_lut = build_label_lut(label_lut, self.reduce_zero_label)
+        if label_lut is not None:
+            gt_semantic_seg = label_lut[gt_semantic_seg]
         results['gt_semantic_seg'] = gt_semantic_seg
         results['seg_fields'].append('gt_semantic_seg')
         return results
@@ -5,16 +5,23 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import multiprocessing
+import numbers
+import os
 import os.path as osp
+import weakref
 
 import mmcv
 import numpy as np
+from mmcv.parallel import DataContainer as DC
 from mmcv.utils import deprecated_api_warning, is_tuple_of
 from numpy import random
 from scipy.signal import convolve2d
 from scipy.ndimage import distance_transform_edt
 
 from ..builder import PIPELINES
+from .cache import _open_block, _unlink_blocks, shared_memory
+from .formating import DefaultFormatBundle, to_tensor
 
 
 @PIPELINES.register_module()
@@ -505,10 +512,12 @@ class CLAHE(object):
             dict: Processed results.
         """
 
-        for i in range(results['img'].shape[2]):
-            results['img'][:, :, i] = mmcv.clahe(
-                np.array(results['img'][:, :, i], dtype=np.uint8),
+        img = results['img'].copy()
+        for i in range(img.shape[2]):
+            img[:, :, i] = mmcv.clahe(
+                np.array(img[:, :, i], dtype=np.uint8),
                 self.clip_limit, self.tile_grid_size)
+        results['img'] = img
 
         return results
 
@@ -928,9 +937,146 @@ class PhotoMetricDistortion(object):
         return repr_str
 
 
+class _ImageBank(object):
+    """Fixed-size bank of decoded images, stored downscaled in shared memory.
+
+    All images are rescaled and center-cropped to ``img_size``. The bank has
+    one spare slot: every ``refresh_interval`` calls of :meth:`step`, a
+    process decodes a new image into the spare slot and then swaps it with a
+    random slot of the bank, so readers never see a partially written image.
+    DataLoader workers share the memory, so they all see the refreshed images
+    and only one of them refreshes the bank at a time.
+    """
+
+    def __init__(self, image_paths, size, img_size, refresh_interval=None):
+        self.image_paths = image_paths
+        self.size = size
+        self.img_size = tuple(img_size)
+        self.refresh_interval = refresh_interval
+        self._num_steps = 0
+        self._rng = np.random.RandomState()
+        self._rng_pid = os.getpid()
+        self._lock = multiprocessing.Lock()
+
+        slot_shape = self.img_size + (3, )
+        num_slots = size + 1
+        nbytes = num_slots * int(np.prod(slot_shape))
+        if shared_memory is not None:
+            self._block = _open_block(size=nbytes + 8 * num_slots)
+            self._finalizer = weakref.finalize(
+                self, _unlink_owned_block, self._block.name, os.getpid())
+            buffer = self._block.buf
+        else:
+            self._block = None
+            buffer = bytearray(nbytes + 8 * num_slots)
+        self._bind(buffer)
+
+        for slot_idx in range(num_slots):
+            self._fill(slot_idx)
+            self._index[slot_idx] = slot_idx
+
+    def _bind(self, buffer):
+        num_slots = self.size + 1
+        slot_shape = self.img_size + (3, )
+        # the last entry of the index is the spare slot
+        self._index = np.ndarray((num_slots, ), dtype=np.int64, buffer=buffer)
+        self._slots = np.ndarray(
+            (num_slots, ) + slot_shape,
+            dtype=np.uint8,
+            buffer=buffer,
+            offset=self._index.nbytes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_index', '_slots', '_finalizer']:
+            state.pop(key, None)
+        if self._block is not None:
+            state['_block'] = self._block.name
+        else:
+            state['_buffer'] = self._slots.base
+        return state
+
+    def __setstate__(self, state):
+        # spawned DataLoader workers attach to the bank of the main process
+        buffer = state.pop('_buffer', None)
+        self.__dict__.update(state)
+        if self._block is not None:
+            self._block = _open_block(self._block)
+            buffer = self._block.buf
+        self._bind(buffer)
+
+    def _fill(self, slot_idx):
+        image_path = self.image_paths[self._rng.randint(len(self.image_paths))]
+        image = mmcv.imread(image_path)
+
+        trg_h, trg_w = self.img_size
+        scale_factor = max(trg_h / image.shape[0], trg_w / image.shape[1])
+        new_size = (max(trg_w, int(image.shape[1] * scale_factor + 0.5)),
+                    max(trg_h, int(image.shape[0] * scale_factor + 0.5)))
+        image = mmcv.imresize(image, new_size)
+
+        h_offset = (image.shape[0] - trg_h) // 2
+        w_offset = (image.shape[1] - trg_w) // 2
+        self._slots[slot_idx] = image[h_offset:h_offset + trg_h,
+                                      w_offset:w_offset + trg_w]
+
+    def step(self):
+        """Replace a bank image if it is due and no other process is doing
+        it."""
+
+        self._num_steps += 1
+        if self.refresh_interval is None or \
+                self._num_steps % self.refresh_interval != 0:
+            return
+        if not self._lock.acquire(block=False):
+            return
+        try:
+            if self._rng_pid != os.getpid():
+                # forked workers start with the state of the same generator
+                self._rng.seed()
+                self._rng_pid = os.getpid()
+            spare_slot = int(self._index[self.size])
+            self._fill(spare_slot)
+            bank_idx = self._rng.randint(self.size)
+            self._index[self.size] = self._index[bank_idx]
+            self._index[bank_idx] = spare_slot
+        finally:
+            self._lock.release()
+
+    def __getitem__(self, bank_idx):
+        return self._slots[self._index[bank_idx]]
+
+
+def _unlink_owned_block(name, owner_pid):
+    if os.getpid() == owner_pid:
+        _unlink_blocks([name])
+
+
 @PIPELINES.register_module()
 class MixUp(object):
-    def __init__(self, root_dir, annot, imgs_root, alpha=0.2, beta=None, prob=1.0):
+    """Blend the image with a random image of another dataset.
+
+    Args:
+        root_dir (str): Root directory of ``annot`` and ``imgs_root``.
+        annot (str): File with the image paths, one per line.
+        imgs_root (str): Directory of the images.
+        alpha (float): Alpha of the beta distribution of the blend weight.
+            Default: 0.2.
+        beta (float, optional): Beta of the beta distribution of the blend
+            weight. If None, ``alpha`` is used. Default: None.
+        prob (float): Probability of the blend. Default: 1.0.
+        bank_size (int, optional): Number of images decoded once and kept in
+            shared memory. If None, a random image is read from disk on every
+            call. Default: None.
+        bank_img_size (tuple[int]): Size (h, w) the bank images are stored
+            at. Default: (512, 512).
+        bank_refresh_interval (int, optional): Number of calls of each
+            DataLoader worker between replacing a bank image by a new one. If
+            None, the bank is fixed. Default: 100.
+    """
+
+    def __init__(self, root_dir, annot, imgs_root, alpha=0.2, beta=None, prob=1.0,
+                 bank_size=None, bank_img_size=(512, 512), bank_refresh_interval=100):
         if not isinstance(alpha, (int, float)):
             raise TypeError(f'Alpha must be an int or float, but got {type(alpha)}')
         self.alpha = float(alpha)
@@ -956,6 +1102,13 @@ class MixUp(object):
         self.prob = prob
         assert 0.0 <= self.prob <= 1.0
 
+        self.bank = None
+        if bank_size is not None:
+            assert bank_size > 0
+            self.bank = _ImageBank(self.image_paths, bank_size, bank_img_size,
+                                   bank_refresh_interval)
+        self._buffers = None
+
     @staticmethod
     def _parse_image_paths(annot, imgs_root):
         return [osp.join(imgs_root, x.strip().split(' ')[0]) for x in open(annot)]
@@ -977,6 +1130,25 @@ class MixUp(object):
 
         return cropped_image
 
+    @staticmethod
+    def _prepare_bank_image(bank_image, trg_size, scale=1.15):
+        # crop the window that covers trg_size after the rescale and resize
+        # only the window
+        scale_factor = scale * float(min(trg_size)) / float(min(bank_image.shape[:2]))
+        crop_h = min(bank_image.shape[0], max(1, int(trg_size[0] / scale_factor + 0.5)))
+        crop_w = min(bank_image.shape[1], max(1, int(trg_size[1] / scale_factor + 0.5)))
+
+        h_offset = random.randint(0, bank_image.shape[0] - crop_h + 1)
+        w_offset = random.randint(0, bank_image.shape[1] - crop_w + 1)
+        cropped_image = bank_image[h_offset:h_offset + crop_h,
+                                   w_offset:w_offset + crop_w]
+        cropped_image = mmcv.imresize(cropped_image, (trg_size[1], trg_size[0]))
+
+        if np.random.randint(2):
+            cropped_image = mmcv.imflip(cropped_image)
+
+        return cropped_image
+
     @staticmethod
     def _generate_weight(alpha, beta):
         weight = np.random.beta(alpha, beta)
@@ -985,17 +1157,45 @@ class MixUp(object):
 
         return weight
 
+    def _blend_uint8(self, img, mixup_image, alpha):
+        """Blend with 8-bit fixed point weights in place, if possible."""
+
+        weight = int(round(alpha * 256))
+        if self._buffers is None or self._buffers[0].shape != img.shape:
+            self._buffers = (np.empty(img.shape, dtype=np.uint16),
+                             np.empty(img.shape, dtype=np.uint16))
+        mixed, scaled_mixup = self._buffers
+
+        np.multiply(img, 256 - weight, out=mixed, dtype=np.uint16)
+        np.multiply(mixup_image, weight, out=scaled_mixup, dtype=np.uint16)
+        mixed += scaled_mixup
+        mixed += 128
+
+        out = img if img.flags.writeable else np.empty_like(img)
+        np.right_shift(mixed, 8, out=out, casting='unsafe')
+
+        return out
+
     def __call__(self, results):
         if np.random.rand() > self.prob:
             return results
 
         img = results['img']
 
-        mixup_image_idx = np.random.randint(len(self.image_paths))
-        mixup_image_path = self.image_paths[mixup_image_idx]
-        mixup_image = self._prepare_mixup_image(mixup_image_path, img.shape[:2])
+        if self.bank is not None:
+            self.bank.step()
+            bank_image = self.bank[np.random.randint(self.bank.size)]
+            mixup_image = self._prepare_bank_image(bank_image, img.shape[:2])
+        else:
+            mixup_image_idx = np.random.randint(len(self.image_paths))
+            mixup_image_path = self.image_paths[mixup_image_idx]
+            mixup_image = self._prepare_mixup_image(mixup_image_path, img.shape[:2])
 
         alpha = self._generate_weight(self.alpha, self.beta)
+        if self.bank is not None and img.dtype == np.uint8 and img.shape == mixup_image.shape:
+            results['img'] = self._blend_uint8(img, mixup_image, alpha)
+            return results
+
         scaled_mixup_image = alpha * mixup_image.astype(np.float32)
 
         float_img = img.astype(np.float32)
@@ -1007,12 +1207,18 @@ class MixUp(object):
 
         return results
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffers'] = None
+        return state
+
     def __repr__(self):
         repr_str = f'{self.__class__.__name__}(' \
                    f'alpha={self.alpha}, ' \
                    f'beta={self.beta}, ' \
                    f'size={len(self.image_paths)}, ' \
-                   f'prob={self.prob})'
+                   f'prob={self.prob}, ' \
+                   f'bank_size={None if self.bank is None else self.bank.size})'
         return repr_str
 
 
@@ -1139,3 +1345,261 @@ class Empty(object):
     def __repr__(self):
         repr_str = f'{self.__class__.__name__}'
         return repr_str
+
+
+def _saturate_pad_value(value, dtype):
+    """Convert a padding value to ``dtype`` like ``cv2.copyMakeBorder``."""
+
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        value = np.clip(np.rint(value), info.min, info.max)
+
+    return np.array(value).astype(dtype)
+
+
+@PIPELINES.register_module()
+class FusedGeometricTransform(object):
+    """Fused flip, normalization, padding and formatting of training samples.
+
+    Produces the same results as the sequence ``RandomFlip`` (optional),
+    ``PhotoMetricDistortion`` (optional), ``Normalize``, ``Pad`` and
+    ``DefaultFormatBundle``, but the image is flipped, normalized, padded and
+    transposed in one pass, which writes the float32 CHW output directly, and
+    the segmentation maps are flipped and padded into their final buffer.
+    :class:`Compose` replaces such sequences by this transform automatically.
+
+    Resize and RandomCrop are left out, as the crop is chosen on the resized
+    segmentation map and resampling only the crop region would not give the
+    same pixels. Samples the fast path does not cover, e.g. gray images, are
+    passed through the original transforms.
+
+    Args:
+        normalize (dict | Normalize): Normalize transform or its arguments.
+        pad (dict | Pad): Pad transform or its arguments.
+        flip (dict | RandomFlip, optional): RandomFlip transform or its
+            arguments. Default: None.
+        photo_metric_distortion (dict | PhotoMetricDistortion, optional):
+            PhotoMetricDistortion transform or its arguments. Default: None.
+    """
+
+    def __init__(self,
+                 normalize,
+                 pad,
+                 flip=None,
+                 photo_metric_distortion=None):
+        self.normalize = self._build(normalize, Normalize)
+        self.pad = self._build(pad, Pad)
+        self.flip = self._build(flip, RandomFlip)
+        self.photo_metric_distortion = self._build(photo_metric_distortion,
+                                                   PhotoMetricDistortion)
+        self.format_bundle = DefaultFormatBundle()
+
+        # same arithmetic as mmcv.imnormalize
+        self.mean = np.float64(self.normalize.mean.reshape(-1))
+        self.stdinv = 1 / np.float64(self.normalize.std.reshape(-1))
+
+        # scratch buffers of the normalization, grown on demand
+        self._buf64 = np.empty(0, dtype=np.float64)
+        self._buf32 = np.empty(0, dtype=np.float32)
+
+    @staticmethod
+    def _build(cfg, transform_type):
+        if cfg is None or isinstance(cfg, transform_type):
+            return cfg
+        return transform_type(**cfg)
+
+    @classmethod
+    def fuse(cls, transforms):
+        """Replace the runs of ``[RandomFlip], [PhotoMetricDistortion],
+        Normalize, Pad, DefaultFormatBundle`` in a transform list.
+
+        Args:
+            transforms (list[callable]): Built transforms.
+
+        Returns:
+            list[callable]: Transforms with the matching runs fused.
+        """
+
+        fused_transforms = []
+        i = 0
+        while i < len(transforms):
+            j = i
+            flip, photo_metric_distortion = None, None
+            if type(transforms[j]) is RandomFlip:
+                flip = transforms[j]
+                j += 1
+            if j < len(transforms) and \
+                    type(transforms[j]) is PhotoMetricDistortion:
+                photo_metric_distortion = transforms[j]
+                j += 1
+            tail_types = [type(t) for t in transforms[j:j + 3]]
+            if tail_types == [Normalize, Pad, DefaultFormatBundle]:
+                fused_transforms.append(
+                    cls(transforms[j], transforms[j + 1], flip,
+                        photo_metric_distortion))
+                i = j + 3
+            else:
+                fused_transforms.append(transforms[i])
+                i += 1
+
+        return fused_transforms
+
+    def _get_pad_shape(self, results):
+        """Get the padded (h, w) if the sample is covered by the fast path,
+        otherwise None."""
+
+        img = results['img']
+        if img.ndim != 3 or img.shape[2] != len(self.mean) or \
+                img.shape[2] > 4:
+            return None
+        if self.normalize.to_rgb and img.shape[2] != 3:
+            return None
+        if isinstance(self.pad.pad_val, tuple):
+            if len(self.pad.pad_val) != img.shape[2]:
+                return None
+        elif not isinstance(self.pad.pad_val, numbers.Number):
+            return None
+
+        h, w = img.shape[:2]
+        if self.pad.size is not None:
+            pad_h, pad_w = self.pad.size
+        else:
+            divisor = self.pad.size_divisor
+            pad_h = int(np.ceil(h / divisor)) * divisor
+            pad_w = int(np.ceil(w / divisor)) * divisor
+        if h > pad_h or w > pad_w:
+            return None
+
+        for target in ['img', 'aux_img']:
+            if target not in results:
+                continue
+            if results[target].shape != img.shape or \
+                    results[target].dtype not in (np.uint8, np.float32):
+                return None
+        for key in results.get('seg_fields', []):
+            seg = results[key]
+            if seg.ndim != 2 or seg.shape[0] > pad_h or \
+                    seg.shape[1] > pad_w or \
+                    not np.issubdtype(seg.dtype, np.number):
+                return None
+
+        return pad_h, pad_w
+
+    def _normalize_pad(self, img, pad_shape):
+        h, w, num_channels = img.shape
+        out = np.empty((num_channels, ) + pad_shape, dtype=np.float32)
+
+        if isinstance(self.pad.pad_val, tuple):
+            pad_vals = self.pad.pad_val
+        else:
+            # a scalar pads only the first channel, as in cv2
+            pad_vals = (self.pad.pad_val, ) + (0, ) * (num_channels - 1)
+
+        if self._buf64.size < h * w:
+            self._buf64 = np.empty(h * w, dtype=np.float64)
+            self._buf32 = np.empty(h * w, dtype=np.float32)
+        buf64 = self._buf64[:h * w].reshape(h, w)
+        buf32 = self._buf32[:h * w].reshape(h, w)
+
+        for c in range(num_channels):
+            src_c = num_channels - 1 - c if self.normalize.to_rgb else c
+            # (img - mean) * stdinv with the rounding of cv2 in float32
+            np.subtract(
+                img[..., src_c], self.mean[c], out=buf64, dtype=np.float64)
+            np.copyto(buf32, buf64, casting='same_kind')
+            np.multiply(buf32, self.stdinv[c], out=buf64, dtype=np.float64)
+            np.copyto(out[c, :h, :w], buf64, casting='same_kind')
+            out[c, h:, :] = pad_vals[c]
+            out[c, :h, w:] = pad_vals[c]
+
+        return out
+
+    def _pad_seg(self, seg, pad_shape, dtype):
+        pad_val = _saturate_pad_value(self.pad.seg_pad_val, seg.dtype)
+        out = np.empty(pad_shape, dtype=dtype)
+        h, w = seg.shape
+        out[:h, :w] = seg
+        out[h:, :] = pad_val
+        out[:h, w:] = pad_val
+
+        return out
+
+    def __call__(self, results):
+        """Call function to flip, normalize, pad and format the sample.
+
+        Args:
+            results (dict): Result dict from loading pipeline.
+
+        Returns:
+            dict: The same results as the original transforms.
+        """
+
+        flip_direction = None
+        if self.flip is not None:
+            if 'flip' not in results:
+                flip = True if np.random.rand() < self.flip.prob else False
+                results['flip'] = flip
+            if 'flip_direction' not in results:
+                results['flip_direction'] = self.flip.direction
+            if results['flip']:
+                flip_direction = results['flip_direction']
+                # a view like in RandomFlip, the segmentation maps are flipped
+                # while they are padded
+                results['img'] = mmcv.imflip(
+                    results['img'], direction=flip_direction)
+        if self.photo_metric_distortion is not None:
+            results = self.photo_metric_distortion(results)
+
+        pad_shape = self._get_pad_shape(results)
+        if pad_shape is None:
+            if flip_direction is not None:
+                for key in results.get('seg_fields', []):
+                    results[key] = mmcv.imflip(
+                        results[key], direction=flip_direction).copy()
+            for t in [self.normalize, self.pad, self.format_bundle]:
+                results = t(results)
+            return results
+
+        for target in ['img', 'aux_img']:
+            if target not in results:
+                continue
+            img = self._normalize_pad(results[target], pad_shape)
+            results[target] = DC(to_tensor(img), stack=True)
+        results['img_norm_cfg'] = dict(
+            mean=self.normalize.mean,
+            std=self.normalize.std,
+            to_rgb=self.normalize.to_rgb)
+        results['pad_shape'] = pad_shape + (len(self.mean), )
+        results['pad_fixed_size'] = self.pad.size
+        results['pad_size_divisor'] = self.pad.size_divisor
+
+        for key in results.get('seg_fields', []):
+            seg = results[key]
+            if flip_direction is not None:
+                seg = mmcv.imflip(seg, direction=flip_direction)
+            if key == 'gt_semantic_seg':
+                seg = self._pad_seg(seg, pad_shape, np.int64)
+                results[key] = DC(to_tensor(seg[None, ...]), stack=True)
+            else:
+                results[key] = self._pad_seg(seg, pad_shape, seg.dtype)
+
+        gt_semantic_seg = results.get('gt_semantic_seg')
+        if gt_semantic_seg is not None and not isinstance(gt_semantic_seg, DC):
+            results['gt_semantic_seg'] = DC(
+                to_tensor(gt_semantic_seg[None, ...].astype(np.int64)),
+                stack=True)
+        if 'pixel_weights' in results:
+            results['pixel_weights'] = DC(
+                to_tensor(results['pixel_weights'][None, ...].astype(
+                    np.float32)),
+                stack=True)
+
+        return results
+
+    def __repr__(self):
+        repr_str = self.__class__.__name__
+        repr_str += f'(normalize={self.normalize}, pad={self.pad}, ' \
+                    f'flip={self.flip}, ' \
+                    f'photo_metric_distortion={self.photo_metric_distortion})'
+        return repr_str
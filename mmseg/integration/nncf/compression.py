@@ -154,7 +154,7 @@ def wrap_nncf_model(model,
 
         if distributed:
             dist_eval_res = [None]
-            results = multi_gpu_test(prepared_model, val_dataloader, gpu_collect=True)
+            results = multi_gpu_test(prepared_model, val_dataloader, pre_eval=True)
             if torch.distributed.get_rank() == 0:
                 eval_res = val_dataloader.dataset.evaluate(results, metric=metric_name)
                 if metric_name not in eval_res:
@@ -165,7 +165,7 @@ def wrap_nncf_model(model,
             torch.distributed.broadcast_object_list(dist_eval_res, src=0)
             return dist_eval_res[0][metric_name]
         else:
-            results = single_gpu_test(prepared_model, val_dataloader, show=False)
+            results = single_gpu_test(prepared_model, val_dataloader, show=False, pre_eval=True)
             eval_res = val_dataloader.dataset.evaluate(results, metric=metric_name)
 
             if metric_name not in eval_res:
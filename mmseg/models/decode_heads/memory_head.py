@@ -151,69 +151,82 @@ class FeaturesMemory(nn.Module):
         return memory_output
 
     def update(self, features, segmentation):
+        """Update the memory with the features of the classes in the batch.
+
+        All classes are updated at once: the per-class (or per-slot for
+        ``num_feats_per_cls > 1``) feature sums are accumulated with a single
+        ``index_add_`` over the pixels, so the cost does not depend on the
+        number of the present classes.
+        """
+
         batch_size, num_channels, h, w = features.size()
         momentum = self.momentum
+        memory = self.memory.data
 
         # use features to update memory
-        segmentation = segmentation.long()
-        features = features.permute(0, 2, 3, 1).contiguous()
-        features = features.view(batch_size * h * w, num_channels)
-
-        cls_ids = segmentation.unique()
-        for cls_id in cls_ids:
-            if cls_id == self.ignore_index:
-                continue
-
-            # --(B, H, W) --> (B*H*W,)
-            seg_cls = segmentation.view(-1)
-            # --extract the corresponding feats: (K, C)
-            feats_cls = features[seg_cls == cls_id]
-            # --init memory by using extracted features
-            need_update = True
-            for idx in range(self.num_feats_per_cls):
-                if (self.memory[cls_id][idx] == 0).sum() == self.feats_channels:
-                    self.memory[cls_id][idx].data.copy_(feats_cls.mean(0))
-                    need_update = False
-                    break
-            if not need_update:
-                continue
-
-            # --update according to the selected strategy
+        # --(B, C, H, W) --> (B*H*W, C)
+        features = features.permute(0, 2, 3, 1).reshape(batch_size * h * w, num_channels).to(memory.dtype)
+        # --(B, H, W) --> (B*H*W,), the ignored pixels go to the extra class
+        seg = segmentation.long().view(-1)
+        valid_mask = (seg != self.ignore_index) & (seg >= 0) & (seg < self.num_classes)
+        seg = torch.where(valid_mask, seg, torch.full_like(seg, self.num_classes))
+
+        counts = torch.bincount(seg, minlength=self.num_classes + 1)[:self.num_classes]
+        present = counts > 0
+
+        # --init memory by using the mean of the extracted features
+        empty_slots = (memory == 0).all(dim=2)
+        has_empty_slot = empty_slots.any(dim=1)
+        first_empty_slot = empty_slots.float().argmax(dim=1)
+        init_mask = present & has_empty_slot
+        update_mask = present & ~has_empty_slot
+
+        cls_sums = features.new_zeros(self.num_classes + 1, num_channels).index_add_(0, seg, features)
+        cls_means = cls_sums[:self.num_classes] / counts.clamp_min(1).unsqueeze(1).to(features.dtype)
+
+        # --update according to the selected strategy
+        if self.strategy == 'mean':
+            assert self.num_feats_per_cls == 1
+            new_memory = cls_means.unsqueeze(1)
+        else:
+            padded_memory = torch.cat([memory, memory.new_zeros(1, *memory.shape[1:])])
             if self.num_feats_per_cls == 1:
-                if self.strategy == 'mean':
-                    feats_cls = feats_cls.mean(0)
-                elif self.strategy == 'cosine_similarity':
-                    similarity = F.cosine_similarity(feats_cls, self.memory[cls_id].data.expand_as(feats_cls))
-                    weight = (1 - similarity) / (1 - similarity).sum()
-                    feats_cls = (feats_cls * weight.unsqueeze(-1)).sum(0)
-
-                feats_cls = (1 - momentum) * self.memory[cls_id].data + momentum * feats_cls.unsqueeze(0)
-                self.memory[cls_id].data.copy_(feats_cls)
+                slots = torch.zeros_like(seg)
             else:
-                assert self.strategy in ['cosine_similarity']
-                # ----(K, C) * (C, num_feats_per_cls) --> (K, num_feats_per_cls)
-                relation = torch.matmul(
-                    F.normalize(feats_cls, p=2, dim=1),
-                    F.normalize(self.memory[cls_id].data.permute(1, 0).contiguous(), p=2, dim=0),
-                )
-                argmax = relation.argmax(dim=1)
-                # ----for saving memory during training
-                for idx in range(self.num_feats_per_cls):
-                    mask = argmax == idx
-                    feats_cls_iter = feats_cls[mask]
-                    memory_cls_iter = self.memory[cls_id].data[idx].unsqueeze(0).expand_as(feats_cls_iter)
-                    similarity = F.cosine_similarity(feats_cls_iter, memory_cls_iter)
-                    weight = (1 - similarity) / (1 - similarity).sum()
-
-                    feats_cls_iter = (feats_cls_iter * weight.unsqueeze(-1)).sum(0)
-                    feats_cls_iter = self.memory[cls_id].data[idx] * (1 - momentum) + feats_cls_iter * momentum
-                    self.memory[cls_id].data[idx].copy_(feats_cls_iter)
+                # ----(B*H*W, C) x (B*H*W, C) --> (B*H*W, num_feats_per_cls)
+                norm_features = F.normalize(features, p=2, dim=1)
+                norm_memory = F.normalize(padded_memory, p=2, dim=2)
+                relation = torch.stack([
+                    torch.sum(norm_features * norm_memory[seg, idx], dim=1)
+                    for idx in range(self.num_feats_per_cls)
+                ], dim=1)
+                slots = relation.argmax(dim=1)
+
+            groups = seg * self.num_feats_per_cls + slots
+            similarity = F.cosine_similarity(features, padded_memory.view(-1, num_channels)[groups])
+            weight = 1 - similarity
+
+            num_groups = (self.num_classes + 1) * self.num_feats_per_cls
+            weight_sums = weight.new_zeros(num_groups).index_add_(0, groups, weight)
+            weighted_sums = features.new_zeros(num_groups, num_channels).index_add_(
+                0, groups, features * weight.unsqueeze(1))
+            new_memory = torch.where(
+                weight_sums.unsqueeze(1) > 0,
+                weighted_sums / weight_sums.unsqueeze(1).clamp_min(torch.finfo(weight_sums.dtype).tiny),
+                torch.zeros_like(weighted_sums)
+            )
+            new_memory = new_memory.view(self.num_classes + 1, self.num_feats_per_cls, num_channels)
+            new_memory = new_memory[:self.num_classes]
+
+        updated_memory = (1 - momentum) * memory + momentum * new_memory
+        memory.copy_(torch.where(update_mask.view(-1, 1, 1), updated_memory, memory))
+
+        init_slots_mask = F.one_hot(first_empty_slot, self.num_feats_per_cls).bool() & init_mask.view(-1, 1)
+        memory.copy_(torch.where(init_slots_mask.unsqueeze(2), cls_means.unsqueeze(1).expand_as(memory), memory))
 
         # syn the memory
         if dist.is_available() and dist.is_initialized():
-            memory = self.memory.data.clone()
             dist.all_reduce(memory.div_(dist.get_world_size()))
-            self.memory = nn.Parameter(memory, requires_grad=False)
 
 
 @HEADS.register_module()
@@ -97,14 +97,15 @@ class BaseWeightedLoss(nn.Module, metaclass=ABCMeta):
         loss, meta = self._forward(*args, **kwargs)
 
         if self.with_loss_jitter and loss.numel() == 1:
+            # the smoothed loss is kept on the device to avoid host syncs
             if self._smooth_loss is None:
-                self._smooth_loss = loss.item()
+                self._smooth_loss = loss.detach()
             else:
                 self._smooth_loss = (1.0 - self._loss_jitter_momentum) * self._smooth_loss + \
-                                    self._loss_jitter_momentum * loss.item()
+                                    self._loss_jitter_momentum * loss.detach()
 
-            jitter_sigma = self._jitter_sigma_factor * abs(self._smooth_loss)
-            jitter_point = torch.normal(0.0, jitter_sigma, [], device=loss.device, dtype=loss.dtype)
+            jitter_sigma = self._jitter_sigma_factor * self._smooth_loss.abs()
+            jitter_point = jitter_sigma * torch.randn([], device=loss.device, dtype=loss.dtype)
             loss = (loss - jitter_point).abs() + jitter_point
 
         self._last_loss_weight = self._loss_weight_scheduler(self.iter, self.epoch_size)
@@ -12,6 +12,8 @@
 ch/lovasz_losses.py Lovasz-Softmax and Jaccard hinge loss in PyTorch Maxim
 Berman 2018 ESAT-PSI KU Leuven (MIT License)"""
 
+from functools import partial
+
 import mmcv
 import torch
 import torch.nn.functional as F
@@ -24,17 +26,18 @@ from .base import BaseWeightedLoss
 def lovasz_grad(gt_sorted):
     """Computes gradient of the Lovasz extension w.r.t sorted errors.
 
-    See Alg. 1 in paper.
+    See Alg. 1 in paper. The gradients are computed along the last dimension,
+    so a batch of sorted ground truths of shape [..., P] is supported.
     """
 
-    gt_sum = gt_sorted.sum()
-    intersection = gt_sum - gt_sorted.float().cumsum(0)
-    union = gt_sum + (1 - gt_sorted).float().cumsum(0)
+    gt_sum = gt_sorted.sum(dim=-1, keepdim=True)
+    intersection = gt_sum - gt_sorted.float().cumsum(-1)
+    union = gt_sum + (1 - gt_sorted).float().cumsum(-1)
     jaccard = 1.0 - intersection / union
 
-    p = len(gt_sorted)
+    p = gt_sorted.size(-1)
     if p > 1:  # cover 1-pixel case
-        jaccard[1:p] = jaccard[1:p] - jaccard[0:-1]
+        jaccard[..., 1:p] = jaccard[..., 1:p] - jaccard[..., 0:-1]
 
     return jaccard
 
@@ -147,9 +150,14 @@ def lovasz_hinge(logits,
     return loss
 
 
-def lovasz_softmax_flat(probs, labels, classes='present', class_weight=None):
+def lovasz_softmax_flat(probs, labels, classes='present', class_weight=None, max_pixels=None, class_chunk_size=8):
     """Multi-class Lovasz-Softmax loss.
 
+    The errors of ``class_chunk_size`` classes are sorted at once as one
+    [chunk, P] matrix, so the temporary memory is bounded by the chunk size
+    times the number of pixels. ``max_pixels`` additionally bounds it by
+    subsampling the pixels.
+
     Args:
         probs (torch.Tensor): [P, C], class probabilities at each prediction
             (between 0 and 1).
@@ -157,44 +165,60 @@ def lovasz_softmax_flat(probs, labels, classes='present', class_weight=None):
         classes (str | list[int], optional): Classes chosen to calculate loss.
             'all' for all classes, 'present' for classes present in labels, or
             a list of classes to average. Default: 'present'.
-        class_weight (list[float], optional): The weight for each class.
-            Default: None.
+        class_weight (list[float] | torch.Tensor, optional): The weight for
+            each class. Default: None.
+        max_pixels (int, optional): If set, the loss is computed on a random
+            subset of ``max_pixels`` predictions. Default: None.
+        class_chunk_size (int): The number of classes sorted at once.
+            Default: 8.
 
     Returns:
         torch.Tensor: The calculated loss.
     """
 
+    assert class_chunk_size > 0
+
     if probs.numel() == 0:
         # only void pixels, the gradients should be 0
         return probs * 0.
 
+    if max_pixels is not None and probs.size(0) > max_pixels:
+        keep = torch.randperm(probs.size(0), device=probs.device)[:max_pixels]
+        probs, labels = probs[keep], labels[keep]
+
     C = probs.size(1)
-    losses = []
     class_to_sum = list(range(C)) if classes in ['all', 'present'] else classes
-    for c in class_to_sum:
-        fg = (labels == c).float()  # foreground for class c
-        if classes == 'present' and fg.sum() == 0:
-            continue
+    class_to_sum = torch.as_tensor(class_to_sum, dtype=torch.long, device=probs.device)
+
+    if C == 1 and len(classes) > 1:
+        raise ValueError('Sigmoid output possible only with 1 class')
 
+    losses, num_fg = [], []
+    for chunk in class_to_sum.split(class_chunk_size):
         if C == 1:
-            if len(classes) > 1:
-                raise ValueError('Sigmoid output possible only with 1 class')
-            class_pred = probs[:, 0]
+            class_pred = probs[:, :1].expand(-1, chunk.numel())
         else:
-            class_pred = probs[:, c]
+            class_pred = probs[:, chunk]
 
-        errors = (fg - class_pred).abs()
-        errors_sorted, perm = torch.sort(errors, 0, descending=True)
-        perm = perm.data
-        fg_sorted = fg[perm]
-        loss = torch.dot(errors_sorted, lovasz_grad(fg_sorted))
+        # foregrounds and errors of the chunk of classes, [chunk, P]
+        fg = (labels.view(1, -1) == chunk.view(-1, 1)).float()
+        errors = (fg - class_pred.t()).abs()
+        errors_sorted, perm = torch.sort(errors, 1, descending=True)
+        fg_sorted = fg.gather(1, perm.data)
+        losses.append(torch.sum(errors_sorted * lovasz_grad(fg_sorted), dim=1))
+        num_fg.append(fg.sum(dim=1))
+    losses = torch.cat(losses)
 
-        if class_weight is not None:
-            loss *= class_weight[c]
+    if class_weight is not None:
+        class_weight = torch.as_tensor(class_weight, dtype=losses.dtype, device=losses.device)
+        losses = losses * class_weight[class_to_sum]
 
-        losses.append(loss)
+    if classes == 'present':
+        # the absent classes are masked out instead of skipped
+        present = (torch.cat(num_fg) > 0).float()
+        return torch.sum(losses * present) / present.sum().clamp_min(1.0)
 
-    return torch.stack(losses).mean()
+    return losses.mean()
 
 
 def lovasz_softmax(probs,
@@ -204,7 +228,9 @@ def lovasz_softmax(probs,
                    class_weight=None,
                    reduction='mean',
                    avg_factor=None,
-                   ignore_index=255):
+                   ignore_index=255,
+                   max_pixels=None,
+                   class_chunk_size=8):
     """Multi-class Lovasz-Softmax loss.
 
     Args:
@@ -217,8 +243,8 @@ def lovasz_softmax(probs,
             a list of classes to average. Default: 'present'.
         per_image (bool, optional): If per_image is True, compute the loss per
             image instead of per batch. Default: False.
-        class_weight (list[float], optional): The weight for each class.
-            Default: None.
+        class_weight (list[float] | torch.Tensor, optional): The weight for
+            each class. Default: None.
         reduction (str, optional): The method used to reduce the loss. Options
             are "none", "mean" and "sum". This parameter only works when
             per_image is True. Default: 'mean'.
@@ -226,6 +252,10 @@ def lovasz_softmax(probs,
             the loss. This parameter only works when per_image is True.
             Default: None.
         ignore_index (int | None): The label index to be ignored. Default: 255.
+        max_pixels (int, optional): If set, the loss is computed on a random
+            subset of ``max_pixels`` predictions. Default: None.
+        class_chunk_size (int): The number of classes sorted at once.
+            Default: 8.
 
     Returns:
         torch.Tensor: The calculated loss.
@@ -236,7 +266,9 @@ def lovasz_softmax(probs,
             lovasz_softmax_flat(
                 *flatten_probs(prob.unsqueeze(0), label.unsqueeze(0), ignore_index),
                 classes=classes,
-                class_weight=class_weight)
+                class_weight=class_weight,
+                max_pixels=max_pixels,
+                class_chunk_size=class_chunk_size)
             for prob, label in zip(probs, labels)
         ]
         loss = weight_reduce_loss(torch.stack(loss), None, reduction, avg_factor)
@@ -244,7 +276,9 @@ def lovasz_softmax(probs,
         loss = lovasz_softmax_flat(
             *flatten_probs(probs, labels, ignore_index),
             classes=classes,
-            class_weight=class_weight
+            class_weight=class_weight,
+            max_pixels=max_pixels,
+            class_chunk_size=class_chunk_size
         )
 
     return loss
@@ -272,6 +306,10 @@ class LovaszLoss(BaseWeightedLoss):
         class_weight (list[float] | str, optional): Weight of each class. If in
             str format, read them from a file. Defaults to None.
         loss_weight (float, optional): Weight of the loss. Defaults to 1.0.
+        max_pixels (int, optional): If set, the multi-class loss is computed on
+            a random subset of ``max_pixels`` pixels. Defaults to None.
+        class_chunk_size (int, optional): The number of classes the
+            multi-class loss sorts at once. Defaults to 8.
     """
 
     def __init__(self,
@@ -280,6 +318,8 @@ class LovaszLoss(BaseWeightedLoss):
                  per_image=False,
                  class_weight=None,
                  scale_cfg=None,
+                 max_pixels=None,
+                 class_chunk_size=8,
                  **kwargs):
         super(LovaszLoss, self).__init__(**kwargs)
 
@@ -291,8 +331,9 @@ class LovaszLoss(BaseWeightedLoss):
         if loss_type == 'binary':
             self.cls_criterion = lovasz_hinge
         else:
-            self.cls_criterion = lovasz_softmax
+            self.cls_criterion = partial(lovasz_softmax, max_pixels=max_pixels, class_chunk_size=class_chunk_size)
 
+        self.loss_type = loss_type
         self.classes = classes
         self.per_image = per_image
         self.class_weight = get_class_weight(class_weight)
@@ -300,7 +341,7 @@ class LovaszLoss(BaseWeightedLoss):
         self.last_scale, self.scale_scheduler = None, None
         if scale_cfg is not None:
             self.scale_scheduler = build_scheduler(scale_cfg)
-        if self.cls_criterion == lovasz_softmax:
+        if self.loss_type == 'multi_class':
             assert self.scale_scheduler is not None
 
     @property
@@ -324,7 +365,7 @@ class LovaszLoss(BaseWeightedLoss):
             class_weight = None
 
         # if multi-class loss, transform logits to probs
-        if self.cls_criterion == lovasz_softmax:
+        if self.loss_type == 'multi_class':
             self.last_scale = self.scale_scheduler.get_scale_and_increment_step()
             cls_score = F.softmax(self.last_scale * cls_score, dim=1)
 
@@ -14,16 +14,38 @@ from .. import builder
 
 
 class BasePixelLoss(BaseWeightedLoss):
+    """Base class for the per-pixel losses.
+
+    The sparsity diagnostics in the returned meta are detached device tensors,
+    so the loss does not synchronize with the host. They are computed every
+    ``diagnostics_interval`` iterations only and are missing from the meta
+    otherwise.
+
+    Args:
+        scale_cfg (dict, optional): Scheduler of the logits scale.
+        pr_product (bool): Whether to apply the PR-product. Default: False.
+        conf_penalty_weight (dict, optional): Scheduler of the confidence
+            penalty weight.
+        border_reweighting (bool): Whether to reweight the losses by the
+            pixel weights. Default: False.
+        diagnostics_interval (int): Interval of computing the sparsity
+            diagnostics. Default: 1.
+    """
+
     def __init__(self,
                  scale_cfg=None,
                  pr_product=False,
                  conf_penalty_weight=None,
                  border_reweighting=False,
+                 diagnostics_interval=1,
                  **kwargs):
         super(BasePixelLoss, self).__init__(**kwargs)
 
+        assert isinstance(diagnostics_interval, int) and diagnostics_interval > 0
+
         self._enable_pr_product = pr_product
         self._border_reweighting = border_reweighting
+        self._diagnostics_interval = diagnostics_interval
 
         self._reg_weight_scheduler = builder.build_scheduler(conf_penalty_weight)
         self._scale_scheduler = builder.build_scheduler(scale_cfg, default_value=1.0)
@@ -66,11 +88,16 @@ class BasePixelLoss(BaseWeightedLoss):
 
         return out_values
 
+    @property
+    def with_diagnostics(self):
+        return self.iter % self._diagnostics_interval == 0
+
     @staticmethod
     def _sparsity(values, valid_mask):
         with torch.no_grad():
-            valid_values = values[valid_mask]
-            sparsity = 1.0 - float(valid_values.count_nonzero().item()) / max(1.0, float(valid_mask.sum().item()))
+            num_nonzero = torch.sum((values != 0) & valid_mask)
+            num_valid = torch.sum(valid_mask).clamp_min(1)
+            sparsity = 1.0 - num_nonzero.float() / num_valid.float()
 
             return sparsity
 
@@ -99,12 +126,10 @@ class BasePixelLoss(BaseWeightedLoss):
             losses = pixel_weights.squeeze(1) * losses
 
         losses = torch.where(valid_mask, losses, torch.zeros_like(losses))
-        raw_sparsity = self._sparsity(losses, valid_mask)
 
-        weight, weight_sparsity = None, 0.0
+        weight = None
         if self.sampler is not None:
             weight = self.sampler(losses, output, valid_labels, valid_mask)
-            weight_sparsity = self._sparsity(weight, valid_mask)
 
         loss = weight_reduce_loss(
             losses,
@@ -117,9 +142,10 @@ class BasePixelLoss(BaseWeightedLoss):
             weight=self.last_loss_weight,
             reg_weight=self.last_reg_weight,
             scale=self.last_scale,
-            raw_sparsity=raw_sparsity,
-            weight_sparsity=weight_sparsity
         )
+        if self.with_diagnostics:
+            meta['raw_sparsity'] = self._sparsity(losses, valid_mask)
+            meta['weight_sparsity'] = self._sparsity(weight, valid_mask) if weight is not None else 0.0
 
         return loss, meta
 
@@ -17,6 +17,8 @@ import torch.distributed as dist
 import torch.nn as nn
 from mmcv.runner import auto_fp16
 
+from mmseg.core import ModuleProfiler
+
 
 class BaseSegmentor(nn.Module):
     """Base class for segmentors."""
@@ -74,6 +76,22 @@ class BaseSegmentor(nn.Module):
     def set_step_params(self, init_iter, epoch_size):
         pass
 
+    def profile(self, depth=2, trace_file=None):
+        """Build a :class:`ModuleProfiler` of the segmentor.
+
+        Args:
+            depth (int): The maximum depth of the profiled submodules, e.g. 1
+                for the backbone and the heads, 2 for their stages.
+                Default: 2.
+            trace_file (str, optional): The Chrome trace file. Default: None.
+
+        Returns:
+            ModuleProfiler: The profiler, use it as a context manager or call
+                ``attach()`` and ``detach()``.
+        """
+
+        return ModuleProfiler(self, depth=depth, trace_file=trace_file)
+
     def init_weights(self, pretrained=None):
         """Initialize the weights in segmentor.
 
@@ -196,7 +214,9 @@ class BaseSegmentor(nn.Module):
         Returns:
             tuple[Tensor, dict]: (loss, log_vars), loss is the loss tensor
                 which may be a weighted sum of all losses, log_vars contains
-                all the variables to be sent to the logger.
+                all the variables to be sent to the logger. The tensor
+                variables are returned as detached device scalars, which are
+                moved to the host by :class:`LogVarsSyncHook`.
         """
         log_vars = OrderedDict()
         for var_name, var_value in losses.items():
@@ -215,16 +235,22 @@ class BaseSegmentor(nn.Module):
         )
 
         log_vars['loss'] = loss
-        for var_name, var_value in log_vars.items():
-            if isinstance(var_value, (int, float)):
-                continue
+
+        # all tensors are reduced at once and stay on the device
+        tensor_names = [
+            var_name for var_name, var_value in log_vars.items()
+            if isinstance(var_value, torch.Tensor)
+        ]
+        if len(tensor_names) > 0:
+            var_values = torch.stack([log_vars[var_name].detach().float() for var_name in tensor_names])
 
             # reduce loss when distributed training
             if dist.is_available() and dist.is_initialized():
-                var_value = var_value.data.clone()
-                dist.all_reduce(var_value.div_(dist.get_world_size()))
+                var_values = var_values.clone()
+                dist.all_reduce(var_values.div_(dist.get_world_size()))
 
-            log_vars[var_name] = var_value.item()
+            for var_name, var_value in zip(tensor_names, var_values.unbind(0)):
+                log_vars[var_name] = var_value
 
         return loss, log_vars
 
@@ -5,6 +5,8 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+from collections import OrderedDict
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -15,6 +17,9 @@ from .. import builder
 from ..builder import SEGMENTORS
 from .base import BaseSegmentor
 
+# the number of the input shapes whose sliding-window layouts are kept
+_SLIDE_WINDOWS_CACHE_SIZE = 4
+
 
 @SEGMENTORS.register_module()
 class EncoderDecoder(BaseSegmentor):
@@ -44,6 +49,9 @@ class EncoderDecoder(BaseSegmentor):
         self.train_cfg = train_cfg
         self.test_cfg = test_cfg
 
+        # sliding-window layouts and count matrices of the last input shapes
+        self._slide_windows_cache = OrderedDict()
+
         self.init_weights(pretrained=pretrained)
 
         assert self.with_decode_head
@@ -211,22 +219,32 @@ class EncoderDecoder(BaseSegmentor):
 
         return losses
 
-    # TODO refactor
-    def slide_inference(self, img, img_meta, rescale):
-        """Inference by sliding-window with overlap.
+    def _get_slide_windows(self, img):
+        """Get the sliding-window layout for the shape of ``img``.
 
-        If h_crop > h_img or w_crop > w_img, the small patch will be used to
-        decode without padding.
+        The crop coordinates and the count matrix depend only on the image
+        and window sizes, so they are computed once per input shape and then
+        reused. The layouts of the last few input shapes are kept.
+
+        Returns:
+            list[tuple[int]]: The (y1, y2, x1, x2) coordinates of each crop.
+            Tensor: The number of crops covering each pixel, of shape
+                (1, 1, H, W).
         """
 
         h_stride, w_stride = self.test_cfg.stride
         h_crop, w_crop = self.test_cfg.crop_size
-        batch_size, _, h_img, w_img = img.size()
-        num_classes = self.num_classes
+        h_img, w_img = img.shape[2:]
+
+        key = (h_img, w_img, h_crop, w_crop, h_stride, w_stride, img.device, img.dtype)
+        if key in self._slide_windows_cache:
+            self._slide_windows_cache.move_to_end(key)
+            return self._slide_windows_cache[key]
+
         h_grids = max(h_img - h_crop + h_stride - 1, 0) // h_stride + 1
         w_grids = max(w_img - w_crop + w_stride - 1, 0) // w_stride + 1
-        preds = img.new_zeros((batch_size, num_classes, h_img, w_img))
-        count_mat = img.new_zeros((batch_size, 1, h_img, w_img))
+        windows = []
+        count_mat = img.new_zeros((1, 1, h_img, w_img))
         for h_idx in range(h_grids):
             for w_idx in range(w_grids):
                 y1 = h_idx * h_stride
@@ -235,14 +253,53 @@ class EncoderDecoder(BaseSegmentor):
                 x2 = min(x1 + w_crop, w_img)
                 y1 = max(y2 - h_crop, 0)
                 x1 = max(x2 - w_crop, 0)
-                crop_img = img[:, :, y1:y2, x1:x2]
-                crop_seg_logit = self.encode_decode(crop_img, img_meta)
-                preds += F.pad(crop_seg_logit,
-                               (int(x1), int(preds.shape[3] - x2), int(y1),
-                                int(preds.shape[2] - y2)))
-
+                windows.append((int(y1), int(y2), int(x1), int(x2)))
                 count_mat[:, :, y1:y2, x1:x2] += 1
         assert (count_mat == 0).sum() == 0
+
+        # the layout is traced as constants while exporting to ONNX
+        if not torch.onnx.is_in_onnx_export():
+            self._slide_windows_cache[key] = windows, count_mat
+            # the inputs of variable size would grow the cache without a limit
+            while len(self._slide_windows_cache) > _SLIDE_WINDOWS_CACHE_SIZE:
+                self._slide_windows_cache.popitem(last=False)
+
+        return windows, count_mat
+
+    def slide_inference(self, img, img_meta, rescale):
+        """Inference by sliding-window with overlap.
+
+        If h_crop > h_img or w_crop > w_img, the small patch will be used to
+        decode without padding. All crops have the same size, so
+        ``test_cfg.slide_batch_size`` crops per image are stacked into a
+        single forward pass (1 by default, all crops if set to None) and
+        their logits are accumulated in place.
+        """
+
+        batch_size, _, h_img, w_img = img.size()
+        num_classes = self.num_classes
+        windows, count_mat = self._get_slide_windows(img)
+        slide_batch_size = self.test_cfg.get('slide_batch_size', 1)
+        if slide_batch_size is None:
+            slide_batch_size = len(windows)
+        assert slide_batch_size > 0
+
+        preds = img.new_zeros((batch_size, num_classes, h_img, w_img))
+        for i in range(0, len(windows), slide_batch_size):
+            batch_windows = windows[i:i + slide_batch_size]
+            crop_imgs = torch.cat([
+                img[:, :, y1:y2, x1:x2] for y1, y2, x1, x2 in batch_windows
+            ], dim=0)
+            crop_seg_logits = self.encode_decode(crop_imgs, img_meta)
+            for crop_seg_logit, (y1, y2, x1, x2) in zip(
+                    crop_seg_logits.split(batch_size), batch_windows):
+                if torch.onnx.is_in_onnx_export():
+                    # keep the export graph free of in-place slice updates
+                    preds += F.pad(crop_seg_logit,
+                                   (x1, w_img - x2, y1, h_img - y2))
+                else:
+                    preds[:, :, y1:y2, x1:x2] += crop_seg_logit
+
         if torch.onnx.is_in_onnx_export():
             # cast count_mat to constant while exporting to ONNX
             count_mat = torch.from_numpy(
@@ -311,6 +368,21 @@ class EncoderDecoder(BaseSegmentor):
 
         return output
 
+    def _seg_pred_to_numpy(self, seg_pred):
+        """Move the predicted labels to host memory as a list of arrays.
+
+        With ``test_cfg.output_uint8`` the labels are cast to uint8 on the
+        device first, which cuts the host transfer by 8x compared to int64.
+        """
+
+        if self.test_cfg.get('output_uint8', False) and self.num_classes <= 256:
+            seg_pred = seg_pred.to(torch.uint8)
+        seg_pred = seg_pred.cpu().numpy()
+        # unravel batch dim
+        seg_pred = list(seg_pred)
+
+        return seg_pred
+
     def simple_test(self, img, img_meta, rescale=True, output_logits=False):
         """Simple test with single image."""
 
@@ -327,26 +399,104 @@ class EncoderDecoder(BaseSegmentor):
 
             return seg_pred
 
-        seg_pred = seg_pred.cpu().numpy()
-        seg_pred = list(seg_pred)
+        if output_logits:
+            seg_pred = list(seg_pred.cpu().numpy())
+        else:
+            seg_pred = self._seg_pred_to_numpy(seg_pred)
 
         return seg_pred
 
-    def aug_test(self, imgs, img_metas, rescale=True):
+    def _get_aug_test_size(self, ori_shape):
+        """Get the resolution the augmented predictions are accumulated at.
+
+        ``test_cfg.aug_test_size`` can be None to use the original image
+        shape, a float ratio of the original shape or an (h, w) tuple.
+        """
+
+        aug_test_size = self.test_cfg.get('aug_test_size', None)
+        if aug_test_size is None:
+            return tuple(ori_shape[:2])
+        elif isinstance(aug_test_size, float):
+            return tuple(int(x * aug_test_size + 0.5) for x in ori_shape[:2])
+        else:
+            assert len(aug_test_size) == 2
+            return tuple(aug_test_size)
+
+    def aug_test(self, imgs, img_metas, rescale=True, output_logits=False):
         """Test with augmentations.
 
-        Only rescale=True is supported.
+        Only rescale=True is supported. Augmentations with the same input
+        size (e.g. a scale and its flip) are grouped into batches of up to
+        ``test_cfg.aug_batch_size`` (1 by default, no limit if None) for a
+        single forward pass. Their logits are resized to the
+        ``test_cfg.aug_test_size`` resolution, where the softmax scores are
+        accumulated in place and upsampled to the original shape once at the
+        end.
         """
         # aug_test rescale all imgs back to ori_shape for now
         assert rescale
-        # to save memory, we get augmented seg logit inplace
-        seg_logit = self.inference(imgs[0], img_metas[0], rescale)
-        for i in range(1, len(imgs)):
-            cur_seg_logit = self.inference(imgs[i], img_metas[i], rescale)
-            seg_logit += cur_seg_logit
-        seg_logit /= len(imgs)
+        assert self.test_cfg.mode in ['slide', 'whole']
+
+        ori_shape = img_metas[0][0]['ori_shape']
+        assert all(_['ori_shape'] == ori_shape for img_meta in img_metas for _ in img_meta)
+        aug_test_size = self._get_aug_test_size(ori_shape)
+
+        aug_batch_size = self.test_cfg.get('aug_batch_size', 1)
+        groups = dict()
+        for i, img in enumerate(imgs):
+            groups.setdefault(tuple(img.shape), []).append(i)
+        aug_batches = []
+        for aug_ids in groups.values():
+            step = len(aug_ids) if aug_batch_size is None else aug_batch_size
+            aug_batches.extend(aug_ids[j:j + step] for j in range(0, len(aug_ids), step))
+
+        batch_size = imgs[0].shape[0]
+        seg_logit = None
+        for aug_ids in aug_batches:
+            batch_img = torch.cat([imgs[i] for i in aug_ids], dim=0)
+            if self.test_cfg.mode == 'slide':
+                batch_seg_logit = self.slide_inference(batch_img, img_metas[aug_ids[0]], rescale=False)
+            else:
+                batch_seg_logit = self.whole_inference(batch_img, img_metas[aug_ids[0]], rescale=False)
+
+            for i, cur_seg_logit in zip(aug_ids, batch_seg_logit.split(batch_size)):
+                img_meta = img_metas[i][0]
+                if img_meta['flip']:
+                    flip_direction = img_meta['flip_direction']
+                    assert flip_direction in ['horizontal', 'vertical']
+                    if flip_direction == 'horizontal':
+                        cur_seg_logit = cur_seg_logit.flip(dims=(3, ))
+                    elif flip_direction == 'vertical':
+                        cur_seg_logit = cur_seg_logit.flip(dims=(2, ))
+
+                if tuple(cur_seg_logit.shape[2:]) != aug_test_size:
+                    cur_seg_logit = resize(
+                        cur_seg_logit,
+                        size=aug_test_size,
+                        mode='bilinear',
+                        align_corners=self.align_corners,
+                        warning=False)
+                cur_seg_logit = F.softmax(cur_seg_logit, dim=1)
+
+                # to save memory, we get augmented seg logit inplace
+                if seg_logit is None:
+                    seg_logit = cur_seg_logit
+                else:
+                    seg_logit += cur_seg_logit
+
+        if aug_test_size != tuple(ori_shape[:2]):
+            seg_logit = resize(
+                seg_logit,
+                size=ori_shape[:2],
+                mode='bilinear',
+                align_corners=self.align_corners,
+                warning=False)
+
+        if output_logits:
+            seg_logit /= len(imgs)
+            return list(seg_logit.cpu().numpy())
+
         seg_pred = seg_logit.argmax(dim=1)
-        seg_pred = seg_pred.cpu().numpy()
-        # unravel batch dim
-        seg_pred = list(seg_pred)
+        seg_pred = self._seg_pred_to_numpy(seg_pred)
+
         return seg_pred
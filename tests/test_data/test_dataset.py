@@ -1,13 +1,17 @@
+import importlib.util
 import os.path as osp
+import pickle
+import tempfile
 from unittest.mock import MagicMock, patch
 
+import mmcv
 import numpy as np
 import pytest
 
 from mmseg.core.evaluation import get_classes, get_palette
 from mmseg.datasets import (DATASETS, ADE20KDataset, CityscapesDataset,
-                            ConcatDataset, CustomDataset, PascalVOCDataset,
-                            RepeatDataset)
+                            ConcatDataset, CustomDataset, PackedDataset,
+                            PascalVOCDataset, RepeatDataset)
 
 
 def test_classes():
@@ -151,7 +155,7 @@ def test_custom_dataset():
     assert isinstance(test_data, dict)
 
     # get gt seg map
-    gt_seg_maps = train_dataset.get_gt_seg_maps()
+    gt_seg_maps = list(train_dataset.get_gt_seg_maps())
     assert len(gt_seg_maps) == 5
 
     # evaluation
@@ -299,3 +303,146 @@ def test_custom_dataset_custom_palette():
         palette=[[100, 100, 100], [200, 200, 200]],
         test_mode=True)
     assert tuple(dataset.PALETTE) == tuple([[100, 100, 100], [200, 200, 200]])
+
+
+def test_packed_dataset():
+    pipeline = [
+        dict(type='LoadImageFromFile'),
+        dict(type='LoadAnnotations', reduce_zero_label=True),
+    ]
+    custom_dataset = CustomDataset(
+        pipeline,
+        data_root=osp.join(osp.dirname(__file__), '../data/pseudo_dataset'),
+        img_dir='imgs/',
+        ann_dir='gts/',
+        img_suffix='_img.jpg',
+        seg_map_suffix='_gt.png',
+        split='splits/train.txt')
+
+    # build the shard with the converter itself
+    pack_file = osp.join(
+        osp.dirname(__file__), '../../tools/convert_datasets/pack.py')
+    spec = importlib.util.spec_from_file_location('pack', pack_file)
+    pack = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pack)
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    pack.pack_dataset(custom_dataset, tmp_dir.name, 'train')
+    index = mmcv.load(osp.join(tmp_dir.name, 'train.json'))
+    assert index['shard'] == 'train.bin'
+    for sample in index['samples']:
+        assert sample['img']['offset'] % pack.ALIGNMENT == 0
+        assert sample['ann']['offset'] % pack.ALIGNMENT == 0
+
+    packed_dataset = PackedDataset(
+        pipeline, index_file='train.json', data_root=tmp_dir.name)
+    assert len(packed_dataset) == len(custom_dataset)
+    for idx in range(len(packed_dataset)):
+        expected = custom_dataset[idx]
+        results = packed_dataset[idx]
+        assert results['ori_filename'] == expected['ori_filename']
+        assert results['img_shape'] == expected['img_shape']
+        np.testing.assert_array_equal(results['img'], expected['img'])
+        np.testing.assert_array_equal(results['gt_semantic_seg'],
+                                      expected['gt_semantic_seg'])
+        np.testing.assert_array_equal(
+            packed_dataset.get_gt_seg_map_by_idx(idx),
+            custom_dataset.get_gt_seg_map_by_idx(idx))
+
+    pseudo_results = [
+        custom_dataset.get_gt_seg_map_by_idx(idx)
+        for idx in range(len(custom_dataset))
+    ]
+    assert packed_dataset.evaluate(pseudo_results) == \
+        custom_dataset.evaluate(pseudo_results)
+
+    del packed_dataset
+    tmp_dir.cleanup()
+
+
+def test_iter_gt_seg_maps():
+    dataset_cfg = dict(
+        pipeline=[],
+        data_root=osp.join(osp.dirname(__file__), '../data/pseudo_dataset'),
+        img_dir='imgs/',
+        ann_dir='gts/',
+        img_suffix='_img.jpg',
+        seg_map_suffix='_gt.png')
+    serial_dataset = CustomDataset(gt_prefetch_workers=1, **dataset_cfg)
+    dataset = CustomDataset(
+        gt_prefetch_workers=2, gt_cache_cfg=dict(max_size=16), **dataset_cfg)
+
+    expected = [
+        serial_dataset.get_gt_seg_map_by_idx(idx)
+        for idx in range(len(serial_dataset))
+    ]
+    indices = list(reversed(range(len(dataset))))
+    for _ in range(2):
+        gt_seg_maps = list(dataset.iter_gt_seg_maps(indices))
+        assert len(gt_seg_maps) == len(indices)
+        for idx, gt_seg_map in zip(indices, gt_seg_maps):
+            np.testing.assert_array_equal(gt_seg_map, expected[idx])
+    assert len(dataset.gt_cache) == len(dataset)
+
+    # the second round reads the maps from the cache
+    with patch.object(dataset, 'get_gt_seg_map_by_idx') as get_gt_seg_map:
+        pseudo_results = [np.copy(gt_seg_map) for gt_seg_map in expected]
+        assert dataset.evaluate(pseudo_results) == \
+            serial_dataset.evaluate(pseudo_results)
+        get_gt_seg_map.assert_not_called()
+
+    # the consumer can stop early
+    gt_seg_maps = dataset.iter_gt_seg_maps()
+    np.testing.assert_array_equal(next(gt_seg_maps), expected[0])
+    gt_seg_maps.close()
+
+
+def test_prefetch_gt_seg_maps():
+    dataset = CustomDataset(
+        pipeline=[],
+        data_root=osp.join(osp.dirname(__file__), '../data/pseudo_dataset'),
+        img_dir='imgs/',
+        ann_dir='gts/',
+        img_suffix='_img.jpg',
+        seg_map_suffix='_gt.png',
+        gt_prefetch_workers=2)
+    expected = [
+        dataset.get_gt_seg_map_by_idx(idx) for idx in range(len(dataset))
+    ]
+
+    # the maps of the next batches are decoded before they are evaluated
+    dataset.prefetch_gt_seg_maps(range(len(dataset)))
+    executor = dataset._gt_executor
+    assert len(dataset._gt_prefetched) == min(4, len(dataset))
+    accumulator = dataset.pre_eval([], [])
+    for idx in range(len(dataset)):
+        assert idx in dataset._gt_prefetched
+        accumulator = dataset.pre_eval(np.copy(expected[idx]), idx, accumulator)
+    assert len(dataset._gt_prefetched) == 0
+    assert dataset._gt_executor is executor
+    assert dataset.evaluate(accumulator)['aAcc'] == 1.0
+
+    # the thread pool is not pickled with the dataset
+    dataset = pickle.loads(pickle.dumps(dataset))
+    assert dataset._gt_executor is None
+
+    # the subclasses that do not call CustomDataset.__init__ get the defaults
+    class ProxyDataset(CustomDataset):
+
+        def __init__(self, dataset):
+            self.dataset = dataset
+            self.ignore_index = 255
+            self.reduce_zero_label = False
+            self.CLASSES = None
+
+        def __len__(self):
+            return len(self.dataset)
+
+        def get_gt_seg_map_by_idx(self, idx):
+            return self.dataset.get_gt_seg_map_by_idx(idx)
+
+    proxy_dataset = ProxyDataset(dataset)
+    accumulator = proxy_dataset.pre_eval(
+        [np.copy(gt_seg_map) for gt_seg_map in expected],
+        list(range(len(expected))))
+    assert proxy_dataset.evaluate(accumulator)['aAcc'] == 1.0
@@ -1,11 +1,13 @@
 import copy
 import os.path as osp
 import tempfile
+from unittest.mock import MagicMock
 
 import mmcv
 import numpy as np
 
 from mmseg.datasets.pipelines import LoadAnnotations, LoadImageFromFile
+from mmseg.datasets.pipelines.cache import DecodedCache
 
 
 class TestLoading(object):
@@ -101,6 +103,86 @@ class TestLoading(object):
         assert results['gt_semantic_seg'].shape == (288, 512)
         assert results['gt_semantic_seg'].dtype == np.uint8
 
+    def test_load_with_cache(self):
+        img_results = dict(
+            img_prefix=self.data_prefix, img_info=dict(filename='color.jpg'))
+        seg_results = dict(
+            seg_prefix=self.data_prefix,
+            ann_info=dict(seg_map='seg.png'),
+            seg_fields=[])
+        img_ref = LoadImageFromFile()(copy.deepcopy(img_results))['img']
+        seg_ref = LoadAnnotations(reduce_zero_label=True)(
+            copy.deepcopy(seg_results))['gt_semantic_seg']
+
+        for shared in (False, True):
+            load_img = LoadImageFromFile(
+                to_float32=True, cache_cfg=dict(max_size=16, shared=shared))
+            load_ann = LoadAnnotations(
+                reduce_zero_label=True,
+                cache_cfg=dict(max_size=16, shared=shared))
+            for _ in range(2):
+                img = load_img(copy.deepcopy(img_results))['img']
+                seg = load_ann(copy.deepcopy(seg_results))['gt_semantic_seg']
+                assert img.dtype == np.float32
+                np.testing.assert_array_equal(img, img_ref)
+                np.testing.assert_array_equal(seg, seg_ref)
+            # the cached arrays are decoded once and left unmodified
+            assert len(load_img.cache) == 1
+            assert len(load_ann.cache) == 1
+            np.testing.assert_array_equal(
+                load_img.cache.get(osp.join(self.data_prefix, 'color.jpg')),
+                img_ref)
+
+    def test_decoded_cache_eviction(self):
+        for shared in (False, True):
+            # room for two 0.4 MB arrays
+            cache = DecodedCache(max_size=1, shared=shared)
+            arrays = [
+                np.full((400, 1024), i, dtype=np.uint8) for i in range(3)
+            ]
+            cache.put('a', arrays[0])
+            cache.put('b', arrays[1])
+            # 'a' becomes the most recently used entry
+            np.testing.assert_array_equal(cache.get('a'), arrays[0])
+            cache.put('c', arrays[2])
+            assert 'b' not in cache
+            assert cache.get('b') is None
+            np.testing.assert_array_equal(cache.get('a'), arrays[0])
+            np.testing.assert_array_equal(cache.get('c'), arrays[2])
+            # arrays larger than the capacity are not cached
+            cache.put('d', np.zeros((2048, 1024), dtype=np.uint8))
+            assert 'd' not in cache and len(cache) == 2
+
+    def test_decoded_cache_batches(self):
+        cache = DecodedCache(max_size=1, shared=True)
+        arrays = [
+            np.full((100, 1000), i, dtype=np.uint8) for i in range(12)
+        ]
+        for i, array in enumerate(arrays[:10]):
+            cache.put(str(i), array)
+        assert len(cache) == 10
+
+        # the hits do not take the lock and send the access times in batches
+        cache._lock = MagicMock()
+        cache._access_times = MagicMock(wraps=cache._access_times)
+        cache.access_flush_size = 3
+        for i in range(2):
+            np.testing.assert_array_equal(cache.get(str(i)), arrays[i])
+        assert cache._access_times.update.call_count == 0
+        np.testing.assert_array_equal(cache.get('2'), arrays[2])
+        assert cache._access_times.update.call_count == 1
+        assert not cache._lock.__enter__.called
+
+        # the full cache is evicted down to its low water mark at once
+        cache._access_times = cache._access_times._mock_wraps
+        cache.put('10', arrays[10])
+        assert len(cache) == 9
+        assert all(str(i) in cache for i in range(3))
+        assert '3' not in cache and '4' not in cache
+        cache.put('11', arrays[11])
+        assert len(cache) == 10
+        np.testing.assert_array_equal(cache.get('11'), arrays[11])
+
     def test_load_seg_custom_classes(self):
 
         test_img = np.random.rand(10, 10)
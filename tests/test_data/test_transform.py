@@ -476,3 +476,152 @@ def test_seg_rescale():
     rescale_module = build_from_cfg(transform, PIPELINES)
     rescale_results = rescale_module(results.copy())
     assert rescale_results['gt_semantic_seg'].shape == (h, w)
+
+
+def test_fused_geometric_transform():
+    from mmseg.datasets.pipelines import Compose, FusedGeometricTransform
+
+    img_norm_cfg = dict(
+        mean=[123.675, 116.28, 103.53],
+        std=[58.395, 57.12, 57.375],
+        to_rgb=True)
+    img = mmcv.imread(
+        osp.join(osp.dirname(__file__), '../data/color.jpg'), 'color')
+    seg = np.array(
+        Image.open(osp.join(osp.dirname(__file__), '../data/seg.png')))
+
+    for pad_cfg in [
+            dict(size=(320, 544), pad_val=3, seg_pad_val=255),
+            dict(size_divisor=32, pad_val=(1, 2, 3))
+    ]:
+        pipeline = [
+            dict(type='Resize', img_scale=(512, 256), ratio_range=(0.5, 1.0)),
+            dict(type='RandomCrop', crop_size=(200, 300)),
+            dict(type='RandomFlip', prob=0.5),
+            dict(type='PhotoMetricDistortion'),
+            dict(type='Normalize', **img_norm_cfg),
+            dict(type='Pad', **pad_cfg),
+            dict(type='DefaultFormatBundle'),
+        ]
+        fused = Compose(pipeline)
+        assert isinstance(fused.transforms[2], FusedGeometricTransform)
+        assert len(fused.transforms) == 3
+        reference = [build_from_cfg(t, PIPELINES) for t in pipeline]
+
+        for seed in range(4):
+            results = dict(
+                img=img.copy(),
+                aux_img=img.copy(),
+                gt_semantic_seg=seg.copy(),
+                seg_fields=['gt_semantic_seg'],
+                img_shape=img.shape,
+                ori_shape=img.shape,
+                pad_shape=img.shape,
+                scale_factor=1.0)
+
+            np.random.seed(seed)
+            fused_results = fused(copy.deepcopy(results))
+            np.random.seed(seed)
+            ref_results = copy.deepcopy(results)
+            for t in reference:
+                ref_results = t(ref_results)
+
+            assert fused_results.keys() == ref_results.keys()
+            for key in ['img', 'aux_img', 'gt_semantic_seg']:
+                fused_data = fused_results.pop(key)
+                ref_data = ref_results.pop(key)
+                assert fused_data.stack and ref_data.stack
+                assert fused_data.data.dtype == ref_data.data.dtype
+                assert fused_data.data.equal(ref_data.data)
+            np.testing.assert_equal(fused_results, ref_results)
+
+    # samples out of the fast path go through the original transforms
+    import cv2
+    transform = FusedGeometricTransform(
+        normalize=img_norm_cfg, pad=dict(size=(100, 100)))
+    with pytest.raises(cv2.error):
+        transform(
+            dict(img=img.copy(), gt_semantic_seg=seg.copy(), seg_fields=[]))
+
+
+def test_mask_compose():
+    from mmseg.datasets.pipelines import MaskCompose
+
+    img = mmcv.imread(
+        osp.join(osp.dirname(__file__), '../data/color.jpg'), 'color')
+    seg = np.array(
+        Image.open(osp.join(osp.dirname(__file__), '../data/seg.png')))
+
+    mask = MaskCompose._generate_mask((287, 511), (4, 16), downscale=4)
+    assert mask.shape == (287, 511) and mask.dtype == bool
+    assert 0.4 < mask.mean() < 0.6
+
+    for keep_original in (False, True):
+        transform = MaskCompose(
+            transforms=[dict(type='PhotoMetricDistortion')],
+            prob=1.0,
+            keep_original=keep_original)
+        results = dict(
+            img=img.copy(),
+            gt_semantic_seg=seg.copy(),
+            seg_fields=['gt_semantic_seg'])
+        results = transform(results)
+
+        assert results['img'].shape == img.shape
+        # the input is shared, but left untouched
+        assert results['gt_semantic_seg'].flags.writeable
+        np.testing.assert_array_equal(results['gt_semantic_seg'], seg)
+        assert results['seg_fields'] == ['gt_semantic_seg']
+        if keep_original:
+            assert results['aux_img'].shape == img.shape
+        else:
+            assert 'aux_img' not in results
+
+
+def test_mixup_bank():
+    import tempfile
+
+    img = mmcv.imread(
+        osp.join(osp.dirname(__file__), '../data/color.jpg'), 'color')
+    tmp_dir = tempfile.TemporaryDirectory()
+    mmcv.mkdir_or_exist(osp.join(tmp_dir.name, 'imgs'))
+    with open(osp.join(tmp_dir.name, 'annot.txt'), 'w') as f:
+        for i in range(3):
+            mmcv.imwrite(
+                np.full((300 + 10 * i, 400, 3), 50 * i, dtype=np.uint8),
+                osp.join(tmp_dir.name, 'imgs', f'{i}.png'))
+            f.write(f'{i}.png\n')
+
+    transform = build_from_cfg(
+        dict(
+            type='MixUp',
+            root_dir=tmp_dir.name,
+            annot='annot.txt',
+            imgs_root='imgs',
+            bank_size=2,
+            bank_img_size=(128, 256),
+            bank_refresh_interval=2), PIPELINES)
+    assert transform.bank[0].shape == (128, 256, 3)
+
+    for _ in range(5):
+        results = transform(dict(img=img.copy()))
+        assert results['img'].shape == img.shape
+        assert results['img'].dtype == np.uint8
+    assert transform.bank._num_steps == 5
+
+    # the 8-bit blend matches the float one up to rounding
+    mixup_image = np.random.randint(0, 256, img.shape, dtype=np.uint8)
+    float_mixed = (0.7 * img.astype(np.float32) +
+                   0.3 * mixup_image.astype(np.float32))
+    mixed = transform._blend_uint8(img.copy(), mixup_image, 0.3)
+    assert np.abs(mixed.astype(np.float32) - float_mixed).max() <= 1.5
+
+    # spawned workers attach to the same bank
+    bank = object.__new__(type(transform.bank))
+    bank.__setstate__(transform.bank.__getstate__())
+    np.testing.assert_array_equal(bank[1], transform.bank[1])
+    transform.bank._slots[:] = 7
+    assert (bank[0] == 7).all()
+
+    del bank, transform
+    tmp_dir.cleanup()
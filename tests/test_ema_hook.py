@@ -0,0 +1,126 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+import torch.nn as nn
+
+from mmseg.core.hooks import IterBasedEMAHook
+
+
+class ExampleModel(nn.Module):
+
+    def __init__(self):
+        super(ExampleModel, self).__init__()
+        self.conv = nn.Conv2d(3, 4, 3)
+        self.bn = nn.BatchNorm2d(4)
+
+
+def _train(hook, model, num_iters):
+    """Run the hook on random parameter updates, return the reference
+    averages computed with the per-parameter loop."""
+
+    runner = MagicMock()
+    runner.model = model
+    hook.before_run(runner)
+
+    ema = {name: param.detach().clone() for name, param in model.named_parameters()}
+    init_mode = True
+    for i in range(num_iters):
+        runner.iter = i
+        hook.before_train_iter(runner)
+        with torch.no_grad():
+            for param in model.parameters():
+                param.add_(torch.randn_like(param))
+
+        curr_iter = i + 1
+        if curr_iter > hook.skip_iters and curr_iter % hook.ema_interval == 0:
+            for name, param in model.named_parameters():
+                if init_mode:
+                    ema[name].copy_(param)
+                else:
+                    ema[name].mul_(1.0 - hook.momentum).add_(param, alpha=hook.momentum)
+            init_mode = False
+
+        hook.after_train_iter(runner)
+
+    return runner, ema
+
+
+@pytest.mark.parametrize('has_foreach', [True, False])
+@pytest.mark.parametrize('device', [None, 'cpu'])
+def test_ema_hook_update(has_foreach, device):
+    torch.manual_seed(0)
+    model = ExampleModel()
+    hook = IterBasedEMAHook(momentum=0.1, ema_interval=2, skip_iters=3, eval_interval=1000, device=device)
+
+    with patch('mmseg.core.hooks.ema._HAS_FOREACH', has_foreach):
+        _, ema = _train(hook, model, num_iters=11)
+
+    buffers = dict(model.named_buffers())
+    for name in ema:
+        ema_buffer = buffers[hook.param_ema_buffer[name]]
+        assert ema_buffer.device == torch.device('cpu')
+        assert torch.allclose(ema_buffer, ema[name], atol=1e-6)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='requires CUDA')
+@pytest.mark.parametrize('device', [
+    None, 'cpu', 'cuda:0',
+    pytest.param('cuda:1', marks=pytest.mark.skipif(torch.cuda.device_count() < 2, reason='requires 2 GPUs'))
+])
+def test_ema_hook_stream(device):
+    torch.manual_seed(0)
+    model = ExampleModel().cuda()
+    hook = IterBasedEMAHook(momentum=0.1, skip_iters=3, eval_interval=1000, device=device, use_stream=True)
+
+    recorded = []
+    record_stream = torch.Tensor.record_stream
+
+    def _record_stream(tensor, stream):
+        recorded.append((tensor.device, stream))
+        record_stream(tensor, stream)
+
+    with patch.object(torch.Tensor, 'record_stream', _record_stream):
+        _, ema = _train(hook, model, num_iters=11)
+    assert hook._stream is not None
+
+    hook._join_stream()
+    torch.cuda.synchronize()
+
+    # only the copies to another GPU are recorded on the side stream
+    num_updates = 11 - hook.skip_iters
+    expected_records = num_updates * len(hook._params) if device == 'cuda:1' else 0
+    assert len(recorded) == expected_records
+    assert all(d == torch.device(device) and stream == hook._stream for d, stream in recorded)
+
+    buffers = dict(model.named_buffers())
+    for name in ema:
+        ema_buffer = buffers[hook.param_ema_buffer[name]]
+        expected_device = torch.device(device) if device is not None else ema[name].device
+        assert ema_buffer.device == expected_device
+        assert torch.allclose(ema_buffer, ema[name].to(ema_buffer.device), atol=1e-6)
+
+
+def test_ema_hook_swap():
+    torch.manual_seed(0)
+    model = ExampleModel()
+    hook = IterBasedEMAHook(momentum=0.1, skip_iters=0, eval_interval=4)
+
+    runner, ema = _train(hook, model, num_iters=4)
+    params = dict(model.named_parameters())
+    trained = {name: hook.model_buffers[hook.param_ema_buffer[name]].clone() for name in params}
+
+    # the parameters hold the averages for the evaluation
+    assert hook.eval_mode
+    for name, param in params.items():
+        assert torch.allclose(param, ema[name], atol=1e-6)
+        assert torch.equal(hook.model_buffers[hook.param_ema_buffer[name]], trained[name])
+
+    # the tensors are swapped back by reference before the next iteration
+    param_ptrs = {name: hook.model_buffers[hook.param_ema_buffer[name]].data_ptr() for name in params}
+    runner.iter = 4
+    hook.before_train_iter(runner)
+    assert not hook.eval_mode
+    for name, param in params.items():
+        assert param.data_ptr() == param_ptrs[name]
+        assert torch.allclose(hook.model_buffers[hook.param_ema_buffer[name]], ema[name], atol=1e-6)
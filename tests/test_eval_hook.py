@@ -116,11 +116,41 @@ def multi_gpu_test(model,
                    data_loader,
                    tmpdir=None,
                    gpu_collect=False,
-                   efficient_test=False):
-    results = single_gpu_test(model, data_loader)
+                   efficient_test=False,
+                   pre_eval=False):
+    results = single_gpu_test(model, data_loader, pre_eval=pre_eval)
     return results
 
 
+def test_iter_eval_hook_pre_eval():
+    test_dataset = ExampleDataset()
+    accumulator = MagicMock()
+    test_dataset.pre_eval = MagicMock(return_value=accumulator)
+    test_dataset.evaluate = MagicMock(return_value=dict(test='success'))
+    loader = DataLoader(test_dataset, batch_size=1)
+    model = ExampleModel()
+    data_loader = DataLoader(
+        test_dataset, batch_size=1, sampler=None, num_workers=0, shuffle=False)
+    optim_cfg = dict(type='SGD', lr=0.01, momentum=0.9, weight_decay=0.0005)
+    optimizer = obj_from_dict(optim_cfg, torch.optim,
+                              dict(params=model.parameters()))
+
+    # test EvalHook reduces the predictions with dataset.pre_eval
+    with tempfile.TemporaryDirectory() as tmpdir:
+        eval_hook = EvalHook(data_loader, by_epoch=False, pre_eval=True)
+        runner = mmcv.runner.IterBasedRunner(
+            model=model,
+            optimizer=optimizer,
+            work_dir=tmpdir,
+            logger=logging.getLogger())
+        runner.register_hook(eval_hook)
+        runner.run([loader], [('train', 1)], 1)
+        test_dataset.pre_eval.assert_called_with(
+            torch.tensor([1]), [0], accumulator)
+        test_dataset.evaluate.assert_called_with(
+            accumulator, logger=runner.logger)
+
+
 @patch('mmseg.apis.multi_gpu_test', multi_gpu_test)
 def test_dist_eval_hook():
     with pytest.raises(TypeError):
@@ -0,0 +1,120 @@
+import importlib.util
+import os.path as osp
+from functools import partial
+
+import pytest
+import torch
+from mmcv import ConfigDict
+
+from mmseg.apis.export import _forward_for_export, _get_label_dtype
+from mmseg.models import build_segmentor
+
+
+def _build_segmentor(num_classes):
+    norm_cfg = dict(type='BN', requires_grad=True)
+    model_cfg = dict(
+        type='EncoderDecoder',
+        backbone=dict(
+            type='ResNetV1c',
+            depth=18,
+            num_stages=4,
+            out_indices=(0, 1, 2, 3),
+            dilations=(1, 1, 2, 4),
+            strides=(1, 2, 1, 1),
+            norm_cfg=norm_cfg,
+            contract_dilation=True),
+        decode_head=dict(
+            type='FCNHead',
+            in_channels=512,
+            in_index=3,
+            channels=16,
+            num_convs=1,
+            concat_input=False,
+            num_classes=num_classes,
+            norm_cfg=norm_cfg,
+            align_corners=False,
+            loss_decode=dict(type='CrossEntropyLoss', loss_weight=1.0)),
+        test_cfg=dict(mode='whole'))
+
+    return build_segmentor(ConfigDict(model_cfg)).eval()
+
+
+@pytest.mark.parametrize('num_classes,label_dtype', [(4, torch.uint8),
+                                                      (300, torch.int32)])
+def test_forward_for_export(num_classes, label_dtype):
+    assert _get_label_dtype(num_classes) == str(label_dtype).split('.')[-1]
+
+    model = _build_segmentor(num_classes)
+    img = torch.rand(2, 3, 32, 32)
+    img_meta = [
+        dict(
+            ori_shape=(32, 32, 3),
+            img_shape=(32, 32, 3),
+            pad_shape=(32, 32, 3),
+            flip=False) for _ in range(2)
+    ]
+    # the probabilities the segmentor returns in the export mode
+    forward = partial(model.inference, img_meta=img_meta, rescale=False)
+    export_forward = partial(
+        _forward_for_export,
+        forward,
+        output_logits=False,
+        label_dtype=_get_label_dtype(num_classes))
+
+    with torch.no_grad():
+        probs = forward(img)
+        logits = _forward_for_export(
+            forward,
+            img,
+            output_logits=True,
+            output_confidence=False,
+            label_dtype=_get_label_dtype(num_classes))
+        labels = export_forward(img, output_confidence=False)
+        labels_with_confidence, confidence = export_forward(
+            img, output_confidence=True)
+
+    torch.testing.assert_allclose(logits, probs)
+
+    assert labels.shape == (2, 1, 32, 32)
+    assert labels.dtype == label_dtype
+    assert torch.equal(labels.long(), probs.argmax(dim=1, keepdim=True))
+    assert torch.equal(labels_with_confidence, labels)
+
+    assert confidence.shape == (2, 1, 32, 32)
+    assert confidence.dtype == probs.dtype
+    torch.testing.assert_allclose(confidence, probs.max(dim=1,
+                                                        keepdim=True)[0])
+
+
+def test_get_label_dtype():
+    assert _get_label_dtype(256) == 'uint8'
+    assert _get_label_dtype(257) == 'int32'
+    assert _get_label_dtype(4, 'int32') == 'int32'
+    with pytest.raises(AssertionError):
+        _get_label_dtype(300, 'uint8')
+    with pytest.raises(AssertionError):
+        _get_label_dtype(4, 'int64')
+
+
+def test_export_args():
+    export_file = osp.join(osp.dirname(__file__), '../tools/export.py')
+    spec = importlib.util.spec_from_file_location('export', export_file)
+    export = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(export)
+
+    args = export.parse_args([
+        'config.py', 'model.pth', 'out', '--output', 'labels',
+        '--with-confidence', 'onnx'
+    ])
+    assert args.output == 'labels'
+    assert args.with_confidence
+
+    args = export.parse_args(['config.py', 'model.pth', 'out', 'onnx'])
+    assert args.output == 'logits'
+    assert not args.with_confidence
+
+    # the confidence is computed along with the labels only
+    with pytest.raises(SystemExit):
+        export.parse_args([
+            'config.py', 'model.pth', 'out', '--with-confidence', 'onnx'
+        ])
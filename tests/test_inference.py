@@ -1,8 +1,11 @@
 import os.path as osp
+import threading
 
 import mmcv
+import numpy as np
 
-from mmseg.apis import inference_segmentor, init_segmentor
+from mmseg.apis import (SegmentationPredictor, inference_segmentor,
+                        init_segmentor)
 
 
 def test_test_time_augmentation_on_cpu():
@@ -27,3 +30,63 @@ def test_test_time_augmentation_on_cpu():
         osp.join(osp.dirname(__file__), 'data/color.jpg'), 'color')
     result = inference_segmentor(model, img)
     assert result[0].shape == (288, 512)
+
+
+def test_segmentation_predictor_on_cpu():
+    config_file = 'configs/pspnet/pspnet_r50-d8_512x1024_40k_cityscapes.py'
+    config = mmcv.Config.fromfile(config_file)
+
+    # Remove pretrain model download for testing
+    config.model.pretrained = None
+    # Replace SyncBN with BN to inference on CPU
+    norm_cfg = dict(type='BN', requires_grad=True)
+    config.model.backbone.norm_cfg = norm_cfg
+    config.model.decode_head.norm_cfg = norm_cfg
+    config.model.auxiliary_head.norm_cfg = norm_cfg
+
+    model = init_segmentor(config, None, device='cpu')
+
+    img = mmcv.imread(
+        osp.join(osp.dirname(__file__), 'data/color.jpg'), 'color')
+    imgs = [img, img[:200], img, img[:200], img]
+    expected = [inference_segmentor(model, _)[0] for _ in imgs]
+
+    # batching does not change the results
+    with SegmentationPredictor(
+            model, batch_size=2, num_workers=2) as predictor:
+        results = predictor(imgs)
+        assert len(results) == len(imgs)
+        for result, expected_result in zip(results, expected):
+            assert result.dtype == np.uint8
+            np.testing.assert_array_equal(result, expected_result)
+
+        result = predictor(img)
+        assert result.shape == (288, 512)
+    assert predictor.executor is None
+
+    predictor = SegmentationPredictor(
+        model, batch_size=4, max_latency=0.0, output_logits=True)
+    results = list(predictor.predict(iter(imgs)))
+    assert len(results) == len(imgs)
+    assert results[1].shape == (model.num_classes, ) + imgs[1].shape[:2]
+    predictor.close()
+
+    # a partial batch is run when its latency budget is out, even if the
+    # input blocks
+    release = threading.Event()
+    resumed = threading.Event()
+
+    def _blocking_stream():
+        yield img
+        release.wait(60.0)
+        resumed.set()
+        yield img
+
+    with SegmentationPredictor(
+            model, batch_size=4, max_latency=0.1) as predictor:
+        outputs = predictor.predict(_blocking_stream())
+        np.testing.assert_array_equal(next(outputs), expected[0])
+        assert not resumed.is_set()
+        release.set()
+        np.testing.assert_array_equal(next(outputs), expected[0])
+        assert len(list(outputs)) == 0
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from unittest.mock import MagicMock
+
+import pytest
+import torch
+from mmcv.runner import LogBuffer, TextLoggerHook
+
+from mmseg.core.hooks import LogVarsSyncHook
+from mmseg.models.segmentors import BaseSegmentor
+
+
+def _parse_losses_item(losses):
+    """The log vars copied to the host one by one."""
+
+    log_vars = OrderedDict()
+    for var_name, var_value in losses.items():
+        if isinstance(var_value, torch.Tensor):
+            log_vars[var_name] = var_value.mean()
+        elif isinstance(var_value, list):
+            log_vars[var_name] = sum(_loss.mean() for _loss in var_value)
+        else:
+            log_vars[var_name] = var_value
+
+    loss = sum(_value for _key, _value in log_vars.items() if 'loss' in _key)
+    log_vars['loss'] = loss
+    for var_name, var_value in log_vars.items():
+        if isinstance(var_value, torch.Tensor):
+            log_vars[var_name] = var_value.item()
+
+    return loss, log_vars
+
+
+def _losses(seed):
+    generator = torch.Generator().manual_seed(seed)
+    return dict(
+        loss_ce=torch.rand(4, 8, generator=generator, requires_grad=True),
+        loss_aux=[torch.rand(3, generator=generator), torch.rand(2, 2, generator=generator)],
+        raw_sparsity=torch.rand([], generator=generator),
+        scale=2.5,
+        acc=torch.tensor([75.0]))
+
+
+def test_parse_losses():
+    losses = _losses(0)
+    loss, log_vars = BaseSegmentor._parse_losses(losses)
+    expected_loss, expected_log_vars = _parse_losses_item(losses)
+
+    assert loss.requires_grad
+    torch.testing.assert_allclose(loss, expected_loss)
+
+    # the log vars stay on the device
+    assert list(log_vars.keys()) == list(expected_log_vars.keys())
+    for name, value in log_vars.items():
+        if name == 'scale':
+            assert value == 2.5
+        else:
+            assert isinstance(value, torch.Tensor)
+            assert value.dim() == 0 and not value.requires_grad
+            assert value.item() == pytest.approx(expected_log_vars[name])
+
+
+def test_log_vars_sync_hook():
+    logger_hook = TextLoggerHook(interval=3, by_epoch=False)
+    runner = MagicMock()
+    runner.hooks = [logger_hook]
+    runner.log_buffer = LogBuffer()
+    runner.iter = 0
+    runner.max_iters = runner._max_iters = 10
+
+    hook = LogVarsSyncHook()
+    hook.before_run(runner)
+
+    expected = []
+    for i in range(5):
+        _, log_vars = BaseSegmentor._parse_losses(_losses(i))
+        runner.log_buffer.update(log_vars, 2)
+        runner.log_buffer.update(dict(grad_norm=1.0), 2)
+        expected.append(_parse_losses_item(_losses(i))[1])
+        hook.after_train_iter(runner)
+
+        history = runner.log_buffer.val_history
+        num_on_host = 3 if i >= 2 else 0
+        for name in expected[-1]:
+            assert all(not isinstance(v, torch.Tensor) for v in history[name][:num_on_host])
+            assert all(isinstance(v, torch.Tensor) for v in history[name][num_on_host:] if name != 'scale')
+        runner.iter += 1
+
+    # the buffer averages the same values as the values copied one by one
+    hook.after_train_epoch(runner)
+    runner.log_buffer.average(5)
+    for name in expected[0]:
+        value = sum(log_vars[name] for log_vars in expected) / 5
+        assert runner.log_buffer.output[name] == pytest.approx(value)
+    assert runner.log_buffer.output['grad_norm'] == pytest.approx(1.0)
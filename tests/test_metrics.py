@@ -1,7 +1,10 @@
 import numpy as np
 
-from mmseg.core.evaluation import (eval_metrics, mean_dice, mean_fscore,
-                                   mean_iou)
+import torch
+
+from mmseg.core.evaluation import (ConfusionMatrixAccumulator,
+                                   build_label_lut, eval_metrics,
+                                   mean_dice, mean_fscore, mean_iou)
 from mmseg.core.evaluation.metrics import f_score
 
 
@@ -306,6 +309,98 @@ def test_mean_fscore():
     assert fscore[-1] == -1
 
 
+def test_confusion_matrix_accumulator():
+    pred_size = (10, 30, 30)
+    num_classes = 19
+    ignore_index = 255
+    results = np.random.randint(0, num_classes, size=pred_size)
+    label = np.random.randint(0, num_classes, size=pred_size)
+    label[:, 2, 5:10] = ignore_index
+
+    # Test batched and per-image updates give the legacy confusion matrix.
+    accumulator = ConfusionMatrixAccumulator(num_classes, ignore_index)
+    accumulator.update(results.astype(np.uint8), label.astype(np.uint8))
+    legacy_mat = sum(
+        get_confusion_matrix(results[i], label[i], num_classes, ignore_index)
+        for i in range(len(results)))
+    assert np.array_equal(accumulator.confusion_matrix.numpy(), legacy_mat)
+
+    part_a = ConfusionMatrixAccumulator(num_classes, ignore_index)
+    part_b = ConfusionMatrixAccumulator(num_classes, ignore_index)
+    for i in range(5):
+        part_a.update(results[i], torch.from_numpy(label[i]))
+    part_b.update(list(results[5:]), list(label[5:]))
+    part_a.merge(part_b)
+    assert torch.equal(part_a.confusion_matrix, accumulator.confusion_matrix)
+
+    ret_metrics = accumulator.compute(['mIoU', 'mDice', 'mFscore'])
+    ref_metrics = eval_metrics(
+        results,
+        label,
+        num_classes,
+        ignore_index,
+        metrics=['mIoU', 'mDice', 'mFscore'])
+    assert ret_metrics.keys() == ref_metrics.keys()
+    for key in ref_metrics:
+        assert np.allclose(ret_metrics[key], ref_metrics[key])
+
+    all_acc_l, acc_l, iou_l = legacy_mean_iou(results, label, num_classes,
+                                              ignore_index)
+    assert ret_metrics['aAcc'] == all_acc_l
+    assert np.allclose(ret_metrics['IoU'], iou_l)
+
+    # Test reset and reduce_zero_label.
+    accumulator.reset()
+    assert accumulator.confusion_matrix.sum() == 0
+    accumulator = ConfusionMatrixAccumulator(
+        num_classes, ignore_index, reduce_zero_label=True)
+    accumulator.update(np.array([[0, 1], [2, 3]]), np.array([[0, 1], [3, 3]]))
+    mat = accumulator.confusion_matrix
+    assert mat.sum() == 3
+    assert mat[0, 1] == 1 and mat[2, 2] == 1 and mat[2, 3] == 1
+
+
+def test_build_label_lut():
+    label = np.random.randint(0, 256, size=(64, 64)).astype(np.uint8)
+    label_map = {0: -1, 1: 0, 2: 1, 3: -1, 4: 2}
+
+    def legacy_remap(label, label_map, reduce_zero_label):
+        label = label.copy()
+        if label_map is not None:
+            for old_id, new_id in label_map.items():
+                label[label == old_id] = new_id
+        if reduce_zero_label:
+            label[label == 0] = 255
+            label = label - 1
+            label[label == 254] = 255
+        return label
+
+    assert build_label_lut() is None
+    assert build_label_lut(dict()) is None
+    for reduce_zero_label in (False, True):
+        for mapping in (None, label_map):
+            lut = build_label_lut(mapping, reduce_zero_label)
+            if lut is None:
+                continue
+            assert lut.dtype == np.uint8 and lut.shape == (256, )
+            np.testing.assert_array_equal(
+                lut[label],
+                legacy_remap(label, mapping, reduce_zero_label))
+        # a precomputed table is reused as is
+        lut = build_label_lut(label_map)
+        np.testing.assert_array_equal(
+            build_label_lut(lut, reduce_zero_label),
+            build_label_lut(label_map, reduce_zero_label))
+
+    # labels out of the table are kept by the accumulator
+    accumulator = ConfusionMatrixAccumulator(
+        300, ignore_index=255, label_map={1: 2})
+    accumulator.update(
+        np.array([2, 2, 280]), np.array([1, 2, 280], dtype=np.int64))
+    mat = accumulator.confusion_matrix
+    assert mat.sum() == 3 and mat[2, 2] == 2 and mat[280, 280] == 1
+
+
 def test_filename_inputs():
     import cv2
     import tempfile
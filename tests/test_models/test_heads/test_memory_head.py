@@ -0,0 +1,35 @@
+import torch
+
+from mmseg.models.decode_heads.memory_head import FeaturesMemory
+
+
+def test_features_memory_update():
+    memory = FeaturesMemory(
+        num_classes=4, feats_channels=8, transform_channels=4, out_channels=8, strategy='mean', momentum=0.5)
+
+    feats = torch.randn(2, 8, 5, 5)
+    seg = torch.zeros(2, 1, 5, 5, dtype=torch.long)
+    seg[:, :, 2:] = 2
+    seg[:, :, 4:] = 255
+
+    # the memory of the present classes is initialized with the class means
+    memory.update(feats, seg)
+    flat_feats = feats.permute(0, 2, 3, 1).reshape(-1, 8)
+    flat_seg = seg.view(-1)
+    mean_0 = flat_feats[flat_seg == 0].mean(0)
+    mean_2 = flat_feats[flat_seg == 2].mean(0)
+    assert torch.allclose(memory.memory[0, 0], mean_0, atol=1e-6)
+    assert torch.allclose(memory.memory[2, 0], mean_2, atol=1e-6)
+    assert (memory.memory[[1, 3]] == 0).all()
+
+    # then updated with the momentum
+    memory.update(torch.zeros_like(feats), seg)
+    assert torch.allclose(memory.memory[0, 0], 0.5 * mean_0, atol=1e-6)
+
+    # the slots are assigned by the similarity with several features per class
+    memory = FeaturesMemory(
+        num_classes=4, feats_channels=8, transform_channels=4, out_channels=8, num_feats_per_cls=2)
+    for _ in range(3):
+        memory.update(torch.randn(2, 8, 5, 5), seg)
+    assert (memory.memory[[0, 2]] != 0).any(dim=2).all()
+    assert (memory.memory[[1, 3]] == 0).all()
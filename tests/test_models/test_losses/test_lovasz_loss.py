@@ -90,3 +90,40 @@ def test_lovasz_loss():
     logits = torch.rand(2, 4, 4)
     labels = (torch.rand(2, 4, 4)).long()
     lovasz_loss(logits, labels, ignore_index=None)
+
+
+def test_lovasz_softmax_flat():
+    from mmseg.models.losses.lovasz_loss import lovasz_grad, lovasz_softmax_flat
+
+    probs = torch.rand(50, 4).softmax(dim=1)
+    labels = torch.randint(0, 3, (50, ))
+    class_weight = torch.tensor([1.0, 2.0, 3.0, 4.0])
+
+    # reference with a loop over the present classes
+    losses = []
+    for c in range(3):
+        fg = (labels == c).float()
+        errors_sorted, perm = torch.sort((fg - probs[:, c]).abs(), 0, descending=True)
+        losses.append(class_weight[c] * torch.dot(errors_sorted, lovasz_grad(fg[perm])))
+
+    loss = lovasz_softmax_flat(probs, labels, 'present', class_weight)
+    assert torch.allclose(loss, torch.stack(losses).mean())
+
+    # the classes are sorted in chunks, the weights may be a list
+    for class_chunk_size in (1, 3, 100):
+        loss = lovasz_softmax_flat(
+            probs, labels, 'present', class_weight.tolist(), class_chunk_size=class_chunk_size)
+        assert torch.allclose(loss, torch.stack(losses).mean())
+    with pytest.raises(AssertionError):
+        lovasz_softmax_flat(probs, labels, 'present', class_chunk_size=0)
+
+    # the absent class is taken into account with 'all'
+    loss = lovasz_softmax_flat(probs, labels, 'all', class_weight)
+    assert loss.item() != pytest.approx(torch.stack(losses).mean().item())
+    assert torch.allclose(loss, lovasz_softmax_flat(probs, labels, 'all', class_weight, class_chunk_size=3))
+    loss = lovasz_softmax_flat(probs, labels, [0, 3], class_weight, class_chunk_size=1)
+    assert torch.allclose(loss, lovasz_softmax_flat(probs, labels, [0, 3], class_weight))
+
+    # pixel subsampling
+    loss = lovasz_softmax_flat(probs, labels, 'present', max_pixels=10)
+    assert loss.dim() == 0
@@ -0,0 +1,49 @@
+import pytest
+import torch
+
+from mmseg.models import build_loss
+from mmseg.models.losses.pixel_base import BasePixelLoss
+
+
+def _sparsity_item(values, valid_mask):
+    """The sparsity computed with the boolean indexing and .item()."""
+
+    valid_values = values[valid_mask]
+    return 1.0 - float(valid_values.count_nonzero().item()) / max(1.0, float(valid_mask.sum().item()))
+
+
+def test_sparsity():
+    generator = torch.Generator().manual_seed(0)
+    values = torch.rand(2, 16, 16, generator=generator)
+    values[values < 0.4] = 0.0
+    valid_mask = torch.rand(2, 16, 16, generator=generator) > 0.3
+
+    for mask in (valid_mask, torch.ones_like(valid_mask), torch.zeros_like(valid_mask)):
+        sparsity = BasePixelLoss._sparsity(values.requires_grad_(), mask)
+        assert isinstance(sparsity, torch.Tensor)
+        assert not sparsity.requires_grad
+        assert sparsity.item() == pytest.approx(_sparsity_item(values, mask))
+
+
+def test_diagnostics_interval():
+    with pytest.raises(AssertionError):
+        build_loss(dict(type='CrossEntropyLoss', diagnostics_interval=0))
+
+    loss_module = build_loss(dict(type='CrossEntropyLoss', diagnostics_interval=2, ignore_index=255))
+
+    # the confident logits of the first image give zero losses
+    labels = torch.randint(0, 3, (2, 8, 8), generator=torch.Generator().manual_seed(0))
+    logits = torch.zeros(2, 3, 8, 8)
+    logits[0].scatter_(0, labels[:1], 100.0)
+    labels[1, :4] = 255
+
+    for i in range(5):
+        _, meta = loss_module(logits, labels)
+        assert meta['scale'] == 1.0
+        if i % 2 == 0:
+            assert isinstance(meta['raw_sparsity'], torch.Tensor)
+            assert meta['raw_sparsity'].item() == pytest.approx(64.0 / 96.0)
+            assert meta['weight_sparsity'] == 0.0
+        else:
+            assert 'raw_sparsity' not in meta
+            assert 'weight_sparsity' not in meta
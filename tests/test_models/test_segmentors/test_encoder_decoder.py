@@ -1,7 +1,9 @@
+import numpy as np
+import torch
 from mmcv import ConfigDict
 
 from mmseg.models import build_segmentor
-from .utils import _segmentor_forward_train_test
+from .utils import _demo_mm_inputs, _segmentor_forward_train_test
 
 
 def test_encoder_decoder():
@@ -44,3 +46,82 @@ def test_encoder_decoder():
     cfg.test_cfg = ConfigDict(mode='whole')
     segmentor = build_segmentor(cfg)
     _segmentor_forward_train_test(segmentor)
+
+
+def test_encoder_decoder_batched_slide_inference():
+
+    cfg = ConfigDict(
+        type='EncoderDecoder',
+        backbone=dict(type='ExampleBackbone'),
+        decode_head=dict(type='ExampleDecodeHead'),
+        train_cfg=None,
+        test_cfg=dict(mode='slide', crop_size=(3, 3), stride=(2, 2)))
+    segmentor = build_segmentor(cfg)
+    segmentor.eval()
+
+    mm_inputs = _demo_mm_inputs(input_shape=(2, 3, 8, 16))
+    imgs, img_metas = mm_inputs['imgs'], mm_inputs['img_metas']
+    with torch.no_grad():
+        ref_seg_logit = segmentor.slide_inference(imgs, img_metas, True)
+        # windows and count matrix are cached per input shape
+        assert len(segmentor._slide_windows_cache) == 1
+
+        for slide_batch_size in [2, 5, None]:
+            segmentor.test_cfg.slide_batch_size = slide_batch_size
+            seg_logit = segmentor.slide_inference(imgs, img_metas, True)
+            assert seg_logit.shape == (2, 19, 8, 16)
+            assert torch.allclose(seg_logit, ref_seg_logit, atol=1e-6)
+        assert len(segmentor._slide_windows_cache) == 1
+
+        # only the layouts of the last input shapes are kept
+        for width in range(9, 16):
+            segmentor.slide_inference(imgs[..., :width], img_metas, False)
+        segmentor.slide_inference(imgs, img_metas, False)
+        cache_keys = list(segmentor._slide_windows_cache)
+        assert len(cache_keys) == 4
+        assert cache_keys[-1][:2] == (8, 16)
+
+
+def test_encoder_decoder_aug_test():
+
+    cfg = ConfigDict(
+        type='EncoderDecoder',
+        backbone=dict(type='ExampleBackbone'),
+        decode_head=dict(type='ExampleDecodeHead'),
+        train_cfg=None,
+        test_cfg=dict(mode='whole'))
+    segmentor = build_segmentor(cfg)
+    segmentor.eval()
+
+    mm_inputs = _demo_mm_inputs(input_shape=(1, 3, 8, 16))
+    img, img_meta = mm_inputs['imgs'], mm_inputs['img_metas'][0]
+    flip_img_meta = dict(img_meta, flip=True)
+    small_img = torch.nn.functional.interpolate(img, size=(4, 8))
+    small_img_meta = dict(img_meta, img_shape=(4, 8, 3))
+    imgs = [img, img.flip(dims=(3, )), small_img]
+    img_metas = [[img_meta], [flip_img_meta], [small_img_meta]]
+
+    with torch.no_grad():
+        ref_seg_logit = sum(
+            segmentor.inference(imgs[i], img_metas[i], True)
+            for i in range(len(imgs)))
+        ref_seg_pred = ref_seg_logit.argmax(dim=1).numpy()
+
+        seg_pred = segmentor.aug_test(imgs, img_metas)
+        assert np.array_equal(seg_pred[0], ref_seg_pred[0])
+
+        # fuse the flipped image into the same forward pass
+        segmentor.test_cfg.aug_batch_size = None
+        seg_pred = segmentor.aug_test(imgs, img_metas)
+        assert np.array_equal(seg_pred[0], ref_seg_pred[0])
+
+        seg_logit = segmentor.aug_test(imgs, img_metas, output_logits=True)
+        assert np.allclose(seg_logit[0], ref_seg_logit[0].numpy() / 3,
+                           atol=1e-6)
+
+        # accumulate at a lower resolution and return uint8 labels
+        segmentor.test_cfg.aug_test_size = 0.5
+        segmentor.test_cfg.output_uint8 = True
+        seg_pred = segmentor.aug_test(imgs, img_metas)
+        assert seg_pred[0].shape == (8, 16)
+        assert seg_pred[0].dtype == np.uint8
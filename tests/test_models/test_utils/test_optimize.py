@@ -0,0 +1,113 @@
+import torch
+import torch.nn as nn
+from mmcv.cnn import ConvModule
+
+from mmseg.core.utils import optimize_for_inference
+from mmseg.models import build_segmentor
+
+
+class PreActBlock(nn.Module):
+
+    def __init__(self, channels):
+        super().__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1)
+        # normalizes the input of conv2, but is registered after conv1
+        self.bn = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1)
+
+    def forward(self, x):
+        x = self.conv1(x)
+        return self.conv2(self.bn(x + 1.0))
+
+
+class ToyModel(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.stem = nn.Sequential(
+            nn.Conv2d(3, 8, 3, padding=1, bias=False), nn.BatchNorm2d(8),
+            nn.ReLU(inplace=True), nn.Dropout2d(0.5))
+        self.conv = ConvModule(8, 8, 3, padding=1, norm_cfg=dict(type='BN'))
+        self.block = PreActBlock(8)
+
+    def forward(self, x):
+        return self.block(self.conv(self.stem(x)))
+
+
+def _randomize_bn(model):
+    for m in model.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+
+
+def test_optimize_for_inference():
+    model = ToyModel().eval()
+    _randomize_bn(model)
+    img = torch.rand(2, 3, 16, 16)
+    with torch.no_grad():
+        expected = model(img)
+
+    optimized = optimize_for_inference(
+        model, input_shape=(1, 3, 16, 16), inplace=False)
+    assert optimized is not model
+    assert isinstance(model.conv.bn, nn.BatchNorm2d)
+
+    # the stem BN is folded and dropped along with the dropout
+    assert len(optimized.stem) == 2
+    assert isinstance(optimized.stem[0], nn.Conv2d)
+    assert optimized.stem[0].bias is not None
+    assert isinstance(optimized.conv.bn, nn.Identity)
+    # the BN of the pre-activation block is kept
+    assert isinstance(optimized.block.bn, nn.BatchNorm2d)
+
+    with torch.no_grad():
+        actual = optimized(img)
+    assert torch.allclose(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_optimize_segmentor():
+    norm_cfg = dict(type='BN', requires_grad=True)
+    model_cfg = dict(
+        type='EncoderDecoder',
+        backbone=dict(
+            type='ResNetV1c',
+            depth=18,
+            num_stages=4,
+            out_indices=(0, 1, 2, 3),
+            dilations=(1, 1, 2, 4),
+            strides=(1, 2, 1, 1),
+            norm_cfg=norm_cfg,
+            contract_dilation=True),
+        decode_head=dict(
+            type='FCNHead',
+            in_channels=512,
+            in_index=3,
+            channels=32,
+            num_convs=1,
+            concat_input=False,
+            dropout_ratio=0.1,
+            num_classes=4,
+            norm_cfg=norm_cfg,
+            align_corners=False,
+            loss_decode=dict(type='CrossEntropyLoss', loss_weight=1.0)),
+        test_cfg=dict(mode='whole'))
+    model = build_segmentor(model_cfg).eval()
+    _randomize_bn(model)
+    img = torch.rand(1, 3, 64, 64)
+    with torch.no_grad():
+        expected = model.forward_dummy(img)
+
+    model = optimize_for_inference(
+        model, input_shape=(1, 3, 64, 64), channels_last=True)
+    num_bn = sum(isinstance(m, nn.BatchNorm2d) for m in model.modules())
+    assert num_bn == 0
+    assert isinstance(model.decode_head.dropout, nn.Identity)
+    assert model.backbone.stem[0].weight.is_contiguous(
+        memory_format=torch.channels_last)
+
+    with torch.no_grad():
+        actual = model.forward_dummy(img)
+    assert torch.allclose(actual, expected, rtol=1e-3, atol=1e-4)
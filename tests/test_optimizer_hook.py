@@ -0,0 +1,208 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+import torch.nn as nn
+from mmcv.runner import CheckpointHook, TextLoggerHook
+
+from mmseg.core.hooks import CustomFp16OptimizerHook, CustomOptimizerHook
+
+
+def _build_runner(model, hooks=(), max_iters=10):
+    runner = MagicMock()
+    runner.model = model
+    runner.optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    runner.hooks = list(hooks)
+    runner.meta = None
+    runner.iter = 0
+    runner.max_iters = runner._max_iters = max_iters
+
+    return runner
+
+
+def _train_iter(hook, runner, model, img, loss_factor=1.0):
+    runner.outputs = dict(loss=model(img).sum() * loss_factor, num_samples=len(img))
+    hook.after_train_iter(runner)
+    runner.iter += 1
+
+
+class ExampleModel(nn.Module):
+
+    def __init__(self):
+        super(ExampleModel, self).__init__()
+        # the parameters of the same shape are clipped in one group
+        self.conv1 = nn.Conv2d(3, 4, 3)
+        self.conv2 = nn.Conv2d(3, 4, 3)
+        self.fc = nn.Linear(4, 2)
+
+    def forward(self, img):
+        x = self.conv1(img) + self.conv2(img)
+        return self.fc(x.mean(dim=(2, 3)))
+
+
+def _unit_wise_norm(x):
+    if x.dim() <= 1:
+        return torch.abs(x)
+
+    return torch.sqrt(torch.sum(x ** 2, dim=tuple(range(1, x.dim())), keepdim=True))
+
+
+def _per_param_adaptive_clip_grad_norm(parameters, clip):
+    """The adaptive clipping of every parameter one by one."""
+
+    total_norm = torch.norm(torch.stack([torch.norm(p.grad.detach(), 2) for p in parameters]), 2)
+
+    all_num_invalids, all_invalid_clip_coef = [], []
+    total_num_elements = 0
+    for p in parameters:
+        with torch.no_grad():
+            p_norms = _unit_wise_norm(p)
+            g_norms = _unit_wise_norm(p.grad)
+
+            max_p_norms = float(clip) * p_norms.clamp_min(1e-3)
+            max_g_norms = g_norms.clamp_min(1e-6)
+
+            scales = max_p_norms / max_g_norms
+            invalid_mask = g_norms > max_p_norms
+            clip_coef = torch.where(invalid_mask, scales, torch.ones_like(scales))
+
+            num_invalids = torch.sum(invalid_mask).float().item()
+            all_invalid_clip_coef.append(torch.sum(scales[invalid_mask]).float().item() / max(1.0, num_invalids))
+            all_num_invalids.append(num_invalids)
+            total_num_elements += invalid_mask.nelement()
+
+        p.grad.detach().mul_(clip_coef)
+
+    return {
+        'invalid_grad_scale': sum(all_invalid_clip_coef) / float(max(1, len(all_invalid_clip_coef))),
+        'invalid_grad_ratio': sum(all_num_invalids) / float(max(1, total_num_elements)),
+        'grad_norm': total_norm.item(),
+    }
+
+
+@pytest.mark.parametrize('has_foreach', [True, False])
+@pytest.mark.parametrize('clip', [0.01, 0.5])
+def test_adaptive_clip_grad_norm(clip, has_foreach):
+    torch.manual_seed(0)
+    model = ExampleModel()
+    ref_model = ExampleModel()
+    ref_model.load_state_dict(model.state_dict())
+
+    img = torch.rand(2, 3, 6, 6)
+    for m in (model, ref_model):
+        (m(img).sum() * 10.0).backward()
+
+    hook = CustomOptimizerHook(grad_clip=dict(method='adaptive', clip=clip))
+    with patch('mmseg.core.hooks.optimizer._HAS_FOREACH', has_foreach):
+        grad_info = hook.clip_grads(model.parameters())
+    ref_grad_info = _per_param_adaptive_clip_grad_norm(list(ref_model.parameters()), clip)
+
+    if clip < 0.1:
+        # the small clip value clips a part of the gradients
+        assert ref_grad_info['invalid_grad_ratio'] > 0
+    assert set(grad_info) == set(ref_grad_info)
+    for key, value in grad_info.items():
+        assert float(value) == pytest.approx(ref_grad_info[key], rel=1e-5)
+    for param, ref_param in zip(model.parameters(), ref_model.parameters()):
+        assert torch.allclose(param.grad, ref_param.grad, rtol=1e-5, atol=1e-7)
+
+
+@pytest.mark.parametrize('method', ['default', 'adaptive'])
+def test_optimizer_hook_deferred_grad_info(method):
+    grad_clip = dict(max_norm=1.0) if method == 'default' else dict(clip=0.01)
+    grad_clip['method'] = method
+
+    model = ExampleModel()
+    img = torch.rand(2, 3, 6, 6)
+    runner = _build_runner(model, [TextLoggerHook(interval=3, by_epoch=False)])
+    hook = CustomOptimizerHook(grad_clip=grad_clip)
+    hook.before_run(runner)
+
+    # the statistics of all iterations are logged on the logger flushes only
+    num_updates = []
+    for _ in range(7):
+        _train_iter(hook, runner, model, img)
+        num_updates.append(runner.log_buffer.update.call_count)
+    assert num_updates == [0, 0, 3, 3, 3, 6, 6]
+    for args, _ in runner.log_buffer.update.call_args_list:
+        grad_info, num_samples = args
+        assert isinstance(grad_info['grad_norm'], float)
+        assert num_samples == 2
+
+    # nothing is logged without logger hooks
+    runner = _build_runner(model)
+    hook = CustomOptimizerHook(grad_clip=grad_clip)
+    hook.before_run(runner)
+    for _ in range(3):
+        _train_iter(hook, runner, model, img)
+    runner.log_buffer.update.assert_not_called()
+
+
+def test_fp16_optimizer_hook_loss_scale():
+    with patch('mmseg.core.hooks.optimizer.GradScaler') as grad_scaler:
+        # the static scale can be an integer as in mmcv
+        CustomFp16OptimizerHook(loss_scale=512)
+        grad_scaler.assert_called_with(init_scale=512, growth_factor=1, backoff_factor=1)
+        CustomFp16OptimizerHook(loss_scale=dict(init_scale=64.0, growth_interval=10))
+        grad_scaler.assert_called_with(init_scale=64.0, growth_interval=10)
+
+    with pytest.raises(ValueError):
+        CustomFp16OptimizerHook(loss_scale='static')
+
+
+def test_fp16_optimizer_hook_meta():
+    model = nn.Linear(4, 2)
+    img = torch.rand(3, 4)
+    runner = _build_runner(model, [CheckpointHook(interval=2, by_epoch=False)], max_iters=5)
+    hook = CustomFp16OptimizerHook()
+    hook.before_run(runner)
+
+    # the state of the scaler is written on the checkpoint iterations only
+    saved = []
+    for _ in range(5):
+        runner.meta = dict()
+        _train_iter(hook, runner, model, img)
+        saved.append('fp16' in runner.meta)
+    assert saved == [False, True, False, True, True]
+
+    runner.meta = dict()
+    hook.after_run(runner)
+    assert 'loss_scaler' in runner.meta['fp16']
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='requires CUDA')
+def test_fp16_optimizer_hook_scaling():
+    torch.manual_seed(0)
+    model = nn.Linear(4, 2).cuda()
+    ref_model = nn.Linear(4, 2).cuda()
+    ref_model.load_state_dict(model.state_dict())
+    img = torch.rand(3, 4).cuda()
+
+    runner = _build_runner(model, [CheckpointHook(interval=1, by_epoch=False)])
+    hook = CustomFp16OptimizerHook(loss_scale=dict(init_scale=1024.0, growth_interval=1000))
+    hook.before_run(runner)
+
+    # the gradients are unscaled before the step
+    _train_iter(hook, runner, model, img)
+    ref_optimizer = torch.optim.SGD(ref_model.parameters(), lr=0.1)
+    ref_model(img).sum().backward()
+    ref_optimizer.step()
+    for param, ref_param in zip(model.parameters(), ref_model.parameters()):
+        assert torch.allclose(param.grad, ref_param.grad, atol=1e-5)
+        assert torch.allclose(param, ref_param, atol=1e-5)
+    assert hook.loss_scaler.get_scale() == 1024.0
+
+    # the step is skipped on overflow and the scale is reduced
+    params = [param.detach().clone() for param in model.parameters()]
+    _train_iter(hook, runner, model, img, loss_factor=float('inf'))
+    for param, prev_param in zip(model.parameters(), params):
+        assert torch.equal(param, prev_param)
+    assert hook.loss_scaler.get_scale() == 512.0
+
+    # the scale is resumed from the meta of the checkpoint
+    meta = runner.meta
+    runner = _build_runner(model)
+    runner.meta = meta
+    resumed_hook = CustomFp16OptimizerHook()
+    resumed_hook.before_run(runner)
+    assert resumed_hook.loss_scaler.get_scale() == 512.0
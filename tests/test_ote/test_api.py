@@ -41,6 +41,7 @@ from ote_sdk.entities.train_parameters import TrainParameters
 from ote_sdk.tests.test_helpers import generate_random_annotated_image
 
 from mmseg.apis.ote.apis.segmentation import OTESegmentationTask
+from mmseg.apis.ote.extension.datasets import OTEDataset
 
 
 DEFAULT_TEMPLATE_DIR = osp.join('configs', 'ote', 'custom-sematic-segmentation', 'ocr-lite-hrnet-18')
@@ -140,6 +141,25 @@ class API(unittest.TestCase):
 
         return hyper_parameters, model_template
 
+    @e2e_pytest_api
+    def test_ote_dataset_pre_eval(self):
+        hyper_parameters, model_template = self.setup_configurable_parameters(DEFAULT_TEMPLATE_DIR)
+        _, dataset = self.init_environment(hyper_parameters, model_template, number_of_images=5)
+        ote_dataset = OTEDataset(dataset, pipeline=[], classes=['rectangle', 'ellipse', 'triangle'],
+                                 test_mode=True)
+
+        gt_seg_maps = list(ote_dataset.get_gt_seg_maps())
+        self.assertEqual(len(gt_seg_maps), len(dataset))
+
+        # the ground truth is scored against itself with the maps decoded ahead
+        ote_dataset.prefetch_gt_seg_maps(range(len(ote_dataset)))
+        accumulator = ote_dataset.pre_eval([], [])
+        for idx, gt_seg_map in enumerate(gt_seg_maps):
+            accumulator = ote_dataset.pre_eval(gt_seg_map, idx, accumulator)
+
+        eval_results = ote_dataset.evaluate(accumulator, metric='mIoU')
+        self.assertEqual(eval_results['aAcc'], 1.0)
+
     @e2e_pytest_api
     def test_training_progress_tracking(self):
         hyper_parameters, model_template = self.setup_configurable_parameters(DEFAULT_TEMPLATE_DIR, num_iters=5)
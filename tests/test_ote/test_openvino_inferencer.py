@@ -0,0 +1,131 @@
+# Copyright (C) 2021 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from e2e_test_system import e2e_pytest_api
+
+from mmseg.apis.ote.apis.segmentation import openvino_task
+from mmseg.apis.ote.apis.segmentation.configuration import OTESegmentationConfig
+
+
+class SyncModel:
+    """Model API without the asynchronous requests."""
+
+    def __init__(self):
+        self.model_adapter = object()
+
+    def preprocess(self, image):
+        return {'image': image}, {'original_shape': image.shape}
+
+    def postprocess(self, outputs, metadata):
+        return outputs['output']
+
+    def infer_sync(self, inputs):
+        return {'output': inputs['image'] * 2}
+
+
+class AsyncAdapter:
+
+    def __init__(self):
+        self.callback = None
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+
+class AsyncModel(SyncModel):
+    """Model API which completes the latest submitted request first."""
+
+    def __init__(self, num_requests, fail_at=None):
+        self.model_adapter = AsyncAdapter()
+        self.num_requests = num_requests
+        self.fail_at = fail_at
+        self.requests = []
+        self.max_requests_in_flight = 0
+
+    def is_ready(self):
+        return len(self.requests) < self.num_requests
+
+    def infer_async(self, inputs, callback_data):
+        assert self.is_ready()
+        self.requests.append((inputs, callback_data))
+        self.max_requests_in_flight = max(self.max_requests_in_flight, len(self.requests))
+
+    def _get_result(self, request):
+        if self.fail_at is not None and request['image'][0, 0, 0] == self.fail_at:
+            raise RuntimeError('request failed')
+        return self.infer_sync(request)
+
+    def await_any(self):
+        request, callback_data = self.requests.pop()
+        self.model_adapter.callback(request, (self._get_result, callback_data))
+
+    def await_all(self):
+        while self.requests:
+            self.await_any()
+
+
+def _create_inferencer(model):
+    converter = MagicMock()
+    converter.convert_to_annotation.side_effect = lambda prediction, metadata: prediction
+    with patch.object(openvino_task, 'create_core'), \
+            patch.object(openvino_task, 'OpenvinoAdapter'), \
+            patch.object(openvino_task, 'SegmentationToAnnotationConverter', return_value=converter), \
+            patch.object(openvino_task.Model, 'create_model', return_value=model):
+        return openvino_task.OpenVINOSegmentationInferencer(OTESegmentationConfig(), MagicMock(), 'model.xml',
+                                                            num_requests=getattr(model, 'num_requests', 1))
+
+
+def _images(num_images):
+    return [np.full((4, 6, 3), index, dtype=np.int32) for index in range(num_images)]
+
+
+@e2e_pytest_api
+def test_predict_async_keeps_input_order():
+    model = AsyncModel(num_requests=3)
+    inferencer = _create_inferencer(model)
+
+    predictions = list(inferencer.predict_async(iter(_images(8))))
+    assert len(predictions) == 8
+    for index, prediction in enumerate(predictions):
+        np.testing.assert_array_equal(prediction, np.full((4, 6, 3), index * 2))
+    assert model.max_requests_in_flight == 3
+    assert not model.requests
+
+    # the inferencer is reused after a call that was not run to the end
+    predictions = inferencer.predict_async(iter(_images(8)))
+    next(predictions)
+    predictions.close()
+    predictions = list(inferencer.predict_async(iter(_images(2))))
+    np.testing.assert_array_equal(predictions[1], np.full((4, 6, 3), 2))
+
+
+@e2e_pytest_api
+def test_predict_async_raises_request_errors():
+    inferencer = _create_inferencer(AsyncModel(num_requests=2, fail_at=3))
+
+    with pytest.raises(RuntimeError, match='request failed'):
+        list(inferencer.predict_async(iter(_images(6))))
+
+
+@e2e_pytest_api
+def test_predict_async_without_async_requests():
+    inferencer = _create_inferencer(SyncModel())
+
+    predictions = list(inferencer.predict_async(iter(_images(3))))
+    assert len(predictions) == 3
+    np.testing.assert_array_equal(predictions[2], np.full((4, 6, 3), 4))
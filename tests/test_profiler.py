@@ -0,0 +1,100 @@
+import json
+import os.path as osp
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import torch
+import torch.nn as nn
+
+from mmseg.core.hooks.profiler import ModuleProfilerHook
+from mmseg.core.utils.profiler import ModuleProfiler
+
+
+class ExampleModel(nn.Module):
+
+    def __init__(self):
+        super(ExampleModel, self).__init__()
+        self.stem = nn.Sequential(nn.Conv2d(3, 4, 3), nn.ReLU())
+        self.head = nn.Conv2d(4, 2, 1)
+
+    def forward(self, img):
+        return self.head(self.stem(img))
+
+
+def test_module_profiler():
+    model = ExampleModel()
+    img = torch.rand(1, 3, 8, 8)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trace_file = osp.join(tmp_dir, 'trace.json')
+        with ModuleProfiler(model, depth=1, trace_file=trace_file) as profiler:
+            for _ in range(3):
+                model(img)
+        model(img)
+        profiler.dump_trace()
+
+        with open(trace_file) as in_file:
+            trace_events = json.load(in_file)['traceEvents']
+
+    # the hooks are removed on exit
+    assert len(model._forward_pre_hooks) == 0
+    assert len(model.stem._forward_hooks) == 0
+
+    stats = {s['name']: s for s in profiler.summary()}
+    assert set(stats) == {'ExampleModel', 'stem', 'head'}
+    for s in stats.values():
+        assert s['calls'] == 3
+        assert s['device_time'] == 0.0
+    assert stats['head']['activation_bytes'] == 3 * 2 * 6 * 6 * 4
+    assert stats['stem']['depth'] == 1
+
+    # the statistics are sorted in the descending order
+    summary = profiler.summary(sort_by='activation_bytes')
+    assert [s['name'] for s in summary][-1] == 'head'
+    report = profiler.report(max_rows=2)
+    assert len(report.splitlines()) == 4
+    assert 'Peak mem MB' in report
+
+    # every call of the model encloses the calls of its children in order
+    assert len(trace_events) == 9
+    for i in range(3):
+        model_event = [e for e in trace_events if e['name'] == 'ExampleModel'][i]
+        children = [e for e in trace_events if e['tid'] == 1][2 * i:2 * i + 2]
+        assert [e['name'] for e in children] == ['stem', 'head']
+        assert children[0]['ts'] + children[0]['dur'] <= children[1]['ts']
+        for child in children:
+            assert model_event['ts'] <= child['ts']
+            assert child['ts'] + child['dur'] <= model_event['ts'] + model_event['dur']
+
+
+def test_module_profiler_hook():
+    model = ExampleModel()
+    img = torch.rand(1, 3, 8, 8)
+    hook = ModuleProfilerHook(depth=1, start_iter=1, num_iters=2)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runner = MagicMock()
+        runner.model = model
+        runner.work_dir = tmp_dir
+        for i in range(4):
+            runner.iter = i
+            hook.before_train_iter(runner)
+            model(img)
+            hook.after_train_iter(runner)
+        hook.after_run(runner)
+
+        # the iterations 1 and 2 are profiled
+        assert hook.profiler is None
+        assert len(model._forward_pre_hooks) == 0
+        runner.logger.info.assert_called_once()
+        with open(osp.join(tmp_dir, 'module_profile.json')) as in_file:
+            trace_events = json.load(in_file)['traceEvents']
+        assert len(trace_events) == 2 * 3
+
+    # only the master rank is profiled
+    with patch('mmcv.runner.dist_utils.get_dist_info', return_value=(1, 2)):
+        runner = MagicMock()
+        runner.model = model
+        runner.iter = 1
+        hook.before_train_iter(runner)
+        assert hook.profiler is None
@@ -36,3 +36,31 @@ def test_ohem_sampler():
     assert seg_weight.shape[0] == seg_logit.shape[0]
     assert seg_weight.shape[1:] == seg_logit.shape[2:]
     assert seg_weight.sum() == 200
+
+
+def test_max_pooling_sampler():
+    from mmseg.core.seg.sampler import MaxPoolingPixelSampler
+
+    try:
+        ref_sampler = MaxPoolingPixelSampler(ratio=0.3, p=1.7, backend='ext')
+    except ImportError:
+        pytest.skip('the reference extension is not built')
+    sampler = MaxPoolingPixelSampler(ratio=0.3, p=1.7)
+
+    torch.manual_seed(0)
+    for _ in range(5):
+        losses = torch.rand(2, 17, 23) ** 2
+        valid_mask = torch.rand(2, 17, 23) > 0.2
+        losses = torch.where(valid_mask & (losses > 0.01), losses, torch.zeros_like(losses))
+
+        ref_weight = ref_sampler(losses, valid_mask=valid_mask)
+        seg_weight = sampler(losses, valid_mask=valid_mask)
+        assert seg_weight.shape == losses.shape
+        assert torch.allclose(seg_weight, ref_weight, rtol=1e-4, atol=1e-5)
+
+    # every image is pooled independently
+    sampler = MaxPoolingPixelSampler(ratio=0.3, p=1.7, per_image=True)
+    seg_weight = sampler(losses, valid_mask=valid_mask)
+    single_weight = MaxPoolingPixelSampler(ratio=0.3, p=1.7)(losses[:1], valid_mask=valid_mask[:1])
+    assert torch.allclose(seg_weight[:1], single_weight)
+    assert (seg_weight[~valid_mask] == 0).all()
@@ -1,6 +1,13 @@
 import argparse
+import copy
+import itertools
+import platform
+import resource
 import time
+import warnings
 
+import mmcv
+import numpy as np
 import torch
 from mmcv import Config
 from mmcv.parallel import MMDataParallel
@@ -8,18 +15,204 @@ from mmcv.runner import load_checkpoint, wrap_fp16_model
 
 from mmseg.datasets import build_dataloader, build_dataset
 from mmseg.models import build_segmentor
+from mmseg.parallel import MMDataCPU
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='MMSeg benchmark a model')
     parser.add_argument('config', help='test config file path')
-    parser.add_argument('checkpoint', help='checkpoint file')
+    parser.add_argument(
+        'checkpoint', nargs='?', default=None,
+        help='checkpoint file, the model is randomly initialized if omitted')
+    parser.add_argument(
+        '--device',
+        choices=['cuda', 'cpu'],
+        default='cuda' if torch.cuda.is_available() else 'cpu',
+        help='device to run the model on')
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[1],
+        help='batch sizes to benchmark')
+    parser.add_argument(
+        '--img-scales', nargs='+', default=None,
+        help='img_scale of the test pipeline to benchmark, e.g. 2048x1024. '
+        'The scale of the config is used if omitted')
+    parser.add_argument(
+        '--modes', nargs='+', choices=['whole', 'slide'], default=None,
+        help='test modes to benchmark, the mode of the config if omitted')
+    parser.add_argument(
+        '--threads', type=int, nargs='+', default=None,
+        help='numbers of intra-op threads to benchmark')
+    parser.add_argument(
+        '--num-iters', type=int, default=200,
+        help='number of measured iterations of every setting')
+    parser.add_argument(
+        '--num-warmup', type=int, default=5,
+        help='number of skipped first iterations of every setting')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of data loading workers, the one of the config if '
+        'omitted')
+    parser.add_argument('--out', help='output json file with the results')
     parser.add_argument(
         '--log-interval', type=int, default=50, help='interval of logging')
     args = parser.parse_args()
     return args
 
 
+def parse_img_scale(img_scale):
+    values = tuple(int(x) for x in img_scale.split('x'))
+    assert len(values) == 2, f'img_scale should be WxH, but got {img_scale}'
+    return values
+
+
+def set_img_scale(pipeline, img_scale):
+    """Set a single test scale without flipping in the test pipeline."""
+
+    pipeline = copy.deepcopy(pipeline)
+    for transform in pipeline:
+        if transform['type'] == 'MultiScaleFlipAug':
+            transform['img_scale'] = img_scale
+            transform.pop('img_ratios', None)
+            transform['flip'] = False
+
+    return pipeline
+
+
+def synchronize(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process to its current RSS.
+
+    Returns:
+        bool: Whether the peak RSS was reset, it is supported on Linux only.
+    """
+
+    try:
+        # writing 5 to clear_refs resets VmHWM of /proc/self/status
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def read_peak_rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                # the value is in kilobytes
+                return int(line.split()[1]) / 1024.0
+
+    return None
+
+
+def peak_memory(device, rss_reset):
+    """Get the peak memory of the setting.
+
+    If the peak RSS was reset before the setting, it is reported as
+    ``peak_rss_mb``. Otherwise only the peak RSS over the lifetime of the
+    process is known, so it is reported as ``max_process_rss_mb``.
+    """
+
+    memory = dict()
+    peak_rss_mb = read_peak_rss_mb() if rss_reset else None
+    if peak_rss_mb is not None:
+        memory['peak_rss_mb'] = peak_rss_mb
+    else:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        rss_scale = 1.0 if platform.system() == 'Darwin' else 1024.0
+        memory['max_process_rss_mb'] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale / 1024 ** 2
+    if device == 'cuda':
+        memory['peak_cuda_mem_mb'] = torch.cuda.max_memory_allocated() / 1024 ** 2
+
+    return memory
+
+
+def summarize(values):
+    values = np.array(values) * 1000.0
+    return dict(
+        mean=float(values.mean()),
+        p50=float(np.percentile(values, 50)),
+        p90=float(np.percentile(values, 90)),
+        p99=float(np.percentile(values, 99)))
+
+
+def run_setting(model, data_loader, device, num_iters, num_warmup,
+                log_interval):
+    """Run the model on the batches of the data loader and time the stages.
+
+    Every iteration is split into data loading (including the transfer to
+    the device), forward (the backbone, the heads and the rescale of the
+    logits) and post-processing (the argmax and the copy of the labels to
+    the host).
+    """
+
+    segmentor = model.module
+    data_times, forward_times, post_times, batch_sizes = [], [], [], []
+
+    data_iter = iter(data_loader)
+    for i in range(num_iters + num_warmup):
+        start_time = time.perf_counter()
+        try:
+            data = next(data_iter)
+        except StopIteration:
+            data_iter = iter(data_loader)
+            data = next(data_iter)
+
+        if isinstance(model, MMDataCPU):
+            _, kwargs = model.scatter((), data)
+        else:
+            _, kwargs = model.scatter((), data, model.device_ids)
+        img = kwargs[0]['img'][0]
+        img_metas = kwargs[0]['img_metas'][0]
+        # the predictions of a batch are rescaled to one original shape
+        for img_meta in img_metas[1:]:
+            img_meta['ori_shape'] = img_metas[0]['ori_shape']
+        synchronize(device)
+        data_time = time.perf_counter()
+
+        with torch.no_grad():
+            seg_logit = segmentor.inference(img, img_metas, rescale=True)
+            synchronize(device)
+            forward_time = time.perf_counter()
+
+            seg_pred = segmentor._seg_pred_to_numpy(seg_logit.argmax(dim=1))
+            synchronize(device)
+            post_time = time.perf_counter()
+
+        if i < num_warmup:
+            continue
+
+        data_times.append(data_time - start_time)
+        forward_times.append(forward_time - data_time)
+        post_times.append(post_time - forward_time)
+        batch_sizes.append(len(seg_pred))
+
+        done_iters = i + 1 - num_warmup
+        if done_iters % log_interval == 0:
+            fps = sum(batch_sizes) / (sum(forward_times) + sum(post_times))
+            print(f'Done batch [{done_iters:<3}/ {num_iters}], '
+                  f'fps: {fps:.2f} img / s')
+
+    latencies = [f + p for f, p in zip(forward_times, post_times)]
+    num_images = sum(batch_sizes)
+    return dict(
+        num_iters=num_iters,
+        num_images=num_images,
+        latency_ms=summarize(latencies),
+        throughput=num_images / sum(latencies),
+        end_to_end_throughput=num_images / (sum(latencies) + sum(data_times)),
+        time_breakdown_ms=dict(
+            data=summarize(data_times),
+            forward=summarize(forward_times),
+            postprocess=summarize(post_times)))
+
+
 def main():
     args = parse_args()
 
@@ -29,56 +222,81 @@ def main():
     cfg.model.pretrained = None
     cfg.data.test.test_mode = True
 
-    # build the dataloader
-    # TODO: support multiple images per gpu (only minor changes are needed)
-    dataset = build_dataset(cfg.data.test)
-    data_loader = build_dataloader(
-        dataset,
-        samples_per_gpu=1,
-        workers_per_gpu=cfg.data.workers_per_gpu,
-        dist=False,
-        shuffle=False)
-
     # build the model and load checkpoint
     cfg.model.train_cfg = None
     model = build_segmentor(cfg.model, test_cfg=cfg.get('test_cfg'))
     fp16_cfg = cfg.get('fp16', None)
     if fp16_cfg is not None:
         wrap_fp16_model(model)
-    load_checkpoint(model, args.checkpoint, map_location='cpu')
-
-    model = MMDataParallel(model, device_ids=[0])
+    if args.checkpoint is not None:
+        load_checkpoint(model, args.checkpoint, map_location='cpu')
 
+    if args.device == 'cuda':
+        model = MMDataParallel(model, device_ids=[0])
+    else:
+        model = MMDataCPU(model)
     model.eval()
 
-    # the first several iterations may be very slow so skip them
-    num_warmup = 5
-    pure_inf_time = 0
-    total_iters = 200
+    test_cfg = model.module.test_cfg
+    img_scales = [None] if args.img_scales is None else [parse_img_scale(s) for s in args.img_scales]
+    modes = [test_cfg.mode] if args.modes is None else args.modes
+    threads = [torch.get_num_threads()] if args.threads is None else args.threads
+    workers = cfg.data.workers_per_gpu if args.workers is None else args.workers
 
-    # benchmark with 200 image and take the average
-    for i, data in enumerate(data_loader):
+    results = []
+    for img_scale, mode, num_threads, batch_size in itertools.product(
+            img_scales, modes, threads, args.batch_sizes):
+        if mode == 'slide' and ('crop_size' not in test_cfg or 'stride' not in test_cfg):
+            warnings.warn('The slide mode requires crop_size and stride in test_cfg, skipping it')
+            continue
 
-        torch.cuda.synchronize()
-        start_time = time.perf_counter()
+        setting = dict(
+            batch_size=batch_size,
+            img_scale=img_scale,
+            mode=mode,
+            threads=num_threads)
+        print(f'Benchmarking {setting}')
 
-        with torch.no_grad():
-            model(return_loss=False, rescale=True, **data)
+        dataset_cfg = copy.deepcopy(cfg.data.test)
+        if img_scale is not None:
+            dataset_cfg.pipeline = set_img_scale(dataset_cfg.pipeline, img_scale)
+        dataset = build_dataset(dataset_cfg)
+        data_loader = build_dataloader(
+            dataset,
+            samples_per_gpu=batch_size,
+            workers_per_gpu=workers,
+            dist=False,
+            shuffle=False,
+            pin_memory=args.device == 'cuda')
 
-        torch.cuda.synchronize()
-        elapsed = time.perf_counter() - start_time
-
-        if i >= num_warmup:
-            pure_inf_time += elapsed
-            if (i + 1) % args.log_interval == 0:
-                fps = (i + 1 - num_warmup) / pure_inf_time
-                print(f'Done image [{i + 1:<3}/ {total_iters}], '
-                      f'fps: {fps:.2f} img / s')
-
-        if (i + 1) == total_iters:
-            fps = (i + 1 - num_warmup) / pure_inf_time
-            print(f'Overall fps: {fps:.2f} img / s')
-            break
+        test_cfg.mode = mode
+        torch.set_num_threads(num_threads)
+        if args.device == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+        rss_reset = reset_peak_rss()
+
+        result = run_setting(model, data_loader, args.device, args.num_iters,
+                             args.num_warmup, args.log_interval)
+        result.update(setting)
+        result.update(peak_memory(args.device, rss_reset))
+        results.append(result)
+
+        print(f'Overall fps: {result["throughput"]:.2f} img / s, '
+              f'latency p50/p90/p99: {result["latency_ms"]["p50"]:.1f} / '
+              f'{result["latency_ms"]["p90"]:.1f} / '
+              f'{result["latency_ms"]["p99"]:.1f} ms')
+
+    if args.out is not None:
+        mmcv.dump(
+            dict(
+                config=args.config,
+                checkpoint=args.checkpoint,
+                device=args.device,
+                device_name=torch.cuda.get_device_name(0) if args.device == 'cuda' else platform.processor(),
+                torch_version=torch.__version__,
+                results=results),
+            args.out,
+            indent=4)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+# Copyright (C) 2021 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import argparse
+import os.path as osp
+from functools import partial
+from multiprocessing import Pool
+
+import mmcv
+import numpy as np
+from mmcv import Config
+
+from mmseg.datasets import build_dataset
+
+# offsets of the arrays in the shard are aligned to the cache line size
+ALIGNMENT = 64
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pack a dataset split into one memory mappable shard')
+    parser.add_argument('config', help='config file of the dataset')
+    parser.add_argument('out_dir', help='output path')
+    parser.add_argument(
+        '--split',
+        default='train',
+        choices=['train', 'val', 'test'],
+        help='dataset split in the config to pack')
+    parser.add_argument(
+        '--name', help='name of the packed split, the split by default')
+    parser.add_argument(
+        '--color-type',
+        default='color',
+        choices=['color', 'grayscale', 'unchanged'],
+        help='flag used to decode the images')
+    parser.add_argument(
+        '--no-ann', action='store_true', help='do not pack the seg maps')
+    parser.add_argument(
+        '--nproc', default=1, type=int, help='number of process')
+    args = parser.parse_args()
+
+    return args
+
+
+def decode_sample(img_info, img_dir, ann_dir, color_type):
+    img = mmcv.imread(
+        osp.join(img_dir, img_info['filename']), flag=color_type)
+
+    gt_semantic_seg = None
+    if ann_dir is not None and 'ann' in img_info:
+        gt_semantic_seg = mmcv.imread(
+            osp.join(ann_dir, img_info['ann']['seg_map']),
+            flag='unchanged',
+            backend='pillow').squeeze().astype(np.uint8)
+
+    return img_info, img, gt_semantic_seg
+
+
+def write_array(out_file, array):
+    offset = out_file.tell()
+    padding = -offset % ALIGNMENT
+    out_file.write(b'\0' * padding)
+    offset += padding
+
+    array = np.ascontiguousarray(array)
+    out_file.write(array.tobytes())
+
+    return dict(offset=offset, shape=list(array.shape), dtype=array.dtype.str)
+
+
+def pack_dataset(dataset,
+                 out_dir,
+                 name,
+                 with_ann=True,
+                 color_type='color',
+                 nproc=1):
+    """Decode the samples of a dataset into one shard and its index file.
+
+    Args:
+        dataset (CustomDataset): Dataset to pack, with img_infos, img_dir
+            and ann_dir.
+        out_dir (str): Directory to write ``{name}.bin`` and
+            ``{name}.json`` to.
+        name (str): Name of the packed split.
+        with_ann (bool): Whether to pack the seg maps. Default: True.
+        color_type (str): Flag used to decode the images. Default: 'color'.
+        nproc (int): Number of decoding processes. Default: 1.
+    """
+    ann_dir = dataset.ann_dir if with_ann else None
+    mmcv.mkdir_or_exist(out_dir)
+
+    decode = partial(
+        decode_sample,
+        img_dir=dataset.img_dir,
+        ann_dir=ann_dir,
+        color_type=color_type)
+
+    samples = []
+    prog_bar = mmcv.ProgressBar(len(dataset.img_infos))
+    with open(osp.join(out_dir, f'{name}.bin'), 'wb') as out_file:
+        if nproc > 1:
+            pool = Pool(nproc)
+            decoded = pool.imap(decode, dataset.img_infos, chunksize=8)
+        else:
+            pool = None
+            decoded = map(decode, dataset.img_infos)
+
+        for img_info, img, gt_semantic_seg in decoded:
+            sample = dict(
+                filename=img_info['filename'],
+                img=write_array(out_file, img))
+            if gt_semantic_seg is not None:
+                sample['seg_map'] = img_info['ann']['seg_map']
+                sample['ann'] = write_array(out_file, gt_semantic_seg)
+            samples.append(sample)
+            prog_bar.update()
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    mmcv.dump(
+        dict(shard=f'{name}.bin', samples=samples),
+        osp.join(out_dir, f'{name}.json'))
+
+
+def main():
+    args = parse_args()
+
+    cfg = Config.fromfile(args.config)
+    dataset = build_dataset(cfg.data[args.split])
+    # unwrap RepeatDataset
+    while hasattr(dataset, 'dataset'):
+        dataset = dataset.dataset
+
+    pack_dataset(
+        dataset,
+        args.out_dir,
+        args.name if args.name else args.split,
+        with_ann=not args.no_ann,
+        color_type=args.color_type,
+        nproc=args.nproc)
+
+    print('\nDone!')
+
+
+if __name__ == '__main__':
+    main()
@@ -43,12 +43,20 @@ def _convert_batchnorm(module):
     return module_output
 
 
-def parse_args():
+def parse_args(args=None):
     parser = argparse.ArgumentParser(description='Export the MMSeg model to ONNX/IR')
     parser.add_argument('config', help='test config file path')
     parser.add_argument('checkpoint', help="path to file with model's weights")
     parser.add_argument('output_dir', help='path to directory to save exported models in')
     parser.add_argument('--opset', type=int, default=11, help='ONNX opset')
+    parser.add_argument('--output', choices=['logits', 'labels'], default='logits',
+                        help='output the class probabilities or the labels computed in the graph')
+    parser.add_argument('--with-confidence', action='store_true',
+                        help='output the top-1 probabilities along with the labels')
+    parser.add_argument('--label-dtype', choices=['uint8', 'int32'], default=None,
+                        help='data type of the output labels, uint8 if the number of classes allows it')
+    parser.add_argument('--static-shape', action='store_true',
+                        help='export the ONNX model with the fixed batch and spatial axes')
     parser.add_argument('--cfg-options', nargs='+', action=DictAction,
                         help='Override some settings in the used config, the key-value pair '
                              'in xxx=yyy format will be merged into config file. If the value to '
@@ -64,7 +72,11 @@ def parse_args():
     parser_openvino.add_argument('--input-format', choices=['BGR', 'RGB'], default='BGR',
                                  help='Input image format for exported model.')
 
-    return parser.parse_args()
+    args = parser.parse_args(args)
+    if args.with_confidence and args.output != 'labels':
+        parser.error('--with-confidence requires --output labels')
+
+    return args
 
 
 def main(args):
@@ -88,7 +100,10 @@ def main(args):
                  args.output_dir,
                  target=args.target,
                  onnx_opset=args.opset,
-                 output_logits=True,
+                 output_logits=args.output == 'logits',
+                 output_confidence=args.with_confidence,
+                 label_dtype=args.label_dtype,
+                 dynamic_shape=not args.static_shape,
                  input_format=args.input_format)
 
 
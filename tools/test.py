@@ -7,6 +7,7 @@
 
 import argparse
 import os
+import warnings
 
 import mmcv
 import torch
@@ -18,7 +19,7 @@ from mmcv.utils import DictAction
 from mmseg.apis import multi_gpu_test, single_gpu_test
 from mmseg.datasets import build_dataloader, build_dataset
 from mmseg.models import build_segmentor
-from mmseg.core.utils import propagate_root_dir
+from mmseg.core.utils import optimize_for_inference, propagate_root_dir
 
 
 def parse_args():
@@ -57,6 +58,15 @@ def parse_args():
                         help='job launcher')
     parser.add_argument('--opacity', type=float, default=0.5,
                         help='Opacity of painted segmentation map. In (0, 1] range.')
+    parser.add_argument('--profile-depth', type=int,
+                        help='profile the modules up to this depth and print the report')
+    parser.add_argument('--profile-trace',
+                        help='Chrome trace file of the profiled modules')
+    parser.add_argument('--optimize', action='store_true',
+                        help='fold the BN layers into the convolutions and remove the dropout layers '
+                             'before testing')
+    parser.add_argument('--channels-last', action='store_true',
+                        help='convert the optimized model to the channels-last memory format')
     parser.add_argument('--local_rank', type=int, default=0)
     args = parser.parse_args()
 
@@ -127,9 +137,6 @@ def main():
     # build the model and load checkpoint
     cfg.model.train_cfg = None
     model = build_segmentor(cfg.model, test_cfg=cfg.get('test_cfg'))
-    fp16_cfg = cfg.get('fp16', None)
-    if fp16_cfg is not None:
-        wrap_fp16_model(model)
     checkpoint = load_checkpoint(model, args.checkpoint, map_location='cpu')
     if 'CLASSES' in checkpoint.get('meta', {}):
         model.CLASSES = checkpoint['meta']['CLASSES']
@@ -142,10 +149,34 @@ def main():
         print('"PALETTE" not found in meta, use dataset.PALETTE instead')
         model.PALETTE = dataset.PALETTE
 
+    if args.optimize:
+        if torch.cuda.is_available():
+            model = model.cuda()
+        img_scale = cfg.data.test.pipeline[1]['img_scale']
+        model = optimize_for_inference(model,
+                                       input_shape=(1, 3, img_scale[1], img_scale[0]),
+                                       channels_last=args.channels_last)
+    fp16_cfg = cfg.get('fp16', None)
+    if fp16_cfg is not None:
+        wrap_fp16_model(model)
+
     efficient_test = False
     if args.eval_options is not None:
         efficient_test = args.eval_options.get('efficient_test', False)
 
+    # the predictions are only needed if they are dumped, formatted or
+    # evaluated with the cityscapes protocol, otherwise reduce them on the fly
+    pre_eval = bool(args.eval) and not (args.out or args.format_only or efficient_test) and \
+        'cityscapes' not in args.eval
+
+    profiler_cfg = None
+    if args.profile_depth is not None:
+        if distributed:
+            warnings.warn('--profile-depth is not supported in the distributed mode, '
+                          'the modules are not profiled')
+        else:
+            profiler_cfg = dict(depth=args.profile_depth, trace_file=args.profile_trace)
+
     if not distributed:
         model = MMDataParallel(model, device_ids=[0])
         outputs = single_gpu_test(
@@ -154,7 +185,9 @@ def main():
             args.show,
             args.show_dir,
             efficient_test,
-            args.opacity
+            args.opacity,
+            pre_eval=pre_eval,
+            profiler_cfg=profiler_cfg
         )
     else:
         model = MMDistributedDataParallel(
@@ -167,7 +200,8 @@ def main():
             data_loader,
             args.tmpdir,
             args.gpu_collect,
-            efficient_test
+            efficient_test,
+            pre_eval=pre_eval
         )
 
     rank, _ = get_dist_info()
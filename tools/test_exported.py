@@ -18,8 +18,11 @@
 
 import sys
 import argparse
+import threading
+import time
 
 import mmcv
+import numpy as np
 import torch
 from openvino.inference_engine import IECore  # pylint: disable=no-name-in-module
 from mmcv.utils import DictAction
@@ -41,21 +44,105 @@ def update_config(cfg):
     return cfg
 
 
-def collect_results(model, data_loader):
-    results = []
-    progress_bar = mmcv.ProgressBar(len(data_loader.dataset))
-
+def to_seg_map(output, img_meta):
+    """Convert the output of the model to the label map of the original image."""
+
+    # the output is either the labels (1, 1, H, W) or the probabilities (1, C, H, W)
+    output = output[0]
+    seg_map = output.argmax(axis=0) if output.shape[0] > 1 else output[0]
+    seg_map = seg_map.astype(np.uint8) if seg_map.max() < 256 else seg_map.astype(np.int32)
+
+    # crop the padding and restore the original resolution
+    img_h, img_w = img_meta['img_shape'][:2]
+    seg_map = seg_map[:img_h, :img_w]
+    ori_h, ori_w = img_meta['ori_shape'][:2]
+    if seg_map.shape != (ori_h, ori_w):
+        seg_map = mmcv.imresize(seg_map, (ori_w, ori_h), interpolation='nearest')
+
+    return seg_map
+
+
+class StreamingEvaluator:
+    """Scores the outputs of the completed requests against the ground truth.
+
+    The callbacks are run by the threads of the inference engine, so only
+    the confusion matrix counts of the dataset are accumulated. The label
+    maps are collected instead if ``collect_results`` is set, e.g. for the
+    Cityscapes protocol, which evaluates the per-image results.
+    """
+
+    def __init__(self, dataset, with_metrics=True, collect_results=False):
+        self.dataset = dataset
+        self.with_metrics = with_metrics
+        self.collect_results = collect_results
+        self.accumulator = None
+        self.results = None
+        if with_metrics and collect_results:
+            self.results = [None] * len(dataset)
+        elif with_metrics:
+            self.accumulator = dataset.pre_eval([], [])
+        self.num_completed = 0
+        self.exceptions = []
+        self._lock = threading.Lock()
+
+    def __call__(self, output, index, img_meta):
+        try:
+            if self.with_metrics:
+                seg_map = to_seg_map(output, img_meta)
+                if self.collect_results:
+                    self.results[index] = seg_map
+                else:
+                    gt_seg_map = self.dataset.get_gt_seg_map_by_idx(index)
+                    with self._lock:
+                        self.accumulator.update(seg_map, gt_seg_map)
+            with self._lock:
+                self.num_completed += 1
+        except Exception as e:
+            self.exceptions.append(e)
+
+    def check(self):
+        if self.exceptions:
+            raise self.exceptions[0]
+
+
+def evaluate_async(model, data_loader, with_metrics=True, collect_results=False):
+    """Infer the dataset with all requests of the model in flight.
+
+    Returns:
+        tuple[ConfusionMatrixAccumulator | list | None, dict]: The accumulated
+            confusion matrix, or the label maps if ``collect_results`` is set,
+            and the throughput statistics.
+    """
+
+    dataset = data_loader.dataset
+    evaluator = StreamingEvaluator(dataset, with_metrics, collect_results)
+    progress_bar = mmcv.ProgressBar(len(dataset))
+
+    index = 0
+    start_time = time.perf_counter()
     for data in data_loader:
         input_data = data['img'][0].cpu().numpy()
-        result = model(input_data)
+        img_metas = data['img_metas'][0].data[0]
+        for sample, img_meta in zip(input_data, img_metas):
+            model.infer_async(sample[None], evaluator, (index, img_meta))
+            evaluator.check()
+            index += 1
+            progress_bar.update()
 
-        results.extend(result.squeeze(axis=0))
+    model.wait_all()
+    elapsed_time = time.perf_counter() - start_time
+    evaluator.check()
+    assert evaluator.num_completed == index
 
-        batch_size = len(input_data)
-        for _ in range(batch_size):
-            progress_bar.update()
+    stats = dict(
+        num_images=index,
+        num_requests=model.num_requests,
+        total_time_s=elapsed_time,
+        throughput=index / elapsed_time)
 
-    return results
+    results = evaluator.results if collect_results else evaluator.accumulator
+
+    return results, stats
 
 
 def load_ie_core(device='CPU', cpu_extension=None):
@@ -73,19 +160,23 @@ class IEModel:
         self.net = ie_core.read_network(model_path + ".xml", model_path + ".bin")
         assert len(self.net.input_info) == 1, "One input is expected"
 
+        # num_requests=0 creates the optimal number of requests for the device
         self.exec_net = ie_core.load_network(
             network=self.net, device_name=device, num_requests=num_requests
         )
 
         self.input_name = next(iter(self.net.input_info))
         if len(self.net.outputs) > 1:
-            raise Exception("One output is expected")
+            # the labels are evaluated, the confidence output is skipped
+            if 'output' not in self.net.outputs:
+                raise Exception("The 'output' output is expected")
+            self.output_name = 'output'
         else:
             self.output_name = next(iter(self.net.outputs))
 
         self.input_size = self.net.input_info[self.input_name].input_data.shape
         self.output_size = self.exec_net.requests[0].output_blobs[self.output_name].buffer.shape
-        self.num_requests = num_requests
+        self.num_requests = len(self.exec_net.requests)
 
     def infer(self, data):
         input_data = {self.input_name: data}
@@ -93,6 +184,29 @@ class IEModel:
 
         return infer_result[self.output_name]
 
+    def infer_async(self, data, callback, callback_args=()):
+        """Start the inference on an idle request, waiting for one if all are busy.
+
+        ``callback(output, *callback_args)`` is called from a thread of the
+        inference engine when the request is completed.
+        """
+
+        request_id = self.exec_net.get_idle_request_id()
+        while request_id < 0:
+            self.exec_net.wait(num_requests=1)
+            request_id = self.exec_net.get_idle_request_id()
+
+        request = self.exec_net.requests[request_id]
+
+        def _completion_callback(status, _):
+            callback(request.output_blobs[self.output_name].buffer, *callback_args)
+
+        request.set_completion_callback(_completion_callback)
+        request.async_infer({self.input_name: data})
+
+    def wait_all(self):
+        self.exec_net.wait()
+
 
 class Segmentor(IEModel):
     def __init__(self, model_path, ie_core, device='CPU', num_requests=1):
@@ -125,16 +239,22 @@ def main(args):
     )
 
     # load model
-    ie_core = load_ie_core()
-    model = Segmentor(args.model, ie_core)
+    ie_core = load_ie_core(args.device)
+    model = Segmentor(args.model, ie_core, args.device, args.num_requests)
+
+    # infer the dataset and score the outputs on the fly, the Cityscapes
+    # protocol needs the label maps of all images
+    collect_results = bool(args.eval) and 'cityscapes' in args.eval
+    results, stats = evaluate_async(model, data_loader, with_metrics=bool(args.eval),
+                                    collect_results=collect_results)
 
-    # collect results
-    outputs = collect_results(model, data_loader)
+    print(f'\nProcessed {stats["num_images"]} images in {stats["total_time_s"]:.2f} s '
+          f'with {stats["num_requests"]} requests, throughput: {stats["throughput"]:.2f} img / s')
 
     # get metrics
     eval_kwargs = {} if args.eval_options is None else args.eval_options
     if args.eval:
-        dataset.evaluate(outputs, args.eval, show_log=True, **eval_kwargs)
+        dataset.evaluate(results, args.eval, show_log=True, **eval_kwargs)
 
 
 def parse_args():
@@ -143,6 +263,11 @@ def parse_args():
     parser.add_argument('model', help='path to onnx model file or xml file in case of OpenVINO.')
     parser.add_argument('--data_dir', type=str,
                         help='the dir with dataset')
+    parser.add_argument('--device', type=str, default='CPU',
+                        help='device to run the inference on, e.g. CPU or GPU')
+    parser.add_argument('--num-requests', type=int, default=0,
+                        help='number of asynchronous inference requests, 0 selects the optimal number '
+                             'for the device')
     parser.add_argument('--eval', type=str, nargs='+',
                         help='evaluation metrics, which depends on the dataset, e.g., "mIoU"'
                              ' for generic datasets, and "cityscapes" for Cityscapes')